@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+"""
+Benchmarks of the conversion of PW XML inputs to Fortran inputs on the
+fixtures of tests/resources/pw, comparing the conversion plan used by
+get_fortran_input with a full walk of the input subtree, that decodes
+every element and looks up every path in the converter maps, and of a
+parameter sweep with iter_fortran_inputs, that decodes again only the
+overridden elements, compared with a get_fortran_input for each point.
+Also benchmarks the formatting of the cards of positions, forces and
+k-points, with lists of many atoms and k-points.
+"""
+import glob
+import itertools
+
+import numpy as np
+
+from common import get_parser, run_benchmarks, resource, Benchmark
+
+import qeschema
+from qeschema import cards
+from qeschema.schema_cache import find_xsd_element
+from qeschema.utils import etree_iter_path
+
+
+def get_fortran_input_full_walk(document, use_defaults=True):
+    """The conversion to Fortran input with a full walk of the input subtree."""
+    qe_input = document.input_builder(xml_file=document.filename)
+    input_path = './%s' % document.input_path
+    input_root = document.find(input_path)
+
+    for schema_root in document.schema.elements.values():
+        if find_xsd_element(schema_root, input_path) is not None:
+            break
+
+    for elem, path in etree_iter_path(input_root, path=input_path):
+        rel_path = path.replace(input_path, '.')
+        xsd_element = find_xsd_element(schema_root, path)
+        if xsd_element is None:
+            continue
+
+        value = xsd_element.decode(elem, use_defaults=use_defaults)
+        if isinstance(value, str):
+            value = value.strip()
+        node_dict = {elem.tag: value}
+
+        for attr_name in elem.attrib:
+            path_key = '%s/@%s' % (rel_path, attr_name)
+            if path_key in qe_input:
+                qe_input.set_path(path_key, elem.tag, node_dict)
+
+        path_key = '%s/$' % rel_path if xsd_element.attributes else rel_path
+        if path_key in qe_input:
+            qe_input.set_path(path_key, elem.tag, node_dict)
+
+    return qe_input.get_qe_input()
+
+
+def iter_documents():
+    for filename in sorted(glob.glob(resource('pw/*.xml'))):
+        try:
+            document = qeschema.PwDocument(filename)
+            document.get_fortran_input()
+        except Exception:
+            continue  # Output-only fixtures
+        yield filename.rpartition('/')[2], document
+
+
+SWEEP_GRID = {
+    'input/basis/ecutwfc': [20, 25, 30, 35, 40],
+    'input/bands/smearing/@degauss': [0.01, 0.02],
+    'input/electron_control/mixing_beta': [0.3, 0.5],
+}
+
+
+def get_fortran_inputs_sweep(document, grid):
+    """A parameter sweep that edits the XML data and converts the whole input."""
+    inputs = []
+    for values in itertools.product(*grid.values()):
+        for path, value in zip(grid, values):
+            elem_path, _, attr_name = path.partition('/@')
+            if attr_name:
+                document.find(elem_path).set(attr_name, str(value))
+            else:
+                document.find(elem_path).text = str(value)
+        inputs.append(document.get_fortran_input())
+    return inputs
+
+
+def get_cards_arguments(size):
+    """Returns the arguments of the cards for a synthetic input with *size* atoms and k-points."""
+    coords = np.linspace(-10.0, 10.0, 3 * size).reshape(size, 3).tolist()
+    atoms = [{'@name': 'Al' if k % 4 else 'H', '$': coords[k]} for k in range(size)]
+    free_positions = [1] * (3 * size)
+    free_positions[::5] = [0] * len(free_positions[::5])
+    k_points = [{'@weight': 1.0 / size, '$': coords[k]} for k in range(size)]
+
+    return {
+        'atomic_structure': {'@nat': size, 'atomic_positions': {'atom': atoms}},
+        'free_positions': {'$': free_positions},
+        'external_atomic_forces': np.linspace(-0.1, 0.1, 3 * size).tolist(),
+        'atomic_positions': {'atom': atoms},
+        'k_points_IBZ': {'nk': size, 'k_point': k_points},
+        'images': [{'@nat': size, 'atomic_positions': {'atom': atoms}}] * 3,
+    }
+
+
+def iter_benchmarks(documents, args):
+    for size in args.scales:
+        group = 'Cards (%d rows)' % size
+        kwargs = get_cards_arguments(size)
+        yield Benchmark(group, 'ATOMIC_POSITIONS', lambda x=kwargs: cards.
+                        get_atomic_positions_cell_card('ATOMIC_POSITIONS', **x), size)
+        yield Benchmark(group, 'ATOMIC_FORCES', lambda x=kwargs: cards.
+                        get_atomic_forces_card('ATOMIC_FORCES', **x), size)
+        yield Benchmark(group, 'K_POINTS', lambda x=kwargs: cards.
+                        get_k_points_card('K_POINTS', **x), size)
+        yield Benchmark(group, 'NEB positions (3 images)', lambda x=kwargs: cards.
+                        get_neb_images_positions_card(
+                            'ATOMIC_POSITIONS', atomic_structure=x['images'],
+                            free_positions=x['free_positions']), size)
+
+    document = qeschema.PwDocument(resource('pw/Al001_relax_bfgs.xml'))
+    group = 'Parameter sweep (%d inputs)' % len(list(itertools.product(*SWEEP_GRID.values())))
+    yield Benchmark(group, 'iter_fortran_inputs',
+                    lambda: list(document.iter_fortran_inputs(SWEEP_GRID)))
+    yield Benchmark(group, 'get_fortran_input for each point',
+                    lambda: get_fortran_inputs_sweep(document, SWEEP_GRID))
+
+    group = 'Fortran input of all fixtures (%d files)' % len(documents)
+    yield Benchmark(group, 'conversion plan',
+                    lambda: [d.get_fortran_input() for _, d in documents])
+    yield Benchmark(group, 'full walk',
+                    lambda: [get_fortran_input_full_walk(d) for _, d in documents])
+
+    for name, document in documents:
+        group = 'Fortran input (%s)' % name
+        yield Benchmark(group, 'conversion plan', document.get_fortran_input)
+        yield Benchmark(group, 'full walk', lambda d=document: get_fortran_input_full_walk(d))
+
+
+def main():
+    args = get_parser(__doc__).parse_args()
+    documents = list(iter_documents())
+    for name, document in documents:
+        if document.get_fortran_input() != get_fortran_input_full_walk(document):
+            print("Warning: different conversions for %r" % name)
+
+    results = run_benchmarks(iter_benchmarks(documents, args), args)
+
+    times = {}
+    for result in results:
+        times.setdefault(result.group, {})[result.name] = result.best
+
+    print("\nSpeedups")
+    for group, values in times.items():
+        if 'full walk' in values and 'conversion plan' in values:
+            print("  %-60s %6.2fx" % (group, values['full walk'] / values['conversion plan']))
+        elif 'iter_fortran_inputs' in values and len(values) == 2:
+            print("  %-60s %6.2fx" % (group, values['get_fortran_input for each point'] /
+                                      values['iter_fortran_inputs']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+"""
+Benchmarks of XML documents: construction, loading with each validation
+mode, conversion to Fortran input and extraction of PW output data, also
+on synthetic inputs with many atoms and many k-points, with and without
+the path index.
+"""
+import os
+import shutil
+import tempfile
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from common import get_parser, run_benchmarks, resource, scale_pw_document, Benchmark
+
+import qeschema
+
+VALIDATION_MODES = ('strict', 'lax', 'skip')
+
+# A fixture for each document type
+FORTRAN_INPUT_FIXTURES = [
+    (qeschema.PwDocument, 'pw/Al001_relax_bfgs.xml', None),
+    (qeschema.PhononDocument, 'ph/alas_ph.xml', None),
+    (qeschema.NebDocument, 'neb/H2+H.xml', 'qes_neb_test_ref.xsd'),
+    (qeschema.TdDocument, 'tddfpt/CH4.tddfpt.xml', None),
+    (qeschema.TdSpectrumDocument, 'tddfpt/CH4.tddfpt_pp.xml', None),
+    (qeschema.XSpectraDocument, 'xspectra/Cu_L23_xspectra.xml', None),
+    (qeschema.EPWDocument, 'epw/epw_test1.xml', None),
+]
+
+EXTRACTORS = [
+    'get_atomic_positions', 'get_cell_parameters', 'get_stress', 'get_forces',
+    'get_k_points', 'get_ks_eigenvalues', 'get_total_energy',
+    'get_atomic_positions_array', 'get_stress_array', 'get_forces_array',
+    'get_k_points_array', 'get_ks_eigenvalues_array',
+]
+
+
+def iter_benchmarks(args):
+    xml_file = resource('pw/Al001_relax_bfgs.xml')
+    json_file = resource('pw/Al001_relax_bfgs.json')
+    yaml_file = resource('pw/Al001_relax_bfgs.yml')
+
+    group = 'Construction'
+    yield Benchmark(group, 'PwDocument()', qeschema.PwDocument)
+    yield Benchmark(group, 'PwDocument(source)', lambda: qeschema.PwDocument(xml_file))
+
+    group = 'Loading'
+    document = qeschema.PwDocument(schema='qes_test_ref.xsd')
+    for mode in VALIDATION_MODES:
+        yield Benchmark(group, 'from_xml(validation=%r)' % mode,
+                        lambda m=mode: document.from_xml(xml_file, validation=m))
+    for mode in VALIDATION_MODES:
+        yield Benchmark(group, 'from_json(validation=%r)' % mode,
+                        lambda m=mode: document.from_json(json_file, validation=m))
+    if yaml is not None:
+        for mode in VALIDATION_MODES:
+            yield Benchmark(group, 'from_yaml(validation=%r)' % mode,
+                            lambda m=mode: document.from_yaml(yaml_file, validation=m))
+
+    group = 'Fortran input'
+    for cls, path, schema in FORTRAN_INPUT_FIXTURES:
+        document = cls(source=resource(path), schema=schema)
+        yield Benchmark(group, '%s (%s)' % (cls.__name__, path), document.get_fortran_input)
+
+    group = 'PW extractors'
+    document = qeschema.PwDocument(resource('pw/Ni.xml'))
+    for name in EXTRACTORS:
+        yield Benchmark(group, name, getattr(document, name))
+
+    group = 'PW extractors with path index'
+    document = qeschema.PwDocument(resource('pw/Ni.xml'), path_index=True)
+    for name in EXTRACTORS:
+        yield Benchmark(group, name, getattr(document, name))
+
+    # Scaled-up documents are written into temporary files, with the schema
+    # of the fixture, so the documents are complete for all the methods.
+    schema = 'qes-20180510.xsd'
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for nat in args.scales:
+            group = 'Scaled atoms (nat=%d)' % nat
+            filename = os.path.join(tmp_dir, 'Ni_nat%d.xml' % nat)
+            with open(filename, 'w') as f:
+                f.write(scale_pw_document(resource('pw/Ni.xml'), nat=nat))
+
+            document = qeschema.PwDocument(schema=schema)
+            yield Benchmark(group, 'from_xml', lambda x=filename, d=document:
+                            d.from_xml(x, validation='lax'), nat)
+            document = qeschema.PwDocument(schema=schema)
+            document.from_xml(filename, validation='skip')
+            yield Benchmark(group, 'get_fortran_input', document.get_fortran_input, nat)
+            for name in ('get_atomic_positions', 'get_forces',
+                         'get_atomic_positions_array', 'get_forces_array'):
+                yield Benchmark(group, name, getattr(document, name), nat)
+
+        for nks in args.scales:
+            group = 'Scaled k-points (nks=%d)' % nks
+            filename = os.path.join(tmp_dir, 'Ni_nks%d.xml' % nks)
+            with open(filename, 'w') as f:
+                f.write(scale_pw_document(resource('pw/Ni.xml'), nks=nks))
+
+            document = qeschema.PwDocument(schema=schema)
+            yield Benchmark(group, 'from_xml', lambda x=filename, d=document:
+                            d.from_xml(x, validation='lax'), nks)
+            document = qeschema.PwDocument(schema=schema)
+            document.from_xml(filename, validation='skip')
+            for name in ('get_k_points', 'get_ks_eigenvalues',
+                         'get_k_points_array', 'get_ks_eigenvalues_array'):
+                yield Benchmark(group, name, getattr(document, name), nks)
+            document.path_index = True
+            yield Benchmark(group, 'get_k_points_array (path index)',
+                            document.get_k_points_array, nks)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    args = get_parser(__doc__).parse_args()
+    run_benchmarks(iter_benchmarks(args), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+"""
+Benchmark of the import time of the qeschema package, measured in fresh
+interpreter processes.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('xmlschema', 'elementpath', 'numpy', 'h5py', 'yaml')
+
+# The statements to time, with the heavy modules each one is expected to load.
+# PyYAML is imported only by the YAML methods of documents.
+STATEMENTS = {
+    'import qeschema': '',
+    'import qeschema; qeschema.XmlDocumentError': '',
+    'import qeschema; qeschema.PwDocument': 'xmlschema,elementpath,numpy',
+    'import qeschema; qeschema.hdf5': 'numpy,h5py',
+}
+
+TIMER_CODE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ','.join(heavy))
+"""
+
+
+def run_statement(statement):
+    code = TIMER_CODE.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=PKG_DIR,
+                                     stderr=subprocess.DEVNULL)
+    elapsed, heavy = output.decode().split(' ')
+    return float(elapsed), heavy.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help="Number of interpreter runs for each statement.")
+    args = parser.parse_args()
+
+    print("Import times (best of %d runs):\n" % args.repeat)
+    for statement, expected in STATEMENTS.items():
+        try:
+            results = [run_statement(statement) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print("%-48s failed (missing dependency?)" % statement)
+            continue
+        best = min(x[0] for x in results)
+        heavy = results[0][1]
+        print("%-48s %8.2f ms   loaded: %s%s" % (
+            statement, best * 1000, heavy or '-',
+            '' if heavy == expected else '  (expected: %s)' % (expected or '-')
+        ))
+
+
+if __name__ == '__main__':
+    main()
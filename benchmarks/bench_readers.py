@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+"""
+Benchmarks of the readers of pseudo-potential files and of the HDF5 files
+of charge density and wavefunctions, on synthetic files of increasing size.
+"""
+import os
+import shutil
+import tempfile
+
+from common import get_parser, run_benchmarks, resource, Benchmark, \
+    write_upf_file, write_wfc_file, write_charge_file
+
+from qeschema.upf import read_pseudo_file, read_pseudo_header
+
+try:
+    from qeschema import hdf5
+except ImportError:
+    hdf5 = None
+
+
+def iter_benchmarks(args, tmp_dir):
+    group = 'UPF files'
+    filename = resource('upf/N.pz-vbc.UPF')
+    yield Benchmark(group, 'read_pseudo_file (N.pz-vbc.UPF)',
+                    lambda: read_pseudo_file(filename))
+    yield Benchmark(group, 'read_pseudo_header (N.pz-vbc.UPF)',
+                    lambda: read_pseudo_header(filename))
+
+    for scale in args.scales:
+        mesh = 100 * scale
+        filename = os.path.join(tmp_dir, 'mesh%d.UPF' % mesh)
+        write_upf_file(filename, mesh=mesh)
+        yield Benchmark(group, 'read_pseudo_file (mesh=%d)' % mesh,
+                        lambda x=filename: read_pseudo_file(x), mesh)
+
+    # The cost of reading a header must not depend on the size of the mesh
+    for scale in args.scales:
+        filename = os.path.join(tmp_dir, 'mesh%d.UPF' % (100 * scale))
+        yield Benchmark(group, 'read_pseudo_header (mesh=%d)' % (100 * scale),
+                        lambda x=filename: read_pseudo_header(x))
+
+    if hdf5 is None:
+        print("\nSkip HDF5 benchmarks: h5py is not installed")
+        return
+
+    for scale in args.scales:
+        igwx = 100 * scale
+        group = 'HDF5 wavefunctions (igwx=%d, nbnd=16)' % igwx
+        filename = os.path.join(tmp_dir, 'wfc%d.hdf5' % igwx)
+        write_wfc_file(filename, igwx=igwx)
+
+        yield Benchmark(group, 'get_wf_attributes', lambda x=filename: hdf5.get_wf_attributes(x))
+        yield Benchmark(group, 'get_wavefunctions', lambda x=filename: hdf5.get_wavefunctions(x),
+                        igwx)
+        yield Benchmark(group, 'iter_wavefunctions (block_size=4)',
+                        lambda x=filename: sum(1 for _ in hdf5.iter_wavefunctions(x, 4)), igwx)
+        yield Benchmark(group, 'get_wfc_miller_indices',
+                        lambda x=filename: hdf5.get_wfc_miller_indices(x), igwx)
+
+    for scale in args.scales:
+        ngm_g = 1000 * scale
+        group = 'HDF5 charge density (ngm_g=%d)' % ngm_g
+        filename = os.path.join(tmp_dir, 'charge%d.hdf5' % ngm_g)
+        write_charge_file(filename, ngm_g=ngm_g, nspin=2)
+        yield Benchmark(group, 'read_charge_file', lambda x=filename: hdf5.read_charge_file(x),
+                        ngm_g)
+        charge = hdf5.read_charge_file(filename)
+        for dtype in ('float64', 'float32'):
+            yield Benchmark(group, 'get_charge_density_grid (%s)' % dtype,
+                            lambda c=charge, t=dtype: hdf5.get_charge_density_grid(c, dtype=t),
+                            ngm_g)
+
+
+def main():
+    args = get_parser(__doc__).parse_args()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        run_benchmarks(iter_benchmarks(args, tmp_dir), args)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
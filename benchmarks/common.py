@@ -0,0 +1,242 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+"""
+Common harness of the benchmark scripts, with builders of synthetic
+scaled-up data files. Benchmarks only use the standard library timers
+and the fixtures of the test suite, so they can be run offline.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import numpy as np
+
+PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCES_DIR = os.path.join(PKG_DIR, 'tests/resources')
+
+if PKG_DIR not in sys.path:
+    sys.path.insert(0, PKG_DIR)
+
+DEFAULT_SCALES = (10, 100, 1000)
+
+Benchmark = namedtuple('Benchmark', 'group name func size')
+Benchmark.__new__.__defaults__ = (None,)
+
+Result = namedtuple('Result', 'group name best loops size')
+
+
+def resource(*paths):
+    """Returns the path of a test fixture."""
+    return os.path.join(RESOURCES_DIR, *paths)
+
+
+def get_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help="Number of timing runs for each benchmark, default is 5.")
+    parser.add_argument('-k', '--filter', metavar='TEXT', default=None,
+                        help="Run only the benchmarks whose group or name contains TEXT.")
+    parser.add_argument('--scales', metavar='N', type=int, nargs='+',
+                        default=list(DEFAULT_SCALES),
+                        help="Sizes of the synthetic scaled-up inputs, "
+                             "default is %s." % ' '.join(map(str, DEFAULT_SCALES)))
+    parser.add_argument('--json', metavar='FILE', default=None,
+                        help="Save the results to a JSON file, for comparing runs.")
+    return parser
+
+
+def measure(func, repeat=5):
+    """
+    Times a callable, returning the best time of a call and the number of
+    loops of each timing run (calibrated to last at least 0.2 seconds).
+    """
+    timer = timeit.Timer(func)
+    loops, _ = timer.autorange()
+    best = min(timer.repeat(repeat, loops)) / loops
+    return best, loops
+
+
+def format_time(seconds):
+    if seconds >= 1.0:
+        return '%8.3f s ' % seconds
+    elif seconds >= 1e-3:
+        return '%8.3f ms' % (seconds * 1e3)
+    return '%8.3f us' % (seconds * 1e6)
+
+
+def run_benchmarks(benchmarks, args):
+    """
+    Runs a sequence of benchmarks, printing a report. For benchmarks with
+    a size the time per item is also reported, in order to expose costs
+    that don't scale linearly with the size of the input.
+    """
+    results = []
+    group = None
+    for bench in benchmarks:
+        if args.filter and args.filter not in bench.group and args.filter not in bench.name:
+            continue
+
+        if bench.group != group:
+            group = bench.group
+            print("\n%s\n%s" % (group, '-' * len(group)))
+
+        try:
+            best, loops = measure(bench.func, args.repeat)
+        except Exception as err:
+            message = str(err).strip().split('\n')[0]
+            print("  %-52s failed: %s: %s" % (bench.name, err.__class__.__name__, message))
+            continue
+
+        line = "  %-52s %s  (%d loops)" % (bench.name, format_time(best), loops)
+        if bench.size:
+            line += "  %s/item" % format_time(best / bench.size).strip()
+        print(line)
+        results.append(Result(bench.group, bench.name, best, loops, bench.size))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([r._asdict() for r in results], f, indent=2)
+    return results
+
+
+###
+# Builders of synthetic data files
+
+def scale_pw_document(filename, nat=None, nks=None):
+    """
+    Builds a scaled-up PW XML document from a fixture, replicating the atoms
+    of the structures and the k-points of the band structure. When atoms are
+    replicated the output is completed with forces. Returns the XML text.
+    """
+    tree = ElementTree.parse(filename)
+    root = tree.getroot()
+
+    if nat is not None:
+        for structure in root.iter('atomic_structure'):
+            positions = structure.find('atomic_positions')
+            if positions is None:
+                continue
+            atoms = list(positions)
+            for atom in atoms:
+                positions.remove(atom)
+            for k in range(nat):
+                atom = copy.deepcopy(atoms[k % len(atoms)])
+                atom.set('index', str(k + 1))
+                atom.text = ' %.16E %.16E %.16E ' % (0.1 * k, 0.2 * k, 0.3 * k)
+                positions.append(atom)
+            structure.set('nat', str(nat))
+
+        output = root.find('output')
+        if output is not None and output.find('forces') is None:
+            forces = ElementTree.Element('forces')
+            forces.text = ' '.join('%.16E' % x for x in np.linspace(-0.1, 0.1, 3 * nat))
+            index = list(output).index(output.find('band_structure')) + 1
+            output.insert(index, forces)
+
+    if nks is not None:
+        band_structure = root.find('output/band_structure')
+        ks_energies = band_structure.findall('ks_energies')
+        for elem in ks_energies:
+            band_structure.remove(elem)
+        for k in range(nks):
+            band_structure.append(copy.deepcopy(ks_energies[k % len(ks_energies)]))
+        band_structure.find('nks').text = str(nks)
+
+    return ElementTree.tostring(root, encoding='unicode')
+
+
+def write_upf_file(filename, mesh=1000, nbeta=4):
+    """Writes a synthetic UPF v2 pseudo-potential file with a radial mesh of given size."""
+    def values(scale):
+        return '\n'.join(
+            ' '.join('%.14E' % v for v in row)
+            for row in np.array_split(scale * np.linspace(1e-6, 1.0, mesh), max(1, mesh // 4))
+        )
+
+    lines = [
+        '<UPF version="2.0.1">',
+        '<PP_INFO>\nSynthetic pseudo-potential\n</PP_INFO>',
+        '<PP_HEADER generated="benchmark" element="X" pseudo_type="NC" relativistic="no"'
+        ' is_ultrasoft="F" core_correction="F" functional="PZ" z_valence="4.0"'
+        ' mesh_size="%d" number_of_proj="%d"/>' % (mesh, nbeta),
+        '<PP_MESH dx="1.0E-02" mesh="%d" xmin="-7.0" rmax="100.0" zmesh="8.0">' % mesh,
+        '<PP_R type="real" size="%d" columns="4">\n%s\n</PP_R>' % (mesh, values(1.0)),
+        '<PP_RAB type="real" size="%d" columns="4">\n%s\n</PP_RAB>' % (mesh, values(0.01)),
+        '</PP_MESH>',
+        '<PP_LOCAL type="real" size="%d" columns="4">\n%s\n</PP_LOCAL>' % (mesh, values(-2.0)),
+        '<PP_NONLOCAL>',
+    ]
+    for k in range(1, nbeta + 1):
+        lines.append('<PP_BETA.%d type="real" size="%d" columns="4" index="%d" '
+                     'angular_momentum="%d">\n%s\n</PP_BETA.%d>'
+                     % (k, mesh, k, k % 3, values(0.5), k))
+    dij = ' '.join('%.14E' % (1.0 if i == j else 0.0)
+                   for i in range(nbeta) for j in range(nbeta))
+    lines.extend([
+        '<PP_DIJ type="real" size="%d" columns="4">\n\n%s\n</PP_DIJ>' % (nbeta ** 2, dij),
+        '</PP_NONLOCAL>',
+        '<PP_RHOATOM type="real" size="%d" columns="4">\n%s\n</PP_RHOATOM>'
+        % (mesh, values(4.0)),
+        '</UPF>',
+    ])
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+
+
+def get_miller_indices(size):
+    """Returns an array of *size* distinct Miller indices, sorted by modulus."""
+    n = 1
+    while (2 * n + 1) ** 3 < size:
+        n += 1
+    r = np.arange(-n, n + 1)
+    mill = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape(-1, 3)
+    order = np.argsort((mill ** 2).sum(axis=1), kind='stable')
+    return mill[order[:size]].astype(np.int32)
+
+
+def write_wfc_file(filename, igwx=1000, nbnd=16, gamma_only=False, ik=1):
+    """Writes a synthetic wavefunction file in the HDF5 format of PW."""
+    import h5py
+
+    rng = np.random.default_rng(ik)
+    with h5py.File(filename, 'w') as f:
+        f.attrs['ik'] = ik
+        f.attrs['xk'] = np.zeros(3)
+        f.attrs['ispin'] = 1
+        f.attrs['gamma_only'] = b'.TRUE.' if gamma_only else b'.FALSE.'
+        f.attrs['scale_factor'] = 1.0
+        f.attrs['ngw'] = igwx
+        f.attrs['igwx'] = igwx
+        f.attrs['npol'] = 1
+        f.attrs['nbnd'] = nbnd
+        mill = f.create_dataset('MillerIndices', data=get_miller_indices(igwx))
+        for k, name in enumerate(('bg1', 'bg2', 'bg3')):
+            mill.attrs[name] = np.eye(3)[k]
+        f.create_dataset('evc', data=rng.standard_normal((nbnd, 2 * igwx)))
+
+
+def write_charge_file(filename, ngm_g=1000, gamma_only=False, nspin=1):
+    """Writes a synthetic charge density file in the HDF5 format of PW."""
+    import h5py
+
+    rng = np.random.default_rng(0)
+    with h5py.File(filename, 'w') as f:
+        f.attrs['gamma_only'] = b'.TRUE.' if gamma_only else b'.FALSE.'
+        f.attrs['ngm_g'] = ngm_g
+        f.attrs['nspin'] = nspin
+        f.create_dataset('MillerIndices', data=get_miller_indices(ngm_g))
+        f.create_dataset('rhotot_g', data=rng.standard_normal(2 * ngm_g))
+        if nspin == 2:
+            f.create_dataset('rhodiff_g', data=rng.standard_normal(2 * ngm_g))
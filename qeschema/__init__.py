@@ -7,13 +7,7 @@
 #
 # Authors: Davide Brunato
 #
-from .documents import XmlDocument, QeDocument, PwDocument, PhononDocument, \
-    NebDocument, TdDocument, TdSpectrumDocument, XSpectraDocument, EPWDocument
-from .converters import RawInputConverter, PwInputConverter, \
-    PhononInputConverter, NebInputConverter, TdInputConverter, \
-    TdSpectrumInputConverter, XSpectraInputConverter, EPWInputConverter
-from .exceptions import QESchemaError, XmlDocumentError
-from .utils import set_logger
+import importlib
 
 __version__ = '1.5.1'
 
@@ -23,5 +17,57 @@ __all__ = [
     'PwInputConverter', 'PhononInputConverter', 'TdInputConverter',
     'TdSpectrumInputConverter', 'NebInputConverter', 'QESchemaError',
     'XmlDocumentError', 'set_logger', 'hdf5', 'XSpectraDocument',
-    'XSpectraInputConverter', 'EPWInputConverter'
+    'XSpectraInputConverter', 'EPWInputConverter', 'clear_schema_cache',
+    'schema_cache_info', 'batch_extract'
 ]
+
+# The package API is loaded lazily (PEP 562), so importing the package doesn't
+# import xmlschema, numpy or h5py until a class or a function is first accessed.
+_LAZY_ATTRIBUTES = {
+    'XmlDocument': 'documents',
+    'QeDocument': 'documents',
+    'PwDocument': 'documents',
+    'PhononDocument': 'documents',
+    'NebDocument': 'documents',
+    'TdDocument': 'documents',
+    'TdSpectrumDocument': 'documents',
+    'XSpectraDocument': 'documents',
+    'EPWDocument': 'documents',
+    'RawInputConverter': 'converters',
+    'PwInputConverter': 'converters',
+    'PhononInputConverter': 'converters',
+    'NebInputConverter': 'converters',
+    'TdInputConverter': 'converters',
+    'TdSpectrumInputConverter': 'converters',
+    'XSpectraInputConverter': 'converters',
+    'EPWInputConverter': 'converters',
+    'QESchemaError': 'exceptions',
+    'XmlDocumentError': 'exceptions',
+    'clear_schema_cache': 'schema_cache',
+    'schema_cache_info': 'schema_cache',
+    'set_logger': 'utils',
+    'batch_extract': 'batch',
+}
+
+_LAZY_SUBMODULES = {'hdf5'}
+
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        if name not in _LAZY_SUBMODULES:
+            raise AttributeError(
+                "module {!r} has no attribute {!r}".format(__name__, name)
+            ) from None
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        module = importlib.import_module('.' + module_name, __name__)
+        value = getattr(module, name)
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
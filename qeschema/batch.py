@@ -0,0 +1,299 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+#
+# Authors: Davide Brunato
+#
+"""
+Batch extraction of output data and batch conversion of inputs of many XML files.
+"""
+import glob
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .documents import PwDocument, PhononDocument, NebDocument, TdDocument, \
+    TdSpectrumDocument, XSpectraDocument, EPWDocument
+from .utils import sniff_root_tag
+
+logger = logging.getLogger('qeschema')
+
+__all__ = ['QUANTITIES', 'DOCUMENT_CLASSES', 'ConversionResult', 'batch_extract',
+           'batch_convert', 'get_document_class']
+
+# Map each extractable quantity to a PwDocument getter and to the subtrees
+# of the XML data that have to be loaded for computing it.
+QUANTITIES = {
+    'total_energy': ('get_total_energy', ('output/total_energy',)),
+    'forces': ('get_forces_array', ('output/forces', 'output/atomic_structure')),
+    'stress': ('get_stress_array', ('output/stress',)),
+    'cell': ('get_cell_parameters', ('output/atomic_structure',)),
+    'atomic_positions': ('get_atomic_positions_array', ('output/atomic_structure',)),
+    'k_points': ('get_k_points_array', ('output/band_structure',)),
+    'ks_eigenvalues': ('get_ks_eigenvalues_array', ('output/band_structure',)),
+}
+
+# Map the root tags of QE XML documents to the document classes
+DOCUMENT_CLASSES = {
+    'espresso': PwDocument,
+    'espressoph': PhononDocument,
+    'nebRun': NebDocument,
+    'tddfpt': TdDocument,
+    'spectrumDoc': TdSpectrumDocument,
+    'xspectra': XSpectraDocument,
+    'epw': EPWDocument,
+}
+
+ConversionResult = namedtuple('ConversionResult', 'filename output elapsed error')
+
+_worker_document = None
+_worker_validation = 'lax'
+
+
+def _init_worker(schema, validation):
+    """Creates the document shared by all the files processed by a worker."""
+    global _worker_document
+    global _worker_validation
+    _worker_document = PwDocument(schema=schema)
+    _worker_validation = validation
+
+
+def _extract_file(filename, quantities):
+    """Extracts the quantities from a file, capturing any error."""
+    document = _worker_document
+    paths = [p for name in quantities for p in QUANTITIES[name][1]]
+    try:
+        document.from_xml(filename, validation=_worker_validation, paths=paths)
+        values = []
+        for name in quantities:
+            value = getattr(document, QUANTITIES[name][0])()
+            if value is not None:
+                if name in ('forces', 'atomic_positions'):
+                    value = value[1]
+                value = np.asarray(value, dtype=float)
+                if not value.size:
+                    value = None  # Empty arrays for missing data
+            values.append(value)
+    except Exception as err:
+        logger.debug("Extraction from %r failed: %s", filename, err)
+        return None, '%s: %s' % (err.__class__.__name__, err)
+    else:
+        return values, None
+
+
+def iter_filenames(files):
+    """
+    Iterates a sequence of file paths, directories or glob patterns, yielding
+    the file paths. Directories are expanded to the XML files they contain.
+    A single string is processed as a sequence of one item.
+    """
+    if isinstance(files, str):
+        files = [files]
+
+    for item in files:
+        if glob.has_magic(item):
+            yield from sorted(glob.glob(item, recursive=True))
+        elif os.path.isdir(item):
+            yield from sorted(glob.glob(os.path.join(item, '*.xml')))
+        else:
+            yield item
+
+
+def _to_column(values, size):
+    """Builds an array column from a list of values, missing values are `None`."""
+    shapes = {v.shape for v in values if v is not None}
+    if len(shapes) != 1:
+        column = np.empty(size, dtype=object)
+        column[:] = values
+        return column
+
+    shape = shapes.pop()
+    column = np.full((size,) + shape, np.nan)
+    for k, value in enumerate(values):
+        if value is not None:
+            column[k] = value
+    return column
+
+
+def batch_extract(files, quantities=('total_energy',), max_workers=None,
+                  validation='lax', schema=None, chunksize=8):
+    """
+    Extracts output quantities from many PW XML files, distributing the
+    files over a pool of worker processes. Each worker reuses the same schema
+    for all the files it processes and loads only the subtrees of XML data
+    needed by the requested quantities. Errors are captured per file and
+    don't stop the batch.
+
+    :param files: a sequence of file paths and/or glob patterns.
+    :param quantities: a sequence of names of quantities to extract, \
+    available names are the keys of :data:`QUANTITIES`.
+    :param max_workers: the number of worker processes, if 1 the files are \
+    processed in the current process, default is the number of CPUs.
+    :param validation: validation mode, can be 'strict', 'lax' or 'skip'.
+    :param schema: an optional schema name or path, default is the default \
+    schema of :class:`PwDocument`.
+    :param chunksize: the number of files submitted to a worker at a time.
+    :return: a dictionary of columns: a *filename* array of strings, an *error* \
+    array with the error messages (`None` for successful extractions) and an \
+    array for each quantity. Quantities with the same shape for every file are \
+    stacked in a float array, filled with NaNs for failed files, otherwise an \
+    object array is returned.
+    """
+    if isinstance(quantities, str):
+        quantities = [quantities]
+    quantities = list(quantities)
+    for name in quantities:
+        if name not in QUANTITIES:
+            raise ValueError("unknown quantity {!r}, available quantities are {}"
+                             .format(name, sorted(QUANTITIES)))
+
+    filenames = list(iter_filenames(files))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1 or len(filenames) <= 1:
+        _init_worker(schema, validation)
+        results = [_extract_file(x, quantities) for x in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                 initargs=(schema, validation)) as executor:
+            results = list(executor.map(_extract_file, filenames,
+                                        [quantities] * len(filenames),
+                                        chunksize=chunksize))
+
+    size = len(filenames)
+    columns = {
+        'filename': np.array(filenames, dtype=str),
+        'error': np.array([err for _, err in results], dtype=object),
+    }
+    for k, name in enumerate(quantities):
+        values = [None if v is None else v[k] for v, _ in results]
+        columns[name] = _to_column(values, size)
+    return columns
+
+
+def get_document_class(filename):
+    """
+    Returns the document class for an XML file, detected from the root tag
+    of the file, reading only the head of the file.
+    """
+    tag = sniff_root_tag(filename).rpartition('}')[2]
+    try:
+        return DOCUMENT_CLASSES[tag]
+    except KeyError:
+        raise ValueError("unknown document type {!r} for file {!r}"
+                         .format(tag, filename)) from None
+
+
+def get_output_filename(filename, output_dir=None):
+    """Returns the path of the Fortran input converted from an XML file."""
+    output = os.path.splitext(filename)[0] + '.in'
+    if output_dir is None:
+        return output
+    return os.path.join(output_dir, os.path.basename(output))
+
+
+_worker_schema = None
+_worker_output_dir = None
+
+
+def _init_convert_worker(schema, output_dir):
+    global _worker_schema
+    global _worker_output_dir
+    _worker_schema = schema
+    _worker_output_dir = output_dir
+
+
+def _convert_file(filename):
+    """Converts an XML file to a Fortran input, capturing any error."""
+    start_time = time.perf_counter()
+    try:
+        document = get_document_class(filename)(source=filename, schema=_worker_schema)
+        output = get_output_filename(filename, _worker_output_dir)
+        document.write_fortran_input(output)  # an existing output is replaced only at the end
+    except Exception as err:
+        logger.debug("Conversion of %r failed: %s", filename, err)
+        return ConversionResult(filename, None, time.perf_counter() - start_time,
+                                '%s: %s' % (err.__class__.__name__, err))
+    else:
+        return ConversionResult(filename, output, time.perf_counter() - start_time, None)
+
+
+def batch_convert(files, max_workers=None, schema=None, output_dir=None, chunksize=1):
+    """
+    Converts the inputs of many QE XML files to Fortran inputs, distributing
+    the files over a pool of worker processes. The type of each document is
+    detected from the root tag, reading only the head of the file. Schemas
+    and converter maps are cached, so each worker builds them once for each
+    type of document. Errors are captured per file and don't stop the batch.
+    Different files that map to the same output file, e.g. files with the same
+    name in different directories with an *output_dir*, are not converted and
+    are reported as errors. The same file given more times is converted once.
+
+    :param files: a sequence of file paths, directories and/or glob patterns.
+    :param max_workers: the number of worker processes, if 1 the files are \
+    processed in the current process, default is the number of CPUs.
+    :param schema: an optional schema name or path, default is the schema \
+    of the location hints of each file or the default schema of its type.
+    :param output_dir: the directory where to write the Fortran inputs, \
+    default is the directory of each XML file.
+    :param chunksize: the number of files submitted to a worker at a time.
+    :return: a list of :class:`ConversionResult` named tuples, with the path \
+    of the input file, the path of the output file, the elapsed time in seconds \
+    and the error message (`None` for successful conversions).
+    """
+    filenames = list(iter_filenames(files))
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    # Different input files mapped to the same output file are not converted
+    sources = {}
+    for filename in filenames:
+        output = os.path.abspath(get_output_filename(filename, output_dir))
+        sources.setdefault(output, set()).add(os.path.realpath(filename))
+
+    results = {}
+    for filename in filenames:
+        output = get_output_filename(filename, output_dir)
+        if len(sources[os.path.abspath(output)]) > 1:
+            results[filename] = ConversionResult(
+                filename, None, 0.0, 'ValueError: output file %r is shared with '
+                                     'other input files' % output
+            )
+
+    # The same input file given more times (e.g. by path, directory and glob
+    # pattern) is converted once, the result is mapped back to each entry.
+    converted = {}
+    for filename in filenames:
+        if filename not in results:
+            output = os.path.abspath(get_output_filename(filename, output_dir))
+            converted.setdefault(output, filename)
+
+    unique = list(converted.values())
+    if max_workers == 1 or len(unique) <= 1:
+        _init_convert_worker(schema, output_dir)
+        results.update((x, _convert_file(x)) for x in unique)
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=_init_convert_worker,
+                                 initargs=(schema, output_dir)) as executor:
+            results.update(zip(unique, executor.map(_convert_file, unique,
+                                                    chunksize=chunksize)))
+
+    for filename in filenames:
+        if filename not in results:
+            output = get_output_filename(filename, output_dir)
+            result = results[converted[os.path.abspath(output)]]
+            results[filename] = result._replace(
+                filename=filename, output=output if result.output is not None else None
+            )
+
+    return [results[x] for x in filenames]
@@ -12,8 +12,73 @@ Conversion functions for Quantum Espresso cards.
 """
 import logging
 
+import numpy as np
+
 logger = logging.getLogger('qeschema')
 
+POSITION_FORMAT = '%-4s %12.8f  %12.8f  %12.8f'
+FREE_POSITIONS_FORMAT = ' %4d%4d%4d'
+FORCE_FORMAT = '%-3s  %14.8f %14.8f %14.8f'
+
+
+def format_rows(row_formats, values):
+    """
+    Formats the rows of a card with a single string formatting on the
+    joined row formats, instead of formatting each row separately.
+
+    :param row_formats: a sequence with the printf-style format of each row.
+    :param values: a flat sequence with the values of all the rows.
+    :return: List of strings
+    """
+    if not row_formats:
+        return []
+    return ('\n'.join(row_formats) % tuple(values)).split('\n')
+
+
+def format_positions(atoms, free_positions=(), constrained=None):
+    """
+    Formats the lines of atomic positions, with the flags of the position
+    constraints for the constrained atoms. Raises a `ValueError` or a
+    `TypeError` for data that can't be formatted in one pass, e.g. atoms
+    without a name or without 3 coordinates.
+
+    :param atoms: a list of dictionaries with the name and the coordinates \
+    of the atoms, the coordinates can be lists or NumPy arrays.
+    :param free_positions: a flat sequence or a NumPy array with 3 flags for \
+    each atom, or an empty sequence.
+    :param constrained: a function that maps the flags, reshaped to an \
+    array of rows, to a boolean array of the constrained atoms.
+    :return: List of strings
+    """
+    if len(free_positions) not in (0, 3 * len(atoms)):
+        raise ValueError("incorrect number of position constraints")
+    elif not len(free_positions):
+        flags = None
+    else:
+        flags = np.asarray(free_positions).reshape(-1, 3)
+        if constrained is None:
+            is_constrained = (flags.sum(axis=1) != 3).tolist()
+        else:
+            is_constrained = constrained(flags).tolist()
+        flags = flags.astype(int).tolist()
+
+    row_formats = []
+    values = []
+    for k, atom in enumerate(atoms):
+        name, coords = atom.get('@name'), atom.get('$')
+        if not isinstance(name, str) or len(coords) != 3:
+            raise ValueError("atom {!r} can't be formatted".format(atom))
+
+        values.append(name)
+        values.extend(coords)
+        if flags is not None and is_constrained[k]:
+            row_formats.append(POSITION_FORMAT + FREE_POSITIONS_FORMAT)
+            values.extend(flags[k])
+        else:
+            row_formats.append(POSITION_FORMAT)
+
+    return format_rows(row_formats, values)
+
 
 #
 # Functions for QE cards
@@ -90,14 +155,20 @@ def get_atomic_positions_cell_card(name, **kwargs):
 
     # Check atoms with position constraints
     free_positions = kwargs.get('free_positions')
-    if free_positions:
-        free_positions = free_positions.get('$', [])
+    free_positions = free_positions.get('$', []) if free_positions else []
 
-    if free_positions and len(free_positions) != 3 * len(atoms):
+    if len(free_positions) and len(free_positions) != 3 * len(atoms):
         logger.error("ATOMIC_POSITIONS: incorrect number of position constraints!")
 
-    # Add atomic positions
+    # Add atomic positions, formatting the rows one by one only for irregular data
     lines = ['%s %s' % (name, units)]
+    try:
+        lines.extend(format_positions(atoms, free_positions))
+    except (ValueError, TypeError):
+        pass
+    else:
+        return lines
+
     for k in range(len(atoms)):
         try:
             line = '{:4}'.format(atoms[k].get('@name'))
@@ -106,7 +177,7 @@ def get_atomic_positions_cell_card(name, **kwargs):
             logger.error("ATOMIC_POSITIONS: incorrect datatype in positions!")
             continue
 
-        if free_positions:
+        if len(free_positions):
             try:
                 if free_positions[3 * k] + \
                         free_positions[3 * k + 1] + \
@@ -179,6 +250,14 @@ def get_k_points_card(name, **kwargs):
     lines = [name] if k_attrib is None else ['%s %s' % (name, k_attrib)]
     if k_attrib is None:
         lines.append(' {}'.format(nk))
+        if all(len(point['$']) == 3 for point in k_point):
+            values = []
+            for point in k_point:
+                values.extend(point['$'])
+                values.append(point['@weight'])
+            lines.extend(format_rows([' %s %s %s %s'] * len(k_point), values))
+            return lines
+
         for point in k_point:
             lines.append(' {0} {1}'.format(
                 ' '.join([str(value) for value in point['$']]), point['@weight'])
@@ -280,18 +359,13 @@ def get_atomic_forces_card(name, **kwargs):
     if atoms and len(atoms) != len(external_atomic_forces) / 3:
         logger.error("incorrect number of atomic forces")
 
-    # Build input card text lines
-    lines = [name]
+    # Build input card text lines, atoms without 3 force components are skipped
     f = external_atomic_forces
-    for at in atoms:
-        try:
-            line = '{:<3s}  {:14.8f} {:14.8f} {:14.8f}'.format(at["@name"], f[0], f[1], f[2])
-        except IndexError:
-            pass
-        else:
-            lines.append(line)
-            f = f[3:]
-    return lines
+    values = []
+    for k in range(min(len(atoms), len(f) // 3)):
+        values.append(atoms[k]["@name"])
+        values.extend(f[3 * k:3 * k + 3])
+    return [name] + format_rows([FORCE_FORMAT] * (len(values) // 4), values)
 
 
 def _get_cell_lines(name, cells):
@@ -424,7 +498,7 @@ def get_neb_images_positions_card(name, **kwargs):
 
     free_positions = kwargs.get('free_positions', None)
     if free_positions:
-        free_positions = free_positions.get('$')
+        free_positions = free_positions.get('$', [])
     else:
         free_positions = []
 
@@ -444,7 +518,7 @@ def get_neb_images_positions_card(name, **kwargs):
                 logger.error("nat provided in first image differs from number "
                              "of atoms in atomic_positions!!!")
                 return ''
-            if free_positions and len(free_positions) != 3 * first_nat:
+            if len(free_positions) and len(free_positions) != 3 * first_nat:
                 logger.error("ATOMIC_POSITIONS: incorrect number of position constraints!")
                 return ''
         else:
@@ -458,6 +532,14 @@ def get_neb_images_positions_card(name, **kwargs):
                 lines.append('LAST_IMAGE ')
 
         lines.append('ATOMIC_POSITIONS { %s }' % units)
+        try:
+            lines.extend(format_positions(
+                atoms, free_positions, constrained=lambda x: x.sum(axis=1) < 3
+            ))
+        except (ValueError, TypeError):
+            pass
+        else:
+            continue
 
         # reshape to 3x3
         free_positions_sq = [free_positions[i:i + 3]
@@ -467,7 +549,7 @@ def get_neb_images_positions_card(name, **kwargs):
             sp_name = '{:4}'.format(atom['@name'])
             coords = '{:12.8f}  {:12.8f}  {:12.8f}'.format(*atom['$'])
 
-            if free_positions_sq and sum(free_positions_sq[k]) < 3:
+            if len(free_positions_sq) and sum(free_positions_sq[k]) < 3:
                 free_pos = '{:4d}{:4d}{:4d}'.format(*free_positions_sq[k])
                 lines.append('%s %s %s' % (sp_name, coords, free_pos))
             else:
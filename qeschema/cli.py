@@ -0,0 +1,211 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+#
+# Authors: Davide Brunato
+#
+"""
+Command line interface of qeschema.
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+
+logger = logging.getLogger('qeschema')
+
+
+def build_cache(args):
+    """Precompiles the schemas of the package into the on-disk store."""
+    from .documents import SCHEMAS_DIR
+    from .schema_cache import SchemaCache, SchemaStore
+
+    store = SchemaStore(args.cache_dir)
+    os.makedirs(store.directory, exist_ok=True)
+    if args.clear:
+        store.clear()
+
+    cache = SchemaCache(store=store)
+    filenames = sorted(glob.glob(os.path.join(SCHEMAS_DIR, '*.xsd'))) + \
+        sorted(glob.glob(os.path.join(SCHEMAS_DIR, 'releases', '*.xsd')))
+
+    for filename in filenames:
+        try:
+            cache.build_schema(filename)
+        except Exception as err:
+            logger.warning("Skip schema %r: %s", filename, err)
+        else:
+            print("Stored schema %r" % os.path.relpath(filename, SCHEMAS_DIR))
+
+    print("Precompiled schemas saved into %r" % store.directory)
+    return 0
+
+
+def _get_value(column, k):
+    """Returns a row of an extracted column as a float array, `None` if missing."""
+    import numpy as np
+
+    value = column[k]
+    if value is not None:
+        value = np.asarray(value, dtype=float)
+        if np.isnan(value).all():
+            return None  # NaN placeholder of a failed or missing extraction
+    return value
+
+
+def batch(args):
+    """Extracts output quantities from many PW XML files."""
+    import json
+    import numpy as np
+    from .batch import batch_extract
+
+    columns = batch_extract(args.files, args.quantities, max_workers=args.jobs,
+                            validation=args.validation, schema=args.schema)
+
+    if args.output is None:
+        for k, filename in enumerate(columns['filename']):
+            if columns['error'][k] is not None:
+                print("%s: ERROR %s" % (filename, columns['error'][k]))
+                continue
+
+            values = []
+            for name in args.quantities:
+                value = _get_value(columns[name], k)
+                if value is None or value.ndim:
+                    values.append('%s=%s' % (name, getattr(value, 'shape', None)))
+                else:
+                    values.append('%s=%r' % (name, float(value)))
+            print("%s: %s" % (filename, ' '.join(values)))
+
+    elif args.output.lower().endswith('.json'):
+        records = []
+        for k, filename in enumerate(columns['filename']):
+            record = {'filename': str(filename), 'error': columns['error'][k]}
+            for name in args.quantities:
+                value = _get_value(columns[name], k)  # NaNs are not valid JSON
+                record[name] = None if value is None else value.tolist()
+            records.append(record)
+        with open(args.output, 'w') as f:
+            json.dump(records, f, indent=2)
+    else:
+        # Save only fixed-dtype arrays, so the file can be loaded without pickle:
+        # missing errors are empty strings and ragged quantities are JSON lists.
+        arrays = {
+            'filename': columns['filename'],
+            'error': np.array(['' if err is None else err for err in columns['error']],
+                              dtype=str),
+        }
+        for name in args.quantities:
+            column = columns[name]
+            if column.dtype == object:
+                values = [_get_value(column, k) for k in range(len(column))]
+                column = np.array(['' if v is None else json.dumps(v.tolist()) for v in values],
+                                  dtype=str)
+            arrays[name] = column
+        np.savez(args.output, **arrays)
+
+    failed = sum(err is not None for err in columns['error'])
+    if failed:
+        logger.warning("Extraction failed for %d of %d files", failed, len(columns['error']))
+    return 1 if failed else 0
+
+
+def convert(args):
+    """Converts the inputs of many QE XML files to Fortran inputs."""
+    import time
+    from .batch import batch_convert
+
+    start_time = time.perf_counter()
+    results = batch_convert(args.files, max_workers=args.jobs, schema=args.schema,
+                            output_dir=args.output_dir)
+    elapsed = time.perf_counter() - start_time
+
+    for result in results:
+        if result.error is None:
+            print("%s -> %s  (%.1f ms)" % (result.filename, result.output,
+                                           result.elapsed * 1000))
+        else:
+            print("%s: ERROR %s  (%.1f ms)" % (result.filename, result.error,
+                                               result.elapsed * 1000))
+
+    failed = sum(x.error is not None for x in results)
+    print("Converted %d of %d files in %.2f s" % (len(results) - failed, len(results), elapsed))
+    return 1 if failed else 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='qeschema',
+        description="Schema-based tools and interfaces for Quantum Espresso data."
+    )
+    parser.add_argument("-v", "--verbosity", action="count", default=1,
+                        help="Increase output verbosity.")
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser(
+        'build-cache', help="precompile the XSD schemas into the on-disk store."
+    )
+    subparser.add_argument('--cache-dir', metavar='DIR', default=None,
+                           help="The directory of the store, if not provided uses "
+                                "QESCHEMA_CACHE_DIR or the user's cache directory.")
+    subparser.add_argument('--clear', action='store_true', default=False,
+                           help="Remove all the stored schemas before building.")
+    subparser.set_defaults(func=build_cache)
+
+    subparser = subparsers.add_parser(
+        'batch', help="extract output quantities from many PW XML files."
+    )
+    subparser.add_argument('files', metavar='FILE', nargs='+',
+                           help="PW XML files or glob patterns.")
+    subparser.add_argument('-q', '--quantities', nargs='+', default=['total_energy'],
+                           metavar='NAME',
+                           help="Quantities to extract, default is total_energy. Available "
+                                "quantities: total_energy, forces, stress, cell, "
+                                "atomic_positions, k_points, ks_eigenvalues.")
+    subparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help="Number of worker processes, default is the number of CPUs.")
+    subparser.add_argument('-o', '--output', metavar='FILE', default=None,
+                           help="Save the results to a .npz or .json file instead "
+                                "of printing them. In a .npz file the errors of "
+                                "successful extractions are empty strings and the "
+                                "quantities with different shapes are JSON strings.")
+    subparser.add_argument('--validation', default='lax', choices=['strict', 'lax', 'skip'],
+                           help="Validation mode, default is 'lax'.")
+    subparser.add_argument('--schema', metavar='FILE', default=None,
+                           help="Specify XSD schema of the files.")
+    subparser.set_defaults(func=batch)
+
+    subparser = subparsers.add_parser(
+        'convert', help="convert QE XML inputs to Fortran inputs."
+    )
+    subparser.add_argument('files', metavar='FILE', nargs='+',
+                           help="XML files, directories or glob patterns. The type "
+                                "of each document is detected from its root tag.")
+    subparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help="Number of worker processes, default is the number of CPUs.")
+    subparser.add_argument('-o', '--output-dir', metavar='DIR', default=None,
+                           help="Directory of the Fortran inputs, default is the "
+                                "directory of each XML file.")
+    subparser.add_argument('--schema', metavar='FILE', default=None,
+                           help="Specify XSD schema of the files.")
+    subparser.set_defaults(func=convert)
+
+    return parser
+
+
+def main(argv=None):
+    """Main entry point of the command line interface."""
+    from .utils import set_logger
+
+    args = get_parser().parse_args(argv)
+    set_logger(args.verbosity)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,8 +15,9 @@ import logging
 import re
 import os.path
 from collections.abc import Container
+from types import MappingProxyType
 
-from .utils import to_fortran, BiunivocalMap
+from .utils import to_fortran, write_lines, BiunivocalMap
 from . import cards, options
 
 logger = logging.getLogger('qeschema')
@@ -124,7 +125,52 @@ class RawInputConverter(Container):
     target_pattern = re.compile(r'(\w+)(?:\[((?:\w+)(?:%\w+)*)]|)')
     """RE pattern to extract Fortran input's namelist/card and name of a parameter"""
 
-    def __init__(self, invariant_map, variant_map, input_namelists=None, input_cards=None):
+    @classmethod
+    def get_conversion_maps(cls, template_map):
+        """
+        Returns the conversion maps of the class, compiled from the template
+        map at first call and then shared by all the instances of the class.
+
+        :param template_map: the template dictionary of the class.
+        :return: a tuple with read-only invariant and variant maps and a \
+        read-only map from targets to matched namelist/card and parameter names.
+        """
+        try:
+            return cls.__dict__['_conversion_maps']
+        except KeyError:
+            invariant_map, variant_map = conversion_maps_builder(template_map)
+            conversion_maps = (
+                MappingProxyType(invariant_map),
+                MappingProxyType(variant_map),
+                MappingProxyType(cls.match_targets(invariant_map, variant_map)),
+            )
+            setattr(cls, '_conversion_maps', conversion_maps)
+            return conversion_maps
+
+    @classmethod
+    def match_targets(cls, invariant_map, variant_map):
+        """
+        Matches the targets of the conversion maps with the target pattern.
+
+        :return: a dictionary from each target to a couple with the name of \
+        the namelist/card and the name of the parameter, `None` for targets \
+        that don't match the pattern.
+        """
+        targets = set(invariant_map.values())
+        for items in variant_map.values():
+            if isinstance(items[0], str):
+                targets.add(items[0])
+            else:
+                targets.update(item[0] for item in items)
+
+        matches = {}
+        for target in targets:
+            match = cls.target_pattern.match(target)
+            matches[target] = match.groups() if match is not None else None
+        return matches
+
+    def __init__(self, invariant_map, variant_map, input_namelists=None,
+                 input_cards=None, targets=None):
         self.invariant_map = invariant_map
         """Map of parameters that are matched with one-to-one relation
         and which value is invariant from XML to QE Fortran input format."""
@@ -133,6 +179,11 @@ class RawInputConverter(Container):
         """Map of parameters that require a type conversion or are multi
         related with other inputs."""
 
+        if targets is None:
+            targets = self.match_targets(invariant_map, variant_map)
+        self.targets = targets
+        """Map of targets to the namelist/card and the name of the parameter."""
+
         self.input_namelists = tuple(input_namelists) or (
             key for key in invariant_map.keys() + variant_map.keys()
         )
@@ -190,11 +241,7 @@ class RawInputConverter(Container):
 
     def set_parameter(self, path, value):
         target = self.invariant_map[path]
-        match = self.target_pattern.match(target)
-        if match is not None:
-            namelist, name = match.groups()
-        else:
-            namelist = name = None
+        namelist, name = self.targets[target] or (None, None)
         if name is None:
             raise ValueError("Wrong value {!r} for invariant parameter {!r}".format(target, path))
 
@@ -209,7 +256,7 @@ class RawInputConverter(Container):
         for target, _get_qe_input, _ in target_items:
             logger.debug("Add argument to %r", target)
             logger.debug("Argument's conversion function: %r", _get_qe_input)
-            group, name = self.target_pattern.match(target).groups()
+            group, name = self.targets[target]
             if name is not None:
                 try:
                     name_dict = self._input[group][name]
@@ -237,18 +284,21 @@ class RawInputConverter(Container):
                 if _get_qe_input is not None:
                     self._input[group].update({'_get_qe_input': _get_qe_input})
 
-    def get_qe_input(self):
+    def iter_qe_input(self):
+        """
+        Generates the lines of the Fortran input, building a namelist
+        or a card at a time.
+        """
         if all([not section for section in self._input.values()]):
             logger.error("Empty input!")
         _input = self._input
-        lines = []
         for namelist in self.input_namelists:
 
             if namelist == FCP_NAMELIST and not len(_input[namelist]):
                 # Skip empty &FCP/ section
                 continue
 
-            lines.append('&%s' % namelist)
+            yield '&%s' % namelist
             for name, value in sorted(_input[namelist].items(), key=lambda x: x[0].lower()):
                 logger.debug("Add input for parameter %s[%r] with value %r",
                              namelist, name, value)
@@ -263,14 +313,14 @@ class RawInputConverter(Container):
                         continue
 
                     if callable(to_fortran_input):
-                        lines.extend(to_fortran_input(name, **value))
+                        yield from to_fortran_input(name, **value)
                     else:
                         logger.error('Parameter %s[%r] conversion function is not callable!',
                                      namelist, name)
                 else:
                     # Simple invariant conversion
-                    lines.append(' {0}={1}'.format(name, value))
-            lines.append('/')
+                    yield ' {0}={1}'.format(name, value)
+            yield '/'
 
         for card in self.input_cards:
             logger.debug("Add card %r", card)
@@ -285,11 +335,22 @@ class RawInputConverter(Container):
             _get_qe_input = card_args.get('_get_qe_input', None)
 
             if callable(_get_qe_input):
-                lines.extend(_get_qe_input(card, **card_args))
+                yield from _get_qe_input(card, **card_args)
             elif card not in OPTIONAL_CARDS:
                 logger.error('Card conversion function not found!')
 
-        return '\n'.join(lines)
+    def get_qe_input(self):
+        """Returns the Fortran input as a string."""
+        return '\n'.join(self.iter_qe_input())
+
+    def write_qe_input(self, fp):
+        """
+        Writes the Fortran input to a file object, without building the text
+        of the whole input. The content is the same of :meth:`get_qe_input`.
+
+        :param fp: a text file object.
+        """
+        write_lines(fp, self.iter_qe_input())
 
     def clear_input(self):
         del self._input
@@ -571,8 +632,9 @@ class PwInputConverter(RawInputConverter):
     }
 
     def __init__(self, **kwargs):
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.PW_TEMPLATE_MAP)
         super(PwInputConverter, self).__init__(
-            *conversion_maps_builder(self.PW_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=('CONTROL', 'SYSTEM', 'ELECTRONS', 'IONS', 'CELL',
                              FCP_NAMELIST),
             input_cards=('ATOMIC_SPECIES', 'ATOMIC_POSITIONS', 'K_POINTS',
@@ -696,13 +758,37 @@ class PhononInputConverter(RawInputConverter):
     }
 
     def __init__(self, **_kwargs):
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.PHONON_TEMPLATE_MAP)
         super(PhononInputConverter, self).__init__(
-            *conversion_maps_builder(self.PHONON_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=('INPUTPH',),
             input_cards=('qPointsSpecs', PH_NAT_TODO_CARD)
         )
 
 
+def get_neb_engine_template_map():
+    """
+    Builds the template map of the NEB engine input, that is the PW template
+    map with the atomic structure replaced by the images of the path.
+    """
+    engine_template_map = copy.deepcopy(PwInputConverter.PW_TEMPLATE_MAP)
+    engine_template_map['atomic_structure'] = {
+        '@nat': ("SYSTEM[nat]", options.neb_set_system_nat, None),
+        '$': [
+            ('SYSTEM[ibrav]', options.set_ibrav_to_zero, None),
+            ("CELL_PARAMETERS", cards.get_neb_cell_parameters_card, None),
+            ("ATOMIC_POSITIONS", cards.get_neb_images_positions_card, None)
+        ],
+        'atomic_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None),
+        'crystal_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None),
+        'wyckoff_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None)
+    }
+    engine_template_map['free_positions'] = {
+        '$': ("ATOMIC_POSITIONS", cards.get_neb_images_positions_card, None)
+    }
+    return engine_template_map
+
+
 class NebInputConverter(RawInputConverter):
     """
     Convert to/from Fortran input for Phonon.
@@ -732,46 +818,35 @@ class NebInputConverter(RawInputConverter):
             'totChargeFirst': "PATH[fcp_tot_charge_first]",
             'totChargeLast': "PATH[fcp_tot_charge_last]",
             'climbingImageIndex': ("CLIMBING_IMAGES", cards.get_climbing_images, None)
-        }
+        },
+        'engine': get_neb_engine_template_map(),
     }
 
     def __init__(self, **_kwargs):
-        engine_template_map = copy.deepcopy(PwInputConverter.PW_TEMPLATE_MAP)
-        engine_template_map['atomic_structure'] = {
-            '@nat': ("SYSTEM[nat]", options.neb_set_system_nat, None),
-            '$': [
-                ('SYSTEM[ibrav]', options.set_ibrav_to_zero, None),
-                ("CELL_PARAMETERS", cards.get_neb_cell_parameters_card, None),
-                ("ATOMIC_POSITIONS", cards.get_neb_images_positions_card, None)
-            ],
-            'atomic_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None),
-            'crystal_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None),
-            'wyckoff_positions': ('ATOMIC_FORCES', cards.get_atomic_forces_card, None)
-        }
-        engine_template_map['free_positions'] = {
-            '$': ("ATOMIC_POSITIONS", cards.get_neb_images_positions_card, None)
-        }
-        self.NEB_TEMPLATE_MAP.update({'engine': engine_template_map})
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.NEB_TEMPLATE_MAP)
         super(NebInputConverter, self).__init__(
-            *conversion_maps_builder(self.NEB_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=('PATH', 'CONTROL', 'SYSTEM', 'ELECTRONS', 'IONS', 'CELL'),
             input_cards=('CLIMBING_IMAGES', 'ATOMIC_SPECIES', 'ATOMIC_POSITIONS', 'K_POINTS',
                          'CELL_PARAMETERS', 'ATOMIC_FORCES', 'CONSTRAINTS')
         )
 
-    def get_qe_input(self):
+    def iter_qe_input(self):
         """
         Overrides method in RawInputConverter because few lines
         in between the namelists are requested for the NEB input.
 
-        :return: a string containing the text input for NEB calculations
+        :return: a generator of the lines of the text input for NEB calculations
         """
-        qe_input = super(NebInputConverter, self).get_qe_input().split('\n')
-        qe_input = ['BEGIN', 'BEGIN_PATH_INPUT'] + qe_input
-        index = qe_input.index('&CONTROL')
-        qe_input = qe_input[:index] + ['END_PATH_INPUT', 'BEGIN_ENGINE_INPUT'] + qe_input[index:]
-        qe_input += ['END_ENGINE_INPUT', 'END']
-        return '\n'.join(qe_input)
+        yield 'BEGIN'
+        yield 'BEGIN_PATH_INPUT'
+        for line in super(NebInputConverter, self).iter_qe_input():
+            if line == '&CONTROL':
+                yield 'END_PATH_INPUT'
+                yield 'BEGIN_ENGINE_INPUT'
+            yield line
+        yield 'END_ENGINE_INPUT'
+        yield 'END'
 
 
 class TdInputConverter(RawInputConverter):
@@ -856,21 +931,22 @@ class TdInputConverter(RawInputConverter):
     }
 
     def __init__(self, **_kwargs):
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.TD_TEMPLATE_MAP)
         super(TdInputConverter, self).__init__(
-            *conversion_maps_builder(self.TD_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=('cache', 'lr_input', 'lr_control', 'lr_dav', 'lr_post')
         )
 
-    def get_qe_input(self):
+    def iter_qe_input(self):
         """
-        Overrides superclass get_qe_input with use_defaults set to False.
-        :return: the input as obtained from its input builder
+        Overrides superclass iter_qe_input selecting the namelists
+        for the type of TDDFPT calculation.
         """
-        temp = super().get_qe_input().split('\n')
+        temp = list(super().iter_qe_input())
         td = temp[1]
         start = temp.index('&lr_input')
         end = start + temp[start:].index('/')
-        qe_input = '\n'.join(temp[start:end + 1])
+        yield from temp[start:end + 1]
         """ put lr_input in qe_input """
 
         if td.lower() in ('lanczos', 'eels'):
@@ -878,15 +954,14 @@ class TdInputConverter(RawInputConverter):
         elif td.lower() == 'davidson':
             start = temp.index('&lr_dav')
         end = start + temp[start:].index('/')
-        qe_input = qe_input + '\n' + '\n'.join(temp[start:end + 1])
+        yield from temp[start:end + 1]
         """ put one of lr_control(lanczos) or lr_davidson in qe_input"""
 
         start = temp.index('&lr_post')
         end = start + temp[start:].index('/')
         if end - start > 1:
-            qe_input = qe_input + '\n' + '\n'.join(temp[start:end + 1])
+            yield from temp[start:end + 1]
         """ if not empty add lr_post namelist to qe_input """
-        return qe_input
 
 
 class TdSpectrumInputConverter(RawInputConverter):
@@ -915,8 +990,9 @@ class TdSpectrumInputConverter(RawInputConverter):
     }
 
     def __init__(self, **_kwargs):
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.SPEC_TEMPLATE_MAP)
         super(TdSpectrumInputConverter, self).__init__(
-            *conversion_maps_builder(self.SPEC_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=['lr_input']
         )
 
@@ -993,8 +1069,9 @@ class XSpectraInputConverter(RawInputConverter):
     }
 
     def __init__(self, **_kwargs):
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.XSPECTRA_TEMPLATE_MAP)
         super(XSpectraInputConverter, self).__init__(
-            *conversion_maps_builder(self.XSPECTRA_TEMPLATE_MAP),
+            invariant_map, variant_map, targets=targets,
             input_namelists=('input_xspectra', 'plot', 'pseudos', 'cut_occ'),
             input_cards=("K_POINTS",)
         )
@@ -1099,6 +1176,7 @@ class EPWInputConverter(RawInputConverter):
     }
 
     def __init__(self, **kwargs):
-        super().__init__(*conversion_maps_builder(self.EPW_TEMPLATE_MAP),
+        invariant_map, variant_map, targets = self.get_conversion_maps(self.EPW_TEMPLATE_MAP)
+        super().__init__(invariant_map, variant_map, targets=targets,
                          input_namelists=['inputepw'],
                          input_cards=[])
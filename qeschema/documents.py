@@ -7,27 +7,28 @@
 #
 # Authors: Davide Brunato
 #
+import copy
+import itertools
 import logging
 import os.path
 import json
+import threading
+import weakref
 from abc import ABCMeta
+from collections import namedtuple
 from functools import wraps
 from xml.etree import ElementTree
+import numpy as np
 import xmlschema
 from xmlschema import etree_tostring
 
-
-try:
-    import yaml
-except ImportError:
-    yaml = None
-
 from .namespaces import XSD_NAMESPACE
 from .converters import RawInputConverter, PwInputConverter, PhononInputConverter, \
     NebInputConverter, TdInputConverter, TdSpectrumInputConverter, \
     XSpectraInputConverter, EPWInputConverter
 from .exceptions import XmlDocumentError
-from .utils import etree_iter_path
+from .schema_cache import get_schema, find_xsd_element
+from .utils import text_to_array, write_lines
 
 logger = logging.getLogger('qeschema')
 
@@ -44,10 +45,219 @@ def requires_xml_data(method):
     return check_xml_data
 
 
+def import_yaml():
+    """Imports PyYAML on demand, so it's not loaded for documents that don't use it."""
+    try:
+        import yaml
+    except ImportError:
+        raise RuntimeError("PyYAML library is not installed!") from None
+    return yaml
+
+
 def removeprefix(s, prefix):
     return s[len(prefix):] if s.startswith(prefix) else s
 
 
+def to_xml_text(value):
+    """Translates a Python value to the text of an XML element or attribute."""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (list, tuple)):
+        return ' '.join(to_xml_text(v) for v in value)
+    return str(value)
+
+
+def get_path_steps(path):
+    """
+    Splits a path into a tuple of steps for a path index lookup, each step is
+    a couple with a boolean that is `True` for a descendant step ('//') and
+    a tag name. Returns `None` for paths with other XPath features, e.g.
+    wildcards, predicates, attributes, namespaces or parent steps.
+    """
+    if not path or any(c in path for c in '[]*@{}:') or '..' in path.replace('//', '/'):
+        return None
+
+    parts = path.split('/')
+    if parts[0] == '.':
+        parts = parts[1:]
+    elif not parts[0]:
+        return None
+
+    steps = []
+    descendant = False
+    for part in parts:
+        if not part:
+            if descendant:
+                return None
+            descendant = True
+        elif part == '.':
+            return None
+        else:
+            steps.append((descendant, part))
+            descendant = False
+
+    return None if descendant else tuple(steps)
+
+
+def match_path_steps(steps, tags):
+    """Returns `True` if a tuple of path steps matches a tuple of tags from the root."""
+    if not steps:
+        return not tags
+
+    descendant, tag = steps[0]
+    if not descendant:
+        return bool(tags) and tags[0] == tag and match_path_steps(steps[1:], tags[1:])
+    return any(tags[k] == tag and match_path_steps(steps[1:], tags[k + 1:])
+               for k in range(len(tags)))
+
+
+ConversionStep = namedtuple('ConversionStep', 'xsd_element attributes key')
+
+_conversion_plans = weakref.WeakKeyDictionary()
+_conversion_plans_lock = threading.Lock()
+
+
+def get_conversion_plan(schema_root, converter, input_path):
+    """
+    Returns the conversion plan for the input subtree of XML documents, that
+    maps each relative path that is an ancestor of a path of the converter
+    maps to a :class:`ConversionStep`, with the XSD element, the converter
+    paths of the attributes and the converter path of the element (`None`
+    for elements that are only ancestors of converted elements). Elements
+    whose path is not in the plan don't contribute to the conversion and
+    can be skipped with their subtree.
+
+    Plans are built once and shared for each schema, converter class and
+    input path, unless the converter instance has its own maps.
+
+    :param schema_root: the XSD element that contains the input element.
+    :param converter: a :class:`RawInputConverter` instance.
+    :param input_path: the path of the input element, e.g. './input'.
+    """
+    cls = type(converter)
+    maps = cls.__dict__.get('_conversion_maps')
+    shared = maps is not None and maps[0] is converter.invariant_map \
+        and maps[1] is converter.variant_map
+
+    if shared:
+        try:
+            return _conversion_plans[schema_root][cls, input_path]
+        except KeyError:
+            pass
+
+    paths = {}
+    for key in list(converter.invariant_map) + list(converter.variant_map):
+        path, _, name = key.rpartition('/')
+        if name == '$' or name.startswith('@'):
+            paths.setdefault(path, []).append(key)
+        else:
+            paths.setdefault(key, [])
+
+    # Include the ancestors, that are walked to reach the converted elements
+    for path in list(paths):
+        while path.count('/') > 1:
+            path = path.rpartition('/')[0]
+            paths.setdefault(path, [])
+    paths.setdefault('.', [])
+
+    plan = {}
+    for path, keys in paths.items():
+        xsd_element = find_xsd_element(schema_root, input_path + path[1:])
+        if xsd_element is None:
+            plan[path] = ConversionStep(None, {}, None)
+            continue
+
+        attributes = {k.rpartition('/@')[2]: k for k in keys if '/@' in k}
+        key = '%s/$' % path if xsd_element.attributes else path
+        if key not in converter:
+            key = None
+        plan[path] = ConversionStep(xsd_element, attributes, key)
+
+    if shared:
+        with _conversion_plans_lock:
+            plans = _conversion_plans.setdefault(schema_root, {})
+            plan = plans.setdefault((cls, input_path), plan)
+    return plan
+
+
+class SubtreesBuilder(object):
+    """
+    A parser target that builds only the selected subtrees of XML data and
+    their ancestors, skipping all the other elements and their content.
+
+    :param paths: a sequence of paths relative to the root, with tag names \
+    separated by slashes, eg. `['output/total_energy', 'output/atomic_structure']`.
+    :ivar subtrees: the list of couples with path and root of the built subtrees.
+    :ivar namespaces: the namespace declarations found in XML data.
+    """
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+
+        self.selected = set()
+        self.ancestors = set()
+        for path in paths:
+            path = removeprefix(path.strip(), './').strip('/')
+            if not path or '//' in path or '*' in path or '[' in path:
+                raise XmlDocumentError("{!r} is not a path of tag names".format(path))
+            self.selected.add(path)
+            while '/' in path:
+                path = path.rpartition('/')[0]
+                self.ancestors.add(path)
+
+        self.subtrees = []
+        self.namespaces = {}
+        self._builder = ElementTree.TreeBuilder()
+        self._path = []
+        self._depth = 0  # depth inside a selected subtree
+        self._skip = 0  # depth inside a skipped subtree
+
+    def start_ns(self, prefix, uri):
+        self.namespaces.setdefault(prefix, uri)
+
+    def start(self, tag, attrib):
+        if self._skip:
+            self._skip += 1
+            return
+        elif self._depth:
+            self._depth += 1
+            return self._builder.start(tag, attrib)
+        elif not self._path:
+            self._path.append(None)
+            return self._builder.start(tag, attrib)
+
+        self._path.append(tag.rpartition('}')[2])
+        path = '/'.join(self._path[1:])
+        if path in self.selected:
+            self._depth = 1
+            elem = self._builder.start(tag, attrib)
+            self.subtrees.append((path, elem))
+            return elem
+        elif path in self.ancestors:
+            return self._builder.start(tag, attrib)
+        else:
+            self._path.pop()
+            self._skip = 1
+
+    def end(self, tag):
+        if self._skip:
+            self._skip -= 1
+            return
+        elif self._depth:
+            self._depth -= 1
+            if self._depth:
+                return self._builder.end(tag)
+        self._path.pop()
+        return self._builder.end(tag)
+
+    def data(self, data):
+        if not self._skip:
+            self._builder.data(data)
+
+    def close(self):
+        return self._builder.close()
+
+
 class XmlDocument(object):
     """
     Base class for a generic XML document based on an XSD schema. The schema
@@ -59,7 +269,12 @@ class XmlDocument(object):
     :param source: can be a :class:`xmlschema.XMLResource` instance or a file-like \
     object or a file path or an URL of a resource or a string containing the XML data.
     :param schema: can be a :class:`xmlschema.XMLSchema` instance or a file-like \
-    object or a file path or an URL of a resource or a string containing the XSD schema.
+    object or a file path or an URL of a resource or a string containing the XSD schema. \
+    Schemas loaded from files are shared between documents using a process-wide cache.
+    :param path_index: if `True` :meth:`find`, :meth:`findall` and :meth:`iter` use \
+    an index of the elements by path, built at first query in one traversal of the \
+    tree. The index is rebuilt when new data is loaded, call :meth:`clear_path_index` \
+    after changing the tree with the ElementTree API.
 
     :cvar SEARCH_PATHS: the sequence of search paths used by :meth:`fetch_schema` \
     for fetching schemas.
@@ -72,7 +287,8 @@ class XmlDocument(object):
     SEARCH_PATHS = ('.',)
     DEFAULT_SCHEMA = None
 
-    def __init__(self, source=None, schema=None):
+    def __init__(self, source=None, schema=None, path_index=False):
+        self.path_index = path_index
         self.root = None
         self.filename = None
         self.format = None
@@ -100,20 +316,29 @@ class XmlDocument(object):
             self.schema = schema
         elif isinstance(schema, str) and '\n' not in schema \
                 and not schema.lstrip().startswith('<'):
-            self.schema = xmlschema.XMLSchema(self.fetch_schema(schema) or schema)
+            self.schema = get_schema(self.fetch_schema(schema) or schema)
         elif schema is not None:
-            self.schema = xmlschema.XMLSchema(schema)
+            self.schema = get_schema(schema)
         elif source_schema is not None:
-            self.schema = xmlschema.XMLSchema(source_schema)
+            self.schema = get_schema(source_schema)
         elif self.DEFAULT_SCHEMA is not None:
             default_schema = self.fetch_schema(self.DEFAULT_SCHEMA)
-            self.schema = xmlschema.XMLSchema(default_schema)
+            self.schema = get_schema(default_schema)
         else:
             raise XmlDocumentError("missing schema for XML data!")
 
         if source is not None:
             self.from_xml(source, validation='lax')
 
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._root = root
+        self._path_index = None
+
     @property
     def namespaces(self):
         """
@@ -146,7 +371,8 @@ class XmlDocument(object):
         :param filename: filepath of the data source file.
         :param validation: validation mode, can be 'strict', 'lax' or 'skip'.
         :param kwargs: other options to pass to the encoding method of the schema \
-        instance in case of a non-XML data source.
+        instance in case of a non-XML data source. For XML data a *paths* option \
+        can be provided for loading only a selection of subtrees (see :meth:`from_xml`).
         """
         if not isinstance(filename, str):
             raise TypeError("wrong type for argument 'filename'")
@@ -154,20 +380,26 @@ class XmlDocument(object):
             raise ValueError("{!r} is not a file".format(filename))
 
         ext = filename.strip().lower().rpartition('.')[2] if '.' in filename else None
+        paths = kwargs.pop('paths', None)
 
         if ext == 'xml':
-            self.from_xml(filename, validation)
+            self.from_xml(filename, validation, paths=paths)
+        elif paths is not None and ext in ('json', 'yml', 'yaml'):
+            raise XmlDocumentError("selective loading of subtrees requires XML data")
         elif ext == 'json':
             self.from_json(filename, validation, **kwargs)
         elif ext in ('yml', 'yaml'):
             self.from_yaml(filename, validation, **kwargs)
         else:
             try:
-                self.from_xml(filename, validation)
+                self.from_xml(filename, validation, paths=paths)
             except (ElementTree.ParseError, SyntaxError):
+                if paths is not None:
+                    raise
                 try:
                     self.from_json(filename, validation, **kwargs)
                 except json.JSONDecodeError:
+                    yaml = import_yaml()
                     try:
                         self.from_yaml(filename, validation, **kwargs)
                     except yaml.YAMLError:
@@ -175,17 +407,25 @@ class XmlDocument(object):
                             "input file is not in neither of XML, JSON or YAML formats"
                         )
 
-    def from_xml(self, source, validation='strict', **kwargs):
+    def from_xml(self, source, validation='strict', paths=None, **kwargs):
         """
         Load XML data. Data is validated against the schema.
 
         :param source: a filepath to an XML file or a string containing XML data.
         :param validation: validation mode, can be 'strict', 'lax' or 'skip'.
+        :param paths: an optional sequence of paths relative to the root, eg. \
+        `['output/total_energy', 'output/atomic_structure']`. If provided only \
+        the selected subtrees and their ancestors are built and only the selected \
+        subtrees are validated, the rest of the XML data is skipped while parsing.
         :param kwargs: other options for creating the :class:`xmlschema.XMLResource` \
         instance used for reading the XML data.
         :return: a couple with the root element of the XML ElementTree a list \
         containing the detected errors.
         """
+        if paths is not None:
+            self._from_xml_subtrees(source, validation, paths)
+            return
+
         if not isinstance(source, xmlschema.XMLResource):
             source = xmlschema.XMLResource(source, **kwargs)
 
@@ -206,6 +446,51 @@ class XmlDocument(object):
             self.filename = removeprefix(source.url, 'file://')
             self.format = 'xml'
 
+    def _from_xml_subtrees(self, source, validation, paths):
+        if isinstance(source, xmlschema.XMLResource):
+            raise XmlDocumentError("selective loading requires a file path, "
+                                   "a file-like object or a string containing XML data")
+
+        builder = SubtreesBuilder(paths)
+        parser = ElementTree.XMLParser(target=builder)
+        if not isinstance(source, str):
+            filename = None
+            while True:
+                chunk = source.read(65536)
+                if not chunk:
+                    break  # either '' or b'', for text or binary file objects
+                parser.feed(chunk)
+        elif source.lstrip().startswith('<'):
+            filename = None
+            parser.feed(source)
+        else:
+            filename = source.strip()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    parser.feed(chunk)
+        root = parser.close()
+
+        errors = []
+        if validation != 'skip':
+            for path, elem in builder.subtrees:
+                xsd_path = '/%s/%s' % (root.tag, path)
+                xsd_element = find_xsd_element(self.schema, xsd_path)
+                if xsd_element is None:
+                    msg = "{!r} doesn't match any XSD element!".format(xsd_path)
+                    if validation == 'strict':
+                        raise XmlDocumentError(msg)
+                    logger.error(msg)
+                elif validation == 'strict':
+                    xsd_element.validate(elem, namespaces=builder.namespaces)
+                else:
+                    errors.extend(xsd_element.iter_errors(elem, namespaces=builder.namespaces))
+
+        self.root = root
+        self.errors = errors
+        self._namespaces = builder.namespaces
+        self.filename = filename
+        self.format = 'xml' if filename else None
+
     def from_json(self, source, validation='strict', **kwargs):
         """
         Load JSON encoded data. Data is converted to an XML ElementTree structure
@@ -253,9 +538,8 @@ class XmlDocument(object):
         :return: a couple with the root element of the XML ElementTree and a list \
         containing the detected errors.
         """
-        if yaml is None:
-            raise RuntimeError("PyYAML library is not installed!")
-        elif not isinstance(source, str):
+        yaml = import_yaml()
+        if not isinstance(source, str):
             raise TypeError("the source argument must be a string!")
         elif '\n' not in source and not source.strip().startswith('<'):
             with open(source) as f:
@@ -299,6 +583,72 @@ class XmlDocument(object):
             self.root, self.errors = obj, []
         self.filename = self.format = None
 
+    def iterparse(self, source, tags, validation='lax'):
+        """
+        Iterates XML data from a file in streaming mode, yielding the subtrees
+        whose tag is included in *tags*. Each subtree is validated against the
+        corresponding XSD element and then it's cleared and detached from the
+        tree when the iteration resumes, so the memory usage doesn't depend on
+        the number of subtrees. Nested subtrees of a matched element are not
+        yielded separately. At the end of the iteration the document is bound
+        to the remaining part of the XML data.
+
+        :param source: a filepath to an XML file or a file-like object.
+        :param tags: a tag name or a sequence of tag names of the subtrees to \
+        yield, eg. `('step', 'ks_energies')`. Namespaces are ignored for matching.
+        :param validation: validation mode, can be 'strict', 'lax' or 'skip'.
+        :return: a generator of couples with the absolute path and the subtree root.
+        """
+        if isinstance(tags, str):
+            tags = {tags}
+        else:
+            tags = set(tags)
+
+        namespaces = {}
+        errors = []
+        ancestors = []
+        match_depth = 0
+        root = None
+
+        for event, item in ElementTree.iterparse(source, events=('start-ns', 'start', 'end')):
+            if event == 'start-ns':
+                namespaces.setdefault(*item)
+            elif event == 'start':
+                ancestors.append(item)
+                if root is None:
+                    root = item
+                elif not match_depth and item.tag.rpartition('}')[2] in tags:
+                    match_depth = len(ancestors)
+            else:
+                if len(ancestors) == match_depth:
+                    path = '/%s' % '/'.join(e.tag for e in ancestors)
+                    if validation != 'skip':
+                        xsd_element = find_xsd_element(self.schema, path)
+                        if xsd_element is None:
+                            msg = "{!r} doesn't match any XSD element!".format(path)
+                            if validation == 'strict':
+                                raise XmlDocumentError(msg)
+                            logger.error(msg)
+                        elif validation == 'strict':
+                            xsd_element.validate(item, namespaces=namespaces)
+                        else:
+                            errors.extend(xsd_element.iter_errors(item, namespaces=namespaces))
+
+                    yield path, item
+                    ancestors[-2].remove(item)
+                    item.clear()
+                    match_depth = 0
+                ancestors.pop()
+
+        self.root = root
+        self.errors = errors
+        self._namespaces = namespaces
+        if isinstance(source, str):
+            self.filename = source.strip()
+            self.format = 'xml'
+        else:
+            self.filename = self.format = None
+
     @requires_xml_data
     def write(self, filename, output_format='xml', validation='strict', **kwargs):
         """
@@ -324,9 +674,7 @@ class XmlDocument(object):
                 return json.dump(obj, f, sort_keys=True, indent=4)
 
         elif output_format == 'yaml':
-            if yaml is None:
-                raise RuntimeError("PyYAML library is not installed!")
-
+            yaml = import_yaml()
             obj = self.to_dict(validation, **kwargs)
             with open(filename, 'w+') as f:
                 yaml.dump(obj, stream=f, default_flow_style=False)
@@ -384,9 +732,7 @@ class XmlDocument(object):
         :param validation: validation mode, can be 'strict', 'lax' or 'skip'.
         :param kwargs: other options for the decoding method of the schema instance.
         """
-        if yaml is None:
-            raise RuntimeError("PyYAML library is not installed!")
-
+        yaml = import_yaml()
         data = self.to_dict(validation, **kwargs)
         if filename is None:
             return yaml.dump(data, default_flow_style=False)
@@ -400,7 +746,61 @@ class XmlDocument(object):
 
     # ElementTree API wrappers
 
+    def clear_path_index(self):
+        """Clears the path index, that is rebuilt at next query."""
+        self._path_index = None
+
+    def _get_path_index(self):
+        """
+        Returns the path index of the elements, building it if necessary: a map
+        from tuples of tags from the root to lists of elements, a map from the
+        elements to their position in document order and a cache of queries.
+        """
+        if self._path_index is None:
+            index = {}
+            positions = {}
+            stack = [(self._root, ())]
+            while stack:
+                elem, tags = stack.pop()
+                positions[elem] = len(positions)
+                index.setdefault(tags, []).append(elem)
+                stack.extend((child, tags + (child.tag,)) for child in reversed(elem))
+            self._path_index = index, positions, {}
+        return self._path_index
+
+    def _lookup(self, path):
+        """
+        Returns the elements matching a path in document order,
+        or `None` if the path cannot be resolved with the index.
+        """
+        index, positions, queries = self._get_path_index()
+        try:
+            keys = queries[path]
+        except KeyError:
+            steps = get_path_steps(path)
+            if steps is None:
+                keys = None
+            else:
+                keys = [tags for tags in index if match_path_steps(steps, tags)]
+            queries[path] = keys
+
+        if keys is None:
+            return None
+        elif len(keys) == 1:
+            return index[keys[0]]
+        return sorted((e for k in keys for e in index[k]), key=positions.__getitem__)
+
     def iter(self, tag=None):
+        if self.path_index and tag is not None and tag != '*':
+            index, positions, queries = self._get_path_index()
+            try:
+                elements = queries[None, tag]
+            except KeyError:
+                elements = [e for k, v in index.items()
+                            if (k[-1] if k else self._root.tag) == tag for e in v]
+                elements.sort(key=positions.__getitem__)
+                queries[None, tag] = elements
+            return iter(elements)
         return self.root.iter(tag)
 
     def find(self, path, namespaces=None):
@@ -413,6 +813,10 @@ class XmlDocument(object):
         """
         if path[:1] == "/":
             path = "." + path
+        if self.path_index:
+            elements = self._lookup(path)
+            if elements is not None:
+                return elements[0] if elements else None
         return self.root.find(path, namespaces)
 
     def findall(self, path, namespaces=None):
@@ -425,6 +829,10 @@ class XmlDocument(object):
         """
         if path[:1] == "/":
             path = "." + path
+        if self.path_index:
+            elements = self._lookup(path)
+            if elements is not None:
+                return list(elements)
         return self.root.findall(path, namespaces)
 
 
@@ -435,8 +843,8 @@ class QeDocument(XmlDocument, metaclass=ABCMeta):
     SEARCH_PATHS = (SCHEMAS_DIR, os.path.join(SCHEMAS_DIR, 'releases'), '.')
     DEFAULT_INPUT_BUILDER = None
 
-    def __init__(self, source=None, schema=None, input_builder=None):
-        super(QeDocument, self).__init__(source, schema)
+    def __init__(self, source=None, schema=None, input_builder=None, path_index=False):
+        super(QeDocument, self).__init__(source, schema, path_index)
 
         if input_builder is None:
             self.input_builder = self.DEFAULT_INPUT_BUILDER
@@ -447,6 +855,7 @@ class QeDocument(XmlDocument, metaclass=ABCMeta):
         else:
             self.input_builder = input_builder
 
+        self._decoded_input = None
         self.default_namespace = self.schema.target_namespace
         qe_prefixes = ['qes', 'neb', 'qes_ph', 'qes_lr', 'qes_spectrum',
                        'qes_xspectra', 'epw']
@@ -469,13 +878,28 @@ class QeDocument(XmlDocument, metaclass=ABCMeta):
     def write_fortran_input(self, filename):
         """
         Converts the XML input data to a Fortran namelist input and writes it to a file.
+        The input is written a namelist or a card at a time, without building its text,
+        to a temporary file that replaces the file only at the end.
 
-        :param filename: the pathname of the file to use to save the Fortran namelist.
+        :param filename: the pathname of the file to use to save the Fortran namelist, \
+        or a text file object.
         """
-        with open(filename, mode='w+') as f:
-            f.write(self.get_fortran_input())
+        lines = self.iter_fortran_input()
+        if hasattr(filename, 'write'):
+            write_lines(filename, lines)
+            return
+
+        # Write to a temporary file, so an error doesn't leave a truncated file
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(tmp_filename, mode='w') as f:
+                write_lines(f, lines)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            if os.path.isfile(tmp_filename):
+                os.unlink(tmp_filename)
+            raise
 
-    @requires_xml_data
     def get_fortran_input(self, use_defaults=True):
         """
         Converts the XML input data to a Fortran namelist input.
@@ -483,6 +907,18 @@ class QeDocument(XmlDocument, metaclass=ABCMeta):
         :param use_defaults: use the defaults of the XSD schema to fill missing values.
         :returns: a string.
         """
+        return '\n'.join(self.iter_fortran_input(use_defaults))
+
+    @requires_xml_data
+    def iter_fortran_input(self, use_defaults=True):
+        """
+        Converts the XML input data to a Fortran namelist input, returning an iterator
+        of its lines. The XML data is decoded at call, the lines of the namelists and
+        of the cards are built during the iteration.
+
+        :param use_defaults: use the defaults of the XSD schema to fill missing values.
+        :returns: an iterator of strings.
+        """
         qe_input = self.input_builder(xml_file=self.filename)
         input_path = './%s' % self.input_path
 
@@ -491,42 +927,120 @@ class QeDocument(XmlDocument, metaclass=ABCMeta):
             raise XmlDocumentError("Missing input {!r} in XML data!".format(input_path))
 
         for schema_root in self.schema.elements.values():
-            if schema_root.find(input_path):
+            if find_xsd_element(schema_root, input_path) is not None:
                 break
         else:
             raise XmlDocumentError("Missing input element in XSD schema!")
 
-        # Extract values from input's subtree of the XML document
-        for elem, path in etree_iter_path(input_root, path=input_path):
-            rel_path = path.replace(input_path, '.')
-            xsd_element = schema_root.find(path)
-            if xsd_element is None:
-                logger.error("%r doesn't match any element!", path)
+        # Extract values from input's subtree of the XML document, walking
+        # only the elements that are in the conversion plan, in document order.
+        plan = get_conversion_plan(schema_root, qe_input, input_path)
+        stack = [(input_root, '.')]
+        while stack:
+            elem, rel_path = stack.pop()
+            step = plan[rel_path]
+            stack.extend(
+                (child, path) for child, path in
+                reversed([(e, '%s/%s' % (rel_path, e.tag)) for e in elem]) if path in plan
+            )
+
+            if step.xsd_element is None:
+                logger.error("%r doesn't match any element!", input_path + rel_path[1:])
                 continue
+
+            attributes = [k for k in elem.attrib if k in step.attributes]
+            if step.key is None and not attributes:
+                continue  # An ancestor of converted elements
+
+            if self._decoded_input is None:
+                node_dict = self._decode_input_element(elem, step, use_defaults)
+            elif elem in self._decoded_input:
+                # Copied because the converter can extend the lists of decoded values
+                node_dict = copy.deepcopy(self._decoded_input[elem])
             else:
-                value = xsd_element.decode(elem, use_defaults=use_defaults)
-                if isinstance(value, str):
-                    value = value.strip()
-                node_dict = {elem.tag: value}
+                node_dict = self._decode_input_element(elem, step, use_defaults)
+                self._decoded_input[elem] = copy.deepcopy(node_dict)
             logger.debug("Add input for node '{0}' with dict '{1}'".format(elem.tag, node_dict))
 
-            # Convert attributes
-            for attr_name, value in elem.attrib.items():
-                logger.debug("Convert attribute '%s' of element '%s'" % (attr_name, path))
-                path_key = '%s/@%s' % (rel_path, attr_name)
-                if path_key not in qe_input:
-                    logger.debug("Attribute's path '%s' not in converter!" % path_key)
-                    continue
-                qe_input.set_path(path_key, elem.tag, node_dict)
-
-            logger.debug("Convert element '%s'" % path)
-            path_key = '%s/$' % rel_path if xsd_element.attributes else rel_path
-            if path_key not in qe_input:
-                logger.debug("Element's path '%s' not in converter!" % path_key)
-                continue
-            qe_input.set_path(path_key, elem.tag, node_dict)
+            for attr_name in attributes:
+                logger.debug("Convert attribute %r of element %r", attr_name, rel_path)
+                qe_input.set_path(step.attributes[attr_name], elem.tag, node_dict)
+
+            if step.key is not None:
+                logger.debug("Convert element %r", rel_path)
+                qe_input.set_path(step.key, elem.tag, node_dict)
+
+        return qe_input.iter_qe_input()
 
-        return qe_input.get_qe_input()
+    @staticmethod
+    def _decode_input_element(elem, step, use_defaults):
+        value = step.xsd_element.decode(elem, use_defaults=use_defaults)
+        if isinstance(value, str):
+            value = value.strip()
+        return {elem.tag: value}
+
+    @requires_xml_data
+    def iter_fortran_inputs(self, grid, **kwargs):
+        """
+        Generates the Fortran inputs of a parameter sweep, one for each combination
+        of the values of the grid. The input elements are decoded only once, for
+        each combination only the overridden elements and their ancestors are
+        decoded again. The XML data is restored after each input is built.
+
+        :param grid: a map from the paths of input elements or attributes, relative \
+        to the root, to sequences of values, e.g. `{'input/basis/ecutwfc': [30, 40], \
+        'input/bands/smearing/@degauss': [0.01, 0.02]}`.
+        :param kwargs: optional keyword arguments for :meth:`get_fortran_input`.
+        :returns: a generator of couples with a dictionary of the overrides and \
+        the Fortran input.
+        """
+        input_root = self.find('./%s' % self.input_path)
+        if input_root is None:
+            raise XmlDocumentError("Missing input {!r} in XML data!".format(self.input_path))
+
+        parents = {child: elem for elem in input_root.iter() for child in elem}
+        targets = []
+        affected = set()
+        for path in grid:
+            elem_path, _, attr_name = path.partition('/@')
+            elem = self.find(elem_path)
+            if elem is None or elem is not input_root and elem not in parents:
+                raise XmlDocumentError("No input element matches path {!r}!".format(path))
+            targets.append((elem, attr_name or None))
+
+            while elem is not None:
+                affected.add(elem)
+                elem = parents.get(elem)
+
+        # The cache is attached to the document only while an input is built,
+        # so the document is never left with decodings of overridden values.
+        decoded_input = {}
+        for values in itertools.product(*grid.values()):
+            saved = []
+            try:
+                for (elem, attr_name), value in zip(targets, values):
+                    if attr_name is None:
+                        saved.append(elem.text)
+                        elem.text = to_xml_text(value)
+                    else:
+                        saved.append(elem.get(attr_name))
+                        elem.set(attr_name, to_xml_text(value))
+
+                self._decoded_input = decoded_input
+                fortran_input = self.get_fortran_input(**kwargs)
+            finally:
+                self._decoded_input = None
+                for elem in affected:
+                    decoded_input.pop(elem, None)
+                for (elem, attr_name), text in zip(targets, saved):
+                    if attr_name is None:
+                        elem.text = text
+                    elif text is None:
+                        del elem.attrib[attr_name]
+                    else:
+                        elem.set(attr_name, text)
+
+            yield dict(zip(grid, values)), fortran_input
 
 
 class PwDocument(QeDocument):
@@ -546,7 +1060,7 @@ class PwDocument(QeDocument):
         path = './/output//atomic_positions'
         elem = self.find(path)
         if elem is not None:
-            atomic_positions = self.schema.find(path).decode(elem)
+            atomic_positions = find_xsd_element(self.schema, path).decode(elem)
             atoms = atomic_positions.get('atom')
             if not isinstance(atoms, list):
                 atoms = [atoms]
@@ -564,7 +1078,7 @@ class PwDocument(QeDocument):
         path = './/output//cell'
         elem = self.find(path)
         if elem is not None:
-            cell = self.schema.find(path).decode(elem)
+            cell = find_xsd_element(self.schema, path).decode(elem)
             return [cell['a1'], cell['a2'], cell['a3']]
 
     @requires_xml_data
@@ -577,7 +1091,7 @@ class PwDocument(QeDocument):
         path = './/output//stress'
         elem = self.find(path)
         if elem is not None:
-            stress = self.schema.find(path).decode(elem)
+            stress = find_xsd_element(self.schema, path).decode(elem)
             try:
                 stress = stress['$']
             except TypeError:
@@ -595,17 +1109,20 @@ class PwDocument(QeDocument):
         path = './/output/forces'
         elem = self.find(path)
         if elem is not None:
-            forces = self.schema.find(path).decode(elem)
+            forces = find_xsd_element(self.schema, path).decode(elem)
+            try:
+                forces = forces['$']
+            except TypeError:
+                pass  # Schemas without attributes for forces
             path = './/output//atomic_positions'
-            breakpoint()
-            atomic_positions = self.schema.find(path).decode(self.find(path))
+            atomic_positions = find_xsd_element(self.schema, path).decode(self.find(path))
             atoms = atomic_positions.get('atom', [])
             if not isinstance(atoms, list):
                 atoms = [atoms]
             symbols = [a['@name'] for a in atoms]
             i0 = range(3 * len(atoms))[::3]
             i1 = range(3 * len(atoms) + 1)[3::3]
-            forces = [forces['$'][i:j] for i, j in zip(i0, i1)]
+            forces = [forces[i:j] for i, j in zip(i0, i1)]
             return symbols, forces
 
     @requires_xml_data
@@ -616,7 +1133,7 @@ class PwDocument(QeDocument):
         :return: nested list with k_points
         """
         path = './/output//ks_energies/k_point'
-        return [self.schema.find(path).decode(e)['$'] for e in self.findall(path)]
+        return [find_xsd_element(self.schema, path).decode(e)['$'] for e in self.findall(path)]
 
     @requires_xml_data
     def get_ks_eigenvalues(self):
@@ -628,7 +1145,7 @@ class PwDocument(QeDocument):
         path = './/output//ks_energies/eigenvalues'
         eigenvalues = []
         for e in self.findall(path):
-            obj = self.schema.find(path).decode(e)
+            obj = find_xsd_element(self.schema, path).decode(e)
             if isinstance(obj, dict):
                 eigenvalues.append(obj['$'])  # pragma: no cover
             else:
@@ -644,7 +1161,76 @@ class PwDocument(QeDocument):
         :return: total energy in Hartree Units
         """
         path = './/output//etot'
-        return self.schema.find(path).decode(self.find(path))
+        elem = self.find(path)
+        if elem is not None:
+            return find_xsd_element(self.schema, path).decode(elem)
+
+    # NumPy array accessors: values are parsed directly from the text of the
+    # elements with a bulk conversion, bypassing the decoding of the schema.
+
+    @requires_xml_data
+    def get_atomic_positions_array(self):
+        """
+        Gets atomic symbols and atomic positions from XML output data.
+
+        :return: the list of atomic symbols and an array with shape (nat, 3) \
+        containing the coordinates.
+        """
+        elem = self.find('.//output//atomic_positions')
+        if elem is not None:
+            atoms = elem.findall('atom')
+            symbols = [a.get('name') for a in atoms]
+            positions = text_to_array(' '.join(a.text for a in atoms))
+            return symbols, positions.reshape(len(atoms), 3)
+
+    @requires_xml_data
+    def get_stress_array(self):
+        """
+        Gets stress tensor from the XML output data, if present.
+
+        :return: an array with shape (3, 3) containing the stress tensor.
+        """
+        elem = self.find('.//output//stress')
+        if elem is not None:
+            stress = text_to_array(elem.text).reshape(3, 3)
+            return np.ascontiguousarray(stress.T)
+
+    @requires_xml_data
+    def get_forces_array(self):
+        """
+        Gets forces from the XML output data, if present.
+
+        :return: the list of atomic symbols and an array with shape (nat, 3) \
+        containing the forces in atomic units.
+        """
+        elem = self.find('.//output/forces')
+        if elem is not None:
+            atoms = self.findall('.//output//atomic_positions/atom')
+            symbols = [a.get('name') for a in atoms]
+            return symbols, text_to_array(elem.text).reshape(-1, 3)
+
+    @requires_xml_data
+    def get_k_points_array(self):
+        """
+        Extracts the k_points from the XML output data.
+
+        :return: an array with shape (nks, 3) containing the k_points.
+        """
+        elements = self.findall('.//output//ks_energies/k_point')
+        return text_to_array(' '.join(e.text for e in elements)).reshape(len(elements), 3)
+
+    @requires_xml_data
+    def get_ks_eigenvalues_array(self):
+        """
+        Extracts the eigenvalues from the XML output data.
+
+        :return: an array with shape (nks, nbnd) containing the KS eigenvalues \
+        for each k_point in Hartree Units.
+        """
+        elements = self.findall('.//output//ks_energies/eigenvalues')
+        if not elements:
+            return np.empty((0, 0))
+        return text_to_array(' '.join(e.text for e in elements)).reshape(len(elements), -1)
 
 
 class PhononDocument(QeDocument):
@@ -671,6 +1257,12 @@ class PhononDocument(QeDocument):
         """
         return super(PhononDocument, self).get_fortran_input(use_defaults=use_defaults)
 
+    def iter_fortran_input(self, use_defaults=False):
+        """
+        Overrides iter_fortran_input() setting *use_defaults* optional argument to False.
+        """
+        return super(PhononDocument, self).iter_fortran_input(use_defaults=use_defaults)
+
 
 class NebDocument(QeDocument):
     """
@@ -729,7 +1321,11 @@ class EPWDocument(QeDocument):
         return 'input'
 
     def get_fortran_input(self, use_defaults=False):
-        """overrides get_fortran_input adding title-line on top and
+        """overrides get_fortran_input setting *use_defaults* optional argument to false"""
+        return super().get_fortran_input(use_defaults)
+
+    def iter_fortran_input(self, use_defaults=False):
+        """overrides iter_fortran_input adding title-line on top and
            and setting *use_defaults* optional argument to false
         """
         path = './input/control_variables/title'
@@ -738,4 +1334,4 @@ class EPWDocument(QeDocument):
             title = str(element.text)
         else:
             title = "---"
-        return "\n".join([title, super().get_fortran_input(use_defaults)])
+        return itertools.chain([title], super().iter_fortran_input(use_defaults))
@@ -8,8 +8,9 @@
 import numpy as np
 import h5py
 
-__all__ = ['read_charge_file', 'get_wf_attributes', 'get_wavefunctions',
-           'get_wfc_miller_indices']
+__all__ = ['read_charge_file', 'get_charge_density_grid', 'get_wf_attributes', 'get_wavefunctions',
+           'iter_wavefunctions', 'get_wfc_miller_indices', 'WfcDataset',
+           'ChargeDensity', 'open_hdf5_file', 'clear_hdf5_file_cache']
 
 
 def read_charge_file(filename):
@@ -36,6 +37,56 @@ def read_charge_file(filename):
         return res
 
 
+def is_true(value):
+    """Converts a boolean attribute of a QE HDF5 file, also if it's a Fortran logical string."""
+    if isinstance(value, bytes):
+        value = value.decode()
+    if isinstance(value, str):
+        return value.strip().strip('.').upper() in ('TRUE', 'T')
+    return bool(value)
+
+
+def get_charge_density_grid(charge, nr=None, component='rhotot_g', dtype=np.float64):
+    """
+    Computes the charge density on a real-space grid, scattering the G-space
+    coefficients onto an FFT grid and applying an inverse FFT. For gamma-only
+    files the missing half of the coefficients is completed with the complex
+    conjugates of the stored ones.
+
+    :param charge: the dictionary returned by :func:`read_charge_file` or \
+    the path of a charge density file.
+    :param nr: the shape of the grid, default is the minimum grid *nr_min* \
+    that contains all the G-vectors of the file.
+    :param component: the G-space component to transform, 'rhotot_g' for the \
+    total charge or 'rhodiff_g' for the magnetization of spin-polarized runs.
+    :param dtype: the data type of the result, use `numpy.float32` to halve \
+    the memory used by the FFT and by the result.
+    :return: a numpy array with shape *nr*, the charge density in real space.
+    """
+    if isinstance(charge, str):
+        charge = read_charge_file(charge)
+
+    nr_min = tuple(int(x) for x in charge['nr_min'])
+    nr = nr_min if nr is None else tuple(int(x) for x in nr)
+    if len(nr) != 3 or any(n < m for n, m in zip(nr, nr_min)):
+        raise ValueError("grid size must be 3 integers not lower than %r" % (nr_min,))
+
+    dtype = np.dtype(dtype)
+    complex_dtype = np.complex64 if dtype == np.float32 else np.complex128
+    rhog = np.asarray(charge[component], dtype=complex_dtype)
+
+    mill = np.asarray(charge['MillInd'])
+    i, j, k = (np.mod(mill[:, n], nr[n]) for n in range(3))
+    grid = np.zeros(nr, dtype=complex_dtype)
+    if is_true(charge.get('gamma_only', False)):
+        grid[-i % nr[0], -j % nr[1], -k % nr[2]] = rhog.conj()
+    grid[i, j, k] = rhog
+
+    # The density is the sum of the coefficients, without the 1/N normalization
+    grid = np.fft.ifftn(grid, norm='forward')
+    return grid.real.astype(dtype)
+
+
 # TODO update to the new format
 def get_wf_attributes(filename):
     """
@@ -47,34 +98,98 @@ def get_wf_attributes(filename):
     with h5py.File(filename, "r") as f:
         res = dict(f.attrs)
         mi_attrs = f.get('MillerIndices').attrs
-        bg = np.array(mi_attrs.get(x) for x in ['bg1', 'bg2', 'bg3'])
+        bg = np.array([mi_attrs.get(x) for x in ['bg1', 'bg2', 'bg3']])
         res.update({'bg': bg})
     return res
 
 
-def get_wavefunctions(filename, start_band=None, stop_band=None):
+def _get_evc_ranges(f, start_band, stop_band, start_pw, stop_pw):
+    """Returns the normalized ranges of bands and plane waves to read from a wfc file."""
+    evc = f['evc']
+    if start_band is None:
+        start_band = 0
+    if stop_band is None:
+        stop_band = f.attrs.get('nbnd')
+    if stop_band == start_band:
+        stop_band = start_band + 1
+    start_band, stop_band, _ = slice(start_band, stop_band).indices(evc.shape[0])
+    start_pw, stop_pw, _ = slice(start_pw, stop_pw).indices(evc.shape[1] // 2)
+    return start_band, max(start_band, stop_band), start_pw, max(start_pw, stop_pw)
+
+
+def get_wavefunctions(filename, start_band=None, stop_band=None,
+                      start_pw=None, stop_pw=None, out=None):
     """
     Returns a numpy array with the wave functions for bands from start_band to
     stop_band. If not specified starts from 1st band and ends with last one.
-    Band numbering is Python style starts from 0.abs
+    Band numbering is Python style starts from 0. The interleaved real and
+    imaginary parts stored in the file are read directly into a complex array,
+    without intermediate conversions.
 
     :param filename: path to the wfc file
     :param start_band: first band to read, default first band in the file
     :param stop_band:  last band to read, default last band in the file
+    :param start_pw: first plane wave to read, default first plane wave in the file
+    :param stop_pw: last plane wave to read, default last plane wave in the file
+    :param out: optional C-contiguous complex128 array with shape [nbnd,npw] \
+    where to write the wave functions.
     :return: a numpy array with shape [nbnd,npw]
     """
     with h5py.File(filename, "r") as f:
-        igwx = f.attrs.get('igwx')
-        if start_band is None:
-            start_band = 0
-        if stop_band is None:
-            stop_band = f.attrs.get('nbnd')
-        if stop_band == start_band:
-            stop_band = start_band + 1
-        res = f.get('evc')[start_band:stop_band, :]
-
-    res = np.asarray(x.reshape([igwx, 2]).dot([1.e0, 1.e0j]) for x in res[:])
-    return res
+        evc = f['evc']
+        start_band, stop_band, start_pw, stop_pw = \
+            _get_evc_ranges(f, start_band, stop_band, start_pw, stop_pw)
+
+        shape = stop_band - start_band, stop_pw - start_pw
+        if out is None:
+            out = np.empty(shape, dtype=np.complex128)
+        elif out.shape != shape:
+            raise ValueError("wrong shape %r for output array, %r is required"
+                             % (out.shape, shape))
+        elif out.dtype != np.complex128 or not out.flags.c_contiguous:
+            raise TypeError("output array must be a C-contiguous array of complex128")
+
+        if out.size:
+            # A complex128 array is a view of interleaved real/imaginary float64 values
+            selection = np.s_[start_band:stop_band, 2 * start_pw:2 * stop_pw]
+            evc.read_direct(out.view(np.float64), source_sel=selection)
+
+    return out
+
+
+def iter_wavefunctions(filename, block_size=16, start_band=None, stop_band=None,
+                       start_pw=None, stop_pw=None):
+    """
+    Iterates over the wave functions of a wfc file by blocks of bands, reading
+    each block with a single read of the file. The memory used is bounded by the
+    size of a block, because all the blocks are read into the same buffer: copy
+    a block if it has to be kept after the next iteration.
+
+    :param filename: path to the wfc file
+    :param block_size: the number of bands of each block, default is 16
+    :param start_band: first band to read, default first band in the file
+    :param stop_band:  last band to read, default last band in the file
+    :param start_pw: first plane wave to read, default first plane wave in the file
+    :param stop_pw: last plane wave to read, default last plane wave in the file
+    :return: an iterator of couples with the index of the first band of the block \
+    and a complex128 array with shape [nbnd,npw], where nbnd is at most block_size.
+    """
+    if block_size < 1:
+        raise ValueError("block_size must be a positive integer")
+
+    with h5py.File(filename, "r") as f:
+        evc = f['evc']
+        start_band, stop_band, start_pw, stop_pw = \
+            _get_evc_ranges(f, start_band, stop_band, start_pw, stop_pw)
+
+        block_size = max(1, min(block_size, stop_band - start_band))
+        buffer = np.empty((block_size, stop_pw - start_pw), dtype=np.complex128)
+        for band in range(start_band, stop_band, block_size):
+            block = buffer[:min(block_size, stop_band - band)]
+            if block.size:
+                selection = np.s_[band:band + block.shape[0], 2 * start_pw:2 * stop_pw]
+                evc.read_direct(block.view(np.float64), source_sel=selection)
+            yield band, block
 
 
 def get_wfc_miller_indices(filename):
@@ -87,3 +202,7 @@ def get_wfc_miller_indices(filename):
     with h5py.File(filename, "r") as f:
         res = f.get("MillerIndices")[:, :]
     return res
+
+
+from .datasets import WfcDataset, ChargeDensity, \
+    open_hdf5_file, clear_hdf5_file_cache  # noqa: E402
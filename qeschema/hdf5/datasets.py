@@ -0,0 +1,359 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+#
+# Authors: Davide Brunato
+#
+"""
+Dataset-level readers of the HDF5 files written by PW in a save directory.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+from . import get_wavefunctions, get_wf_attributes, get_wfc_miller_indices, \
+    get_charge_density_grid, is_true
+
+__all__ = ['WfcDataset', 'ChargeDensity', 'open_hdf5_file', 'clear_hdf5_file_cache']
+
+WFC_FILENAME_PATTERN = re.compile(r'^wfc(|up|dw)(\d+)\.hdf5$')
+
+
+class WfcDataset(object):
+    """
+    The wavefunctions of a PW run, written in one *wfcN.hdf5* file for each
+    k-point (*wfcupN.hdf5* and *wfcdwN.hdf5* for spin-polarized runs, that
+    are ordered as up and down k-points). K-points and bands are indexed
+    Python style starting from 0.
+
+    Items are read lazily: `dataset[ik]` returns all the bands of a k-point,
+    `dataset[ik, ibnd]` a single band and `dataset[ik, start:stop]` a range
+    of bands. Wavefunctions preloaded with :meth:`load` are served from memory.
+
+    :param dirname: the save directory of the run.
+    :param max_workers: the number of workers used by :meth:`load`, \
+    default is the number of CPUs.
+    :param use_processes: if `True` :meth:`load` uses a pool of processes \
+    instead of a pool of threads. Processes can read files in parallel, \
+    while reads from threads are serialized by h5py.
+    """
+    def __init__(self, dirname, max_workers=None, use_processes=False):
+        if not os.path.isdir(dirname):
+            raise FileNotFoundError("directory %r not found" % dirname)
+
+        matches = []
+        for name in os.listdir(dirname):
+            match = WFC_FILENAME_PATTERN.match(name)
+            if match is not None:
+                spin = ('', 'up', 'dw').index(match.group(1))
+                matches.append((spin, int(match.group(2)), name))
+
+        self.dirname = dirname
+        self.filenames = [os.path.join(dirname, x[2]) for x in sorted(matches)]
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+
+        self._attributes = {}
+        self._miller_indices = {}
+        self._wavefunctions = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.dirname)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @property
+    def nks(self):
+        """The number of k-points of the dataset."""
+        return len(self.filenames)
+
+    def _get_index(self, ik):
+        """Returns the non-negative index of a k-point."""
+        index = int(ik)
+        if index < 0:
+            index += len(self.filenames)
+        if not 0 <= index < len(self.filenames):
+            raise IndexError("k-point index %r out of range" % ik)
+        return index
+
+    def get_attributes(self, ik):
+        """Returns the attributes of the wfc file of a k-point."""
+        ik = self._get_index(ik)
+        try:
+            return self._attributes[ik]
+        except KeyError:
+            attributes = get_wf_attributes(self.filenames[ik])
+            with self._lock:
+                return self._attributes.setdefault(ik, attributes)
+
+    def get_miller_indices(self, ik):
+        """Returns the Miller indices of the plane waves of a k-point, cached at first call."""
+        ik = self._get_index(ik)
+        try:
+            return self._miller_indices[ik]
+        except KeyError:
+            miller_indices = get_wfc_miller_indices(self.filenames[ik])
+            with self._lock:
+                return self._miller_indices.setdefault(ik, miller_indices)
+
+    def _get_band_range(self, ik, bands):
+        nbnd = int(self.get_attributes(ik)['nbnd'])
+        if isinstance(bands, slice):
+            return bands.indices(nbnd)
+
+        band = int(bands)
+        if band < 0:
+            band += nbnd
+        if not 0 <= band < nbnd:
+            raise IndexError("band index %r out of range" % bands)
+        return band, band + 1, 1
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            ik, bands = key
+        else:
+            ik, bands = key, slice(None)
+
+        ik = self._get_index(ik)
+        filename = self.filenames[ik]
+        start, stop, step = self._get_band_range(ik, bands)
+
+        try:
+            first, loaded = self._wavefunctions[ik]
+        except KeyError:
+            loaded = None
+
+        if loaded is not None and step > 0 and first <= start \
+                and max(start, stop) <= first + len(loaded):
+            wavefunctions = loaded[start - first:stop - first:step]
+        elif step != 1:
+            wavefunctions = get_wavefunctions(filename)[bands]
+        elif stop <= start:
+            npw = int(self.get_attributes(ik)['igwx'])
+            wavefunctions = np.empty((0, npw), dtype=np.complex128)
+        else:
+            wavefunctions = get_wavefunctions(filename, start, stop)
+
+        return wavefunctions if isinstance(bands, slice) else wavefunctions[0]
+
+    def load(self, kpoints=None, start_band=None, stop_band=None):
+        """
+        Loads the wavefunctions of the selected k-points concurrently, keeping
+        them in memory for next accesses, together with their Miller indices.
+
+        :param kpoints: a sequence of k-point indexes, default is all the k-points.
+        :param start_band: first band to load, default first band in the files.
+        :param stop_band: last band to load, default last band in the files.
+        :return: a dictionary from k-point indexes to arrays with shape [nbnd,npw].
+        """
+        if kpoints is None:
+            kpoints = range(self.nks)
+        kpoints = [self._get_index(ik) for ik in kpoints]
+        filenames = [self.filenames[ik] for ik in kpoints]
+
+        if self.use_processes:
+            executor = ProcessPoolExecutor(self.max_workers)
+        else:
+            executor = ThreadPoolExecutor(self.max_workers)
+
+        with executor:
+            wfc_futures = [executor.submit(get_wavefunctions, x, start_band, stop_band)
+                           for x in filenames]
+            mill_futures = [None if ik in self._miller_indices else
+                            executor.submit(get_wfc_miller_indices, x)
+                            for ik, x in zip(kpoints, filenames)]
+
+            results = {}
+            for ik, wfc_future, mill_future in zip(kpoints, wfc_futures, mill_futures):
+                if start_band is None:
+                    first = 0
+                else:
+                    first = self._get_band_range(ik, slice(start_band, stop_band))[0]
+                results[ik] = wfc_future.result()
+                with self._lock:
+                    self._wavefunctions[ik] = first, results[ik]
+                    if mill_future is not None:
+                        self._miller_indices[ik] = mill_future.result()
+
+        return results
+
+    def clear(self):
+        """Releases the preloaded wavefunctions and the cached Miller indices."""
+        with self._lock:
+            self._attributes.clear()
+            self._miller_indices.clear()
+            self._wavefunctions.clear()
+
+
+class HDF5FileCache(object):
+    """
+    A bounded LRU cache of HDF5 files opened in read mode. A cached handle
+    is reused while the file is unchanged, evicted handles are closed.
+
+    :param maxsize: the maximum number of open files kept in the cache.
+    """
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def open(self, filename):
+        path = os.path.realpath(filename)
+        stat = os.stat(path)
+        stamp = stat.st_mtime_ns, stat.st_size
+
+        with self._lock:
+            try:
+                file_stamp, h5f = self._files[path]
+            except KeyError:
+                pass
+            else:
+                if file_stamp == stamp and h5f.id.valid:
+                    self._files.move_to_end(path)
+                    return h5f
+                del self._files[path]
+                if h5f.id.valid:
+                    h5f.close()
+
+            h5f = h5py.File(path, 'r')
+            self._files[path] = stamp, h5f
+            while len(self._files) > self.maxsize:
+                _, (_, evicted) = self._files.popitem(last=False)
+                if evicted.id.valid:
+                    evicted.close()
+            return h5f
+
+    def clear(self):
+        with self._lock:
+            for _, h5f in self._files.values():
+                if h5f.id.valid:
+                    h5f.close()
+            self._files.clear()
+
+
+_file_cache = HDF5FileCache()
+
+
+def open_hdf5_file(filename):
+    """
+    Returns an HDF5 file opened in read mode, reusing a cached handle if
+    the file has already been opened and it's unchanged. Don't close the
+    returned file, use :func:`clear_hdf5_file_cache` to release the handles.
+    """
+    return _file_cache.open(filename)
+
+
+def clear_hdf5_file_cache():
+    """Closes all the HDF5 files opened by :func:`open_hdf5_file`."""
+    _file_cache.clear()
+
+
+class ChargeDensity(object):
+    """
+    A lazy reader of a PW charge density file in HDF5 format. Data is read on
+    demand from the datasets of the file, opened through a cache of handles,
+    so only the requested spin component or subset of G-vectors is loaded.
+    G-vectors are stored by PW in order of increasing modulus, so a leading
+    range of coefficients is a sphere in G-space.
+
+    :param filename: the path of the charge density file.
+    """
+    COMPONENTS = ('rhotot_g', 'rhodiff_g')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.attrs = dict(self.file.attrs.items())
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.filename)
+
+    @property
+    def file(self):
+        """The h5py file, fetched from the cache of open files."""
+        return open_hdf5_file(self.filename)
+
+    @property
+    def ngm_g(self):
+        return int(self.attrs['ngm_g'])
+
+    @property
+    def gamma_only(self):
+        return is_true(self.attrs.get('gamma_only', False))
+
+    @property
+    def components(self):
+        """The G-space components available in the file."""
+        return tuple(x for x in self.COMPONENTS if x in self.file)
+
+    @property
+    def miller_indices(self):
+        """The h5py dataset of Miller indices, read on demand by slicing."""
+        return self.file['MillerIndices']
+
+    @property
+    def nr_min(self):
+        """The minimum size of the FFT grid that contains all the G-vectors."""
+        max_indices = np.abs(self.miller_indices[:]).max(axis=0)
+        return 2 * max_indices + 1
+
+    def get_component(self, name='rhotot_g', start=None, stop=None, indices=None):
+        """
+        Reads the coefficients of a G-space component.
+
+        :param name: the name of the component, 'rhotot_g' or 'rhodiff_g'.
+        :param start: the first G-vector to read, default is the first one.
+        :param stop: the G-vector where the reading stops, default is the last one.
+        :param indices: an optional array of G-vector indices to read, that \
+        overrides *start* and *stop*. Negative indices count from the end.
+        :return: a complex128 array.
+        """
+        if name not in self.COMPONENTS:
+            raise ValueError("unknown component %r" % name)
+        try:
+            dataset = self.file[name]
+        except KeyError:
+            raise KeyError("component %r not found in %r" % (name, self.filename)) from None
+
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int64)
+            if not indices.size:
+                return np.empty(0, dtype=np.complex128)
+
+            size = dataset.shape[0] // 2
+            indices = np.where(indices < 0, indices + size, indices)
+            if indices.min() < 0 or indices.max() >= size:
+                raise IndexError("G-vector indices out of range for a component "
+                                 "with %d coefficients" % size)
+            start, stop = int(indices.min()), int(indices.max()) + 1
+            return self.get_component(name, start, stop)[indices - start]
+
+        start, stop, _ = slice(start, stop).indices(dataset.shape[0] // 2)
+        out = np.empty(max(stop - start, 0), dtype=np.complex128)
+        if out.size:
+            dataset.read_direct(out.view(np.float64), source_sel=np.s_[2 * start:2 * stop])
+        return out
+
+    def get_grid(self, nr=None, component='rhotot_g', dtype=np.float64):
+        """
+        Computes the component on a real-space grid, see :func:`get_charge_density_grid`.
+        """
+        charge = {
+            'gamma_only': self.gamma_only,
+            'MillInd': self.miller_indices[:],
+            component: self.get_component(component),
+        }
+        charge['nr_min'] = 2 * np.abs(charge['MillInd']).max(axis=0) + 1
+        return get_charge_density_grid(charge, nr, component, dtype)
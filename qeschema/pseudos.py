@@ -0,0 +1,383 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+#
+# Authors: Davide Brunato
+#
+"""
+An index of a directory of pseudo-potential files, with a cache of parsed files.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from .upf import read_pseudo_file, read_pseudo_header
+
+logger = logging.getLogger('qeschema')
+
+__all__ = ['PseudoInfo', 'PseudoLibrary', 'get_functional_name']
+
+PseudoInfo = namedtuple('PseudoInfo', 'filename element functional z_valence wfc_cutoff '
+                                      'rho_cutoff pseudo_type relativistic mesh_size')
+
+# Short names of the functionals, from the components written in the headers
+FUNCTIONAL_NAMES = {
+    ('SLA', 'PZ'): 'PZ',
+    ('SLA', 'PZ', 'NOGX', 'NOGC'): 'PZ',
+    ('SLA', 'PW'): 'PW',
+    ('SLA', 'PW', 'NOGX', 'NOGC'): 'PW',
+    ('SLA', 'PW', 'PBX', 'PBC'): 'PBE',
+    ('SLA', 'PW', 'PSX', 'PSC'): 'PBESOL',
+    ('SLA', 'PW', 'REVX', 'PBC'): 'REVPBE',
+    ('SLA', 'PW', 'GGX', 'GGC'): 'PW91',
+    ('SLA', 'B88', 'LYP', 'BLYP'): 'BLYP',
+    ('SLA', 'PZ', 'B88', 'P86'): 'BP',
+}
+
+INDEX_FILENAME = 'index.json'
+INDEX_VERSION = 1
+STORE_VERSION = 2  # Increase at each change of the output of read_pseudo_file or pack_pseudo
+
+
+def get_functional_name(functional):
+    """
+    Returns the short name of the functional of a pseudo-potential, e.g. 'PBE'
+    for ' SLA  PW   PBX  PBC'. Functionals without a short name are returned
+    as upper case strings with single spaces between the components.
+    """
+    components = tuple(functional.replace('-', ' ').upper().split())
+    try:
+        return FUNCTIONAL_NAMES[components]
+    except KeyError:
+        return ' '.join(components)
+
+
+def get_pseudo_info(filename, header):
+    """Builds the index entry of a pseudo-potential file from its header."""
+    def to_float(name):
+        try:
+            return float(header[name].replace('D', 'E').replace('d', 'e'))
+        except (KeyError, ValueError):
+            return None
+
+    try:
+        mesh_size = int(header['mesh_size'])
+    except (KeyError, ValueError):
+        mesh_size = None
+
+    return PseudoInfo(
+        filename=filename,
+        element=header.get('element', '').strip().capitalize(),
+        functional=get_functional_name(header.get('functional', '')),
+        z_valence=to_float('z_valence'),
+        wfc_cutoff=to_float('wfc_cutoff'),
+        rho_cutoff=to_float('rho_cutoff'),
+        pseudo_type=header.get('pseudo_type', '').strip().upper(),
+        relativistic=header.get('relativistic', '').strip().lower(),
+        mesh_size=mesh_size,
+    )
+
+
+def get_file_digest(filename):
+    """Returns the SHA-1 digest of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def pack_pseudo(pseudo):
+    """
+    Splits a parsed pseudo-potential into a JSON-serializable skeleton and a
+    dictionary of arrays, referenced in the skeleton by {'__array__': key}.
+    """
+    arrays = {}
+
+    def pack(obj):
+        if isinstance(obj, np.ndarray):
+            key = 'a%d' % len(arrays)
+            arrays[key] = obj
+            return {'__array__': key}
+        elif isinstance(obj, dict):
+            return {k: pack(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [pack(v) for v in obj]
+        return obj
+
+    return pack(pseudo), arrays
+
+
+def unpack_pseudo(skeleton, arrays):
+    """Rebuilds a parsed pseudo-potential packed by :func:`pack_pseudo`."""
+    def unpack(obj):
+        if isinstance(obj, dict):
+            if len(obj) == 1 and '__array__' in obj:
+                return arrays[obj['__array__']]
+            return {k: unpack(v) for k, v in obj.items()}
+        elif isinstance(obj, list):
+            return [unpack(v) for v in obj]
+        return obj
+
+    return unpack(skeleton)
+
+
+class PseudoLibrary(object):
+    """
+    An index of the UPF files of a directory of pseudo-potentials. The index
+    is built from the headers of the files only, so it's fast to build and
+    to search. Parsed files are kept in memory and, if a cache directory is
+    provided, are stored in compact *.npz* files named after the SHA-1 digest
+    of the content of the UPF files and the version of the stored format,
+    shared between libraries. The index is
+    also saved in the cache directory and it's updated only for the files
+    whose modification time or size has changed.
+
+    :param directory: the directory of the pseudo-potential files.
+    :param cache_dir: an optional directory for the index and the parsed files, \
+    it's created if it doesn't exist.
+    """
+    def __init__(self, directory, cache_dir=None):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError("directory %r not found" % directory)
+
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self._entries = {}
+        self._pseudos = {}
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_index()
+        self.scan()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.directory)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (self._entries[k]['info'] for k in sorted(self._entries))
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def __getitem__(self, filename):
+        return self._entries[filename]['info']
+
+    @property
+    def index_filename(self):
+        if self.cache_dir is not None:
+            return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    def _get_stamp(self, filename):
+        stat = os.stat(os.path.join(self.directory, filename))
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _load_index(self):
+        try:
+            with open(self.index_filename) as f:
+                index = json.load(f)
+            if index.get('version') != INDEX_VERSION or \
+                    index.get('directory') != os.path.realpath(self.directory):
+                return
+            for filename, entry in index['files'].items():
+                entry['info'] = PseudoInfo(filename, **entry['info'])
+                self._entries[filename] = entry
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as err:
+            logger.warning("Cannot load pseudo-potential index %r: %s",
+                           self.index_filename, err)
+            self._entries.clear()
+
+    def _save_index(self):
+        files = {}
+        for filename, entry in self._entries.items():
+            info = entry['info']._asdict()
+            del info['filename']
+            files[filename] = dict(entry, info=info)
+
+        index = {'version': INDEX_VERSION,
+                 'directory': os.path.realpath(self.directory),
+                 'files': files}
+
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_filename, self.index_filename)
+        except OSError as err:
+            logger.warning("Cannot save pseudo-potential index %r: %s",
+                           self.index_filename, err)
+            if os.path.isfile(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def scan(self):
+        """
+        Updates the index with the UPF files of the directory, reading the
+        headers of new or modified files and removing the deleted files.
+
+        :return: the number of files whose header has been read.
+        """
+        filenames = sorted(x for x in os.listdir(self.directory)
+                           if x.lower().endswith('.upf')
+                           and os.path.isfile(os.path.join(self.directory, x)))
+
+        with self._lock:
+            changed = set(self._entries).difference(filenames)
+            for filename in changed:
+                del self._entries[filename]
+
+            count = 0
+            for filename in filenames:
+                stamp = self._get_stamp(filename)
+                entry = self._entries.get(filename)
+                if entry is not None and entry['stamp'] == stamp:
+                    continue
+
+                try:
+                    header = read_pseudo_header(os.path.join(self.directory, filename))
+                except (OSError, ValueError, SyntaxError) as err:
+                    logger.warning("Skip pseudo-potential file %r: %s", filename, err)
+                    self._entries.pop(filename, None)
+                else:
+                    self._entries[filename] = {
+                        'stamp': stamp,
+                        'digest': None,
+                        'info': get_pseudo_info(filename, header),
+                    }
+                    count += 1
+                changed.add(filename)
+
+            if changed and self.cache_dir is not None:
+                self._save_index()
+        return count
+
+    def find(self, element=None, functional=None, **kwargs):
+        """
+        Finds the pseudo-potentials matching the given values. String values are
+        matched case-insensitively and the functional can be matched either by
+        its short name (e.g. 'PBE') or by its components.
+
+        :param element: the chemical symbol of the element.
+        :param functional: the exchange-correlation functional.
+        :param kwargs: other fields of :class:`PseudoInfo` to match.
+        :return: a list of :class:`PseudoInfo` instances sorted by filename.
+        """
+        criteria = dict(kwargs)
+        if element is not None:
+            criteria['element'] = element
+        if functional is not None:
+            criteria['functional'] = get_functional_name(functional)
+
+        unknown = set(criteria).difference(PseudoInfo._fields)
+        if unknown:
+            raise TypeError("unknown fields %r" % sorted(unknown))
+
+        for name, value in criteria.items():
+            if isinstance(value, str):
+                criteria[name] = value.strip().lower()
+
+        def match(info):
+            for name, value in criteria.items():
+                field = getattr(info, name)
+                if isinstance(field, str):
+                    field = field.lower()
+                if field != value:
+                    return False
+            return True
+
+        return [info for info in self if match(info)]
+
+    def get_digest(self, filename):
+        """Returns the SHA-1 digest of a file of the library, computed once for each version."""
+        entry = self._entries[filename]
+        if entry['stamp'] != self._get_stamp(filename):
+            self.scan()
+            entry = self._entries[filename]
+
+        if entry['digest'] is None:
+            digest = get_file_digest(os.path.join(self.directory, filename))
+            with self._lock:
+                entry['digest'] = digest
+                if self.cache_dir is not None:
+                    self._save_index()
+        return entry['digest']
+
+    def load(self, filename):
+        """
+        Returns the parsed content of a pseudo-potential file, as returned by
+        :func:`qeschema.upf.read_pseudo_file`. The result is shared between
+        calls, so it must not be modified.
+
+        :param filename: the name of a file of the library or a :class:`PseudoInfo`.
+        """
+        if isinstance(filename, PseudoInfo):
+            filename = filename.filename
+        if filename not in self._entries:
+            raise KeyError("pseudo-potential %r not found in %r" % (filename, self.directory))
+
+        digest = self.get_digest(filename)
+        try:
+            return self._pseudos[digest]
+        except KeyError:
+            pass
+
+        pseudo = self._load_stored(digest)
+        if pseudo is None:
+            pseudo = read_pseudo_file(os.path.join(self.directory, filename))
+            self._store(digest, pseudo)
+
+        with self._lock:
+            return self._pseudos.setdefault(digest, pseudo)
+
+    def get_store_filename(self, digest):
+        return os.path.join(self.cache_dir, '%s-v%d.npz' % (digest, STORE_VERSION))
+
+    def _load_stored(self, digest):
+        if self.cache_dir is None:
+            return None
+
+        store_filename = self.get_store_filename(digest)
+        try:
+            with np.load(store_filename, allow_pickle=False) as npz:
+                arrays = {k: npz[k] for k in npz.files}
+            skeleton = json.loads(str(arrays.pop('__skeleton__')))
+            return unpack_pseudo(skeleton, arrays)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as err:
+            logger.warning("Cannot load stored pseudo-potential %r: %s", store_filename, err)
+            return None
+
+    def _store(self, digest, pseudo):
+        if self.cache_dir is None:
+            return
+
+        skeleton, arrays = pack_pseudo(pseudo)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, __skeleton__=np.array(json.dumps(skeleton)), **arrays)
+            os.replace(tmp_filename, self.get_store_filename(digest))
+        except OSError as err:
+            logger.warning("Cannot store pseudo-potential %r: %s", digest, err)
+            if os.path.isfile(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def clear(self):
+        """Releases the parsed files kept in memory."""
+        with self._lock:
+            self._pseudos.clear()
@@ -0,0 +1,303 @@
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+#
+# Authors: Davide Brunato
+#
+"""
+A process-wide cache of compiled XSD schemas, shared by XML documents,
+backed by an optional on-disk store of precompiled schemas.
+"""
+import hashlib
+import logging
+import os.path
+import pickle
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+import xmlschema
+
+logger = logging.getLogger('qeschema')
+
+__all__ = ['SchemaCache', 'SchemaCacheInfo', 'SchemaStore', 'schema_cache',
+           'get_schema', 'clear_schema_cache', 'schema_cache_info',
+           'get_default_store_dir', 'find_xsd_element']
+
+SchemaCacheInfo = namedtuple('SchemaCacheInfo', 'hits misses maxsize currsize')
+
+
+def get_default_store_dir():
+    """
+    Returns the default directory of the precompiled schema store, that is
+    the value of the environment variable *QESCHEMA_CACHE_DIR* if it's set,
+    otherwise the *qeschema* subdirectory of the user's cache directory.
+    """
+    try:
+        return os.environ['QESCHEMA_CACHE_DIR']
+    except KeyError:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'qeschema')
+
+
+class SchemaStore(object):
+    """
+    An on-disk store of precompiled schemas, saved with the pickle protocol.
+    Each stored schema keeps the modification times and the sizes of all its
+    XSD files, so a stored schema is discarded and rebuilt when one of the
+    files of the schema changes. Stored files are bound to the versions of
+    Python and of the *xmlschema* library that have created them.
+
+    The store is active only if its directory exists. Only use directories
+    that are not writable by other users, because loading a pickle file can
+    execute arbitrary code.
+
+    :param directory: the directory of the store, the default is provided \
+    by :func:`get_default_store_dir`.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or get_default_store_dir()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.directory)
+
+    @property
+    def enabled(self):
+        return os.path.isdir(self.directory)
+
+    def get_store_filename(self, filename):
+        """Returns the path of the stored file for a schema file."""
+        key = '{}|{}|{}'.format(os.path.realpath(filename),
+                                xmlschema.__version__,
+                                '.'.join(map(str, sys.version_info[:2])))
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '%s.pickle' % digest)
+
+    @staticmethod
+    def get_stamps(schema):
+        """Returns the modification times and the sizes of the local files of a schema."""
+        stamps = {}
+        for xsd in schema.maps.iter_schemas():
+            if xsd.url and xsd.url.startswith('file://'):
+                path = url2pathname(urlsplit(xsd.url).path)
+                stat = os.stat(path)
+                stamps[path] = stat.st_mtime_ns, stat.st_size
+        return stamps
+
+    @staticmethod
+    def check_stamps(stamps):
+        """
+        Returns `True` if none of the files of a mapping of stamps, as returned
+        by :meth:`get_stamps`, has been changed or removed.
+        """
+        for path, stamp in stamps.items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stamp != (stat.st_mtime_ns, stat.st_size):
+                return False
+        return True
+
+    def load(self, filename):
+        """
+        Loads a precompiled schema from the store. Returns `None` if the schema
+        is not stored or if the stored schema is outdated or unreadable.
+
+        :param filename: the path of the XSD file.
+        """
+        store_filename = self.get_store_filename(filename)
+        try:
+            with open(store_filename, 'rb') as f:
+                if not self.check_stamps(pickle.load(f)):
+                    logger.debug("Stored schema %r is outdated", store_filename)
+                    return None
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning("Cannot load stored schema %r: %s", store_filename, err)
+            return None
+
+    def save(self, filename, schema):
+        """
+        Saves a compiled schema into the store.
+
+        :param filename: the path of the XSD file.
+        :param schema: the :class:`xmlschema.XMLSchema` instance built from the file.
+        """
+        store_filename = self.get_store_filename(filename)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self.get_stamps(schema), f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(schema, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, store_filename)
+        except Exception as err:
+            logger.warning("Cannot store schema %r: %s", filename, err)
+            if os.path.isfile(tmp_filename):
+                os.unlink(tmp_filename)
+            return False
+        else:
+            logger.debug("Schema %r stored into %r", filename, store_filename)
+            return True
+
+    def clear(self):
+        """Removes all the stored schemas."""
+        if self.enabled:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pickle'):
+                    os.unlink(os.path.join(self.directory, name))
+
+
+class SchemaCache(object):
+    """
+    A bounded LRU cache of compiled :class:`xmlschema.XMLSchema` instances.
+    Entries are keyed by the resolved path of the schema file and are checked
+    against the modification times and the sizes of all the local files of
+    the schema, including the imported and included ones, so a schema with
+    an updated file is compiled again at the next request. On a cache miss the
+    schema is loaded from the on-disk store, if it's enabled, before trying
+    to compile it.
+
+    :param maxsize: the maximum number of compiled schemas kept in the cache.
+    :param store: an optional :class:`SchemaStore` instance.
+    """
+    def __init__(self, maxsize=16, store=None):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._schemas = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def __contains__(self, filename):
+        return os.path.realpath(filename) in self._schemas
+
+    def get_schema(self, filename):
+        """
+        Returns the compiled schema for a schema file, building it if it's
+        missing from the cache or if one of its files has been changed.
+
+        :param filename: the path of the XSD file.
+        :return: an :class:`xmlschema.XMLSchema` instance.
+        """
+        path = os.path.realpath(filename)
+
+        with self._lock:
+            try:
+                stamps, schema = self._schemas[path]
+            except KeyError:
+                pass
+            else:
+                if SchemaStore.check_stamps(stamps):
+                    self.hits += 1
+                    self._schemas.move_to_end(path)
+                    return schema
+                logger.debug("Files of schema %r changed, rebuild the schema", path)
+
+            self.misses += 1
+            schema = self.build_schema(filename)
+            self._schemas[path] = SchemaStore.get_stamps(schema), schema
+            self._schemas.move_to_end(path)
+            while len(self._schemas) > self.maxsize:
+                self._schemas.popitem(last=False)
+            return schema
+
+    def build_schema(self, filename):
+        """
+        Builds a compiled schema instance from an XSD file, using the
+        on-disk store if it's enabled.
+        """
+        store = self.store if self.store is not None and self.store.enabled else None
+        if store is not None:
+            schema = store.load(filename)
+            if schema is not None:
+                logger.debug("Schema for file %r loaded from %r", filename, store)
+                return schema
+
+        logger.debug("Build schema from file %r", filename)
+        schema = xmlschema.XMLSchema(filename)
+        if store is not None:
+            store.save(filename, schema)
+        return schema
+
+    def clear(self):
+        """Removes all the compiled schemas from the cache and resets the counters."""
+        with self._lock:
+            self._schemas.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Returns a named tuple with the statistics of the cache."""
+        return SchemaCacheInfo(self.hits, self.misses, self.maxsize, len(self._schemas))
+
+
+schema_cache = SchemaCache(store=SchemaStore())
+"""The process-wide cache used by XML documents."""
+
+
+def get_schema(source):
+    """
+    Returns a schema instance for a source. Schema files are fetched from the
+    process-wide cache, other sources (text, file-like objects or URLs) are
+    always compiled in a new schema instance.
+
+    :param source: a file path or another source accepted by :class:`xmlschema.XMLSchema`.
+    """
+    if isinstance(source, str) and os.path.isfile(source):
+        return schema_cache.get_schema(source)
+    return xmlschema.XMLSchema(source)
+
+
+def clear_schema_cache():
+    """Clears the process-wide cache of compiled schemas."""
+    schema_cache.clear()
+
+
+def schema_cache_info():
+    """
+    Returns the statistics of the process-wide cache of compiled schemas,
+    as a named tuple with *hits*, *misses*, *maxsize* and *currsize* fields.
+    """
+    return schema_cache.info()
+
+
+# Per-schema indexes of XSD elements by path, kept while the schema is alive.
+_xsd_path_indexes = weakref.WeakKeyDictionary()
+
+
+def find_xsd_element(xsd_component, path):
+    """
+    Finds the XSD element matching a path, memoizing the result in an index
+    associated with the schema or the XSD component. Repeated lookups of the
+    same path are resolved with a dictionary access instead of an XPath
+    selection on the schema.
+
+    :param xsd_component: an :class:`xmlschema.XMLSchema` instance or an XSD element.
+    :param path: an XPath expression without namespace prefixes.
+    :return: the matching XSD element or `None`.
+    """
+    try:
+        index = _xsd_path_indexes[xsd_component]
+    except KeyError:
+        index = _xsd_path_indexes.setdefault(xsd_component, {})
+
+    try:
+        return index[path]
+    except KeyError:
+        xsd_element = index[path] = xsd_component.find(path)
+        return xsd_element
@@ -8,121 +8,422 @@
 """
 A collection of functions for reading different files and quantities.
 """
-import numpy as np
+import codecs
+import logging
+import re
 from xml.etree import ElementTree
+import numpy as np
+
+from .utils import text_to_array
+
+logger = logging.getLogger('qeschema')
+
+__all__ = ['read_pseudo_file', 'read_pseudo_header', 'iter_upf_file']
+
+
+def get_section_array(elem):
+    """
+    Converts the numeric content of a section of a pseudo-potential file to a
+    float64 array. Returns `None` if the section contains non-numeric data.
+    """
+    try:
+        return text_to_array(elem.text)
+    except ValueError:
+        logger.warning("Section %r doesn't contain only numeric data", elem.tag)
+        return None
+
+
+# The fields of the header of UPF v1 files, in order of appearance. The
+# functional is in the first 20 characters of its line, as read by QE.
+UPF_V1_HEADER_FIELDS = (
+    (1, 'element'), (2, 'pseudo_type'), (3, 'core_correction'),
+    (4, 'functional'), (5, 'z_valence'), (6, 'total_psenergy'),
+    (7, 'wfc_cutoff'), (7, 'rho_cutoff'), (8, 'l_max'), (9, 'mesh_size'),
+)
+
+
+ROOT_TAG_PATTERN = re.compile(r'<(UPF|(\w+:)?pseudo)[\s>]')
+
+# Sections of UPF files that don't contain numeric data
+TEXT_SECTIONS = frozenset(('PP_INFO', 'PP_HEADER'))
+
+# Subsections that can be repeated, also when the tags are not numbered
+INDEXED_TAGS = frozenset((
+    'PP_BETA', 'PP_CHI', 'PP_QIJ', 'PP_QIJL', 'PP_AEWFC', 'PP_AEWFC_REL',
+    'PP_PSWFC', 'PP_PSWFC_REL', 'PP_RELWFC', 'PP_RELBETA',
+    'PP_GIPAW_CORE_ORBITAL', 'PP_GIPAW_ORBITAL',
+))
+
+# The number of lines fed to the parser at once
+FEED_LINES = 1024
+
+# Patterns and sizes for scanning the head of UPF files for the PP_HEADER
+HEADER_START_PATTERN = re.compile(r'<(\w+:)?(PP_HEADER|pp_header)(?=[\s/>])')
+HEADER_TAG_PATTERN = re.compile(r'''<[\w:]+[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>''')
+HEADER_END_PATTERN = re.compile(r'</(\w+:)?(PP_HEADER|pp_header)\s*>')
+PREFIX_PATTERN = re.compile(r'(</?)\w+:')
+HEADER_CHUNK_SIZE = 8192
+HEADER_SCAN_LIMIT = 1 << 20
+
+
+def iter_upf_file(filename):
+    """
+    Creates an iterator over the lines of an UPF file,
+    inserting the root <UPF> tag when missing.
+    """
+    with open(filename, 'r') as f:
+        fake_root = None
+        for line in f:
+            if fake_root is not None:
+                line = line.replace('&input', '&amp;input')
+                yield line
+            else:
+                line = line.strip()
+                if line.startswith('<?'):
+                    yield line
+                elif ROOT_TAG_PATTERN.match(line) is not None:
+                    yield line
+                    fake_root = False
+                elif line:
+                    yield "<UPF>"
+                    yield line
+                    fake_root = True
+    if fake_root is True:
+        yield "</UPF>"
+
+
+def iter_upf_events(filename, events=('end',)):
+    """
+    Parses an UPF file incrementally, yielding the events of an
+    :class:`xml.etree.ElementTree.XMLPullParser` for the tags of the file.
+    """
+    parser = ElementTree.XMLPullParser(events=events)
+    lines = []
+    for line in iter_upf_file(filename):
+        lines.append(line)
+        if len(lines) >= FEED_LINES:
+            parser.feed(''.join(lines))
+            lines.clear()
+            yield from parser.read_events()
+
+    parser.feed(''.join(lines))
+    parser.close()
+    yield from parser.read_events()
+
+
+def get_section_name(tag):
+    """
+    Returns the name of a section of an UPF file from its tag, without the
+    namespace and in upper case, so the lowercase tags of UPF-schema files
+    have the names of UPF v2 files.
+    """
+    name = tag.rpartition('}')[2]
+    return name.upper() if name[:3].lower() == 'pp_' else name
+
+
+def get_header(elem):
+    """
+    Returns the PP_HEADER of an UPF file as a dictionary. The header is
+    written in the attributes for UPF v2 files, in child elements for
+    UPF-schema files and in formatted text lines for UPF v1 files.
+    """
+    if elem.attrib:
+        return dict(elem.attrib)
+    elif len(elem):
+        return {get_section_name(child.tag): (child.text or '').strip() for child in elem}
+    return get_v1_header(elem.text or '')
+
+
+def get_v1_header(text):
+    """
+    Converts the text of the PP_HEADER of an UPF v1 file to a dictionary
+    with the names of the attributes used by UPF v2 files.
+    """
+    lines = [x for x in text.split('\n') if x.strip()]
+    header = {}
+    for lineno, name in UPF_V1_HEADER_FIELDS:
+        try:
+            line = lines[lineno]
+        except IndexError:
+            break
+        if name == 'functional':
+            header[name] = line[:20].strip()
+        elif name == 'rho_cutoff':
+            header[name] = line.split()[1]
+        else:
+            header[name] = line.split()[0]
+    return header
+
+
+def find_header_text(filename):
+    """
+    Scans the head of an UPF file by chunks, returning the text of the PP_HEADER
+    element. Returns `None` if the header is not found within the first
+    HEADER_SCAN_LIMIT characters of the file.
+    """
+    text = ''
+    start = None
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(filename, 'rb') as f:
+        while len(text) < HEADER_SCAN_LIMIT:
+            chunk = f.read(HEADER_CHUNK_SIZE)
+            if not chunk:
+                return None
+
+            # Restart the search a bit before the chunk, for tags split between chunks
+            pos = max(0, len(text) - 16)
+            text += decoder.decode(chunk)  # keeps multibyte characters split between chunks
+            if start is None:
+                start = HEADER_START_PATTERN.search(text, pos)
+                if start is None:
+                    continue
+
+            tag = HEADER_TAG_PATTERN.match(text, start.start())
+            if tag is None:
+                continue
+            elif tag.group().endswith('/>'):
+                return tag.group()
+
+            end = HEADER_END_PATTERN.search(text, tag.end())
+            if end is not None:
+                return text[start.start():end.end()]
+
+
+def read_pseudo_header(filename):
+    """
+    Reads the PP_HEADER of a pseudo-potential file in the QE UPF format,
+    without reading the rest of the file, so the cost doesn't depend on
+    the size of the radial mesh. Headers of UPF v1 files are converted to
+    the attribute names used by UPF v2 files, headers of UPF-schema files
+    are read from their child elements.
+
+    Only the header element is parsed, after a scan of the head of the file.
+    If this fails the file is parsed incrementally up to the header.
+
+    :param filename: the path of the UPF file.
+    :return: a dictionary with the attributes of the header as strings.
+    """
+    text = find_header_text(filename)
+    if text is not None:
+        try:
+            return get_header(ElementTree.fromstring(PREFIX_PATTERN.sub(r'\1', text)))
+        except ElementTree.ParseError:
+            pass
+
+    for _, elem in iter_upf_events(filename):
+        if get_section_name(elem.tag) == 'PP_HEADER':
+            return get_header(elem)
+
+    raise ValueError("PP_HEADER not found in %r" % filename)
 
-__all__ = ['read_pseudo_file']
+
+def get_v1_beta(elem):
+    """
+    Converts a PP_BETA section of an UPF v1 file, that starts with a line with
+    the index and the angular momentum of the projector and a line with the
+    number of the values. These data are set as the attributes used by UPF v2
+    files. Only the values up to the cutoff radius index are returned.
+    """
+    lines = elem.text.strip().split('\n')
+    index, angular_momentum = lines[0].split()[:2]
+    size = int(lines[1].split()[0])
+    elem.attrib.update(index=index, angular_momentum=angular_momentum,
+                       cutoff_radius_index=str(size))
+    return text_to_array(' '.join(' '.join(lines[2:]).split()[:size]))
+
+
+def get_v1_dij(text):
+    """
+    Converts a PP_DIJ section of an UPF v1 file, that starts with a line with
+    the number of the nonzero values, followed by a line for each of them with
+    the indexes of the projectors and the value. Returns the flattened matrix
+    of the coefficients, as written in UPF v2 files.
+    """
+    rows = [x.split()[:3] for x in text.strip().split('\n')[1:] if x.strip()]
+    size = max((max(int(i), int(j)) for i, j, _ in rows), default=0)
+    dij = np.zeros((size, size))
+    for i, j, value in rows:
+        dij[int(i) - 1, int(j) - 1] = dij[int(j) - 1, int(i) - 1] = float(value)
+    return dij.ravel()
+
+
+def get_v1_pswfc(text):
+    """
+    Converts the PP_PSWFC section of an UPF v1 file, where each wavefunction
+    starts with a line with its label, angular momentum and occupation. The
+    section is returned with the layout of UPF v2 files.
+    """
+    chis = []
+    for line in text.strip().split('\n'):
+        try:
+            float(line.split()[0])
+        except (IndexError, ValueError):
+            label, l, occupation = line.split()[:3]
+            chis.append((dict(index=str(len(chis) + 1), label=label, l=l,
+                              occupation=occupation), []))
+        else:
+            chis[-1][1].append(line)
+    return {'PP_CHI': [dict(chi, chi=text_to_array(' '.join(lines))) for chi, lines in chis]}
+
+
+def get_leaf_array(elem, name):
+    """
+    Converts the numeric content of a leaf element of an UPF file. The header
+    lines of the PP_BETA and PP_DIJ sections of UPF v1 files are skipped.
+    """
+    if name in ('PP_BETA', 'PP_DIJ') and not elem.attrib:
+        try:
+            return text_to_array(elem.text)
+        except ValueError:
+            # UPF v1 format
+            return get_v1_beta(elem) if name == 'PP_BETA' else get_v1_dij(elem.text)
+    return get_section_array(elem)
+
+
+def get_section_value(elem, values):
+    """
+    Builds the value of a section of an UPF file from its element, whose
+    numeric leaves have been already converted to arrays in *values*.
+    Leaves with attributes are converted to dictionaries with the array
+    in a lowercase key (e.g. 'chi' for PP_CHI), the subsections that can
+    be repeated are collected into lists.
+    """
+    name = get_section_name(elem.tag).partition('.')[0]
+    if not len(elem):
+        if not elem.attrib:
+            return values.get(elem)
+        item = dict(elem.attrib)
+        item[name[3:].lower()] = values.get(elem)
+        return item
+
+    section = dict(elem.attrib)
+    for child in elem:
+        child_name, dot, _ = get_section_name(child.tag).partition('.')
+        value = get_section_value(child, values)
+        if dot or child_name in INDEXED_TAGS:
+            section.setdefault(child_name, []).append(value)
+        else:
+            section[child_name] = value
+    return section
+
+
+def get_nonlocal(elem, values):
+    """Builds the PP_NONLOCAL section, keeping the layout of the previous releases."""
+    betas = list()
+    dij = None
+    pp_aug = None
+    for el in elem:
+        name = get_section_name(el.tag).partition('.')[0]
+        if name == 'PP_BETA':
+            beta = dict(el.attrib)
+            beta.update(beta=values.get(el))
+            betas.append(beta)
+        elif name == 'PP_DIJ':
+            dij = values.get(el)
+        elif name == 'PP_AUGMENTATION':
+            pp_aug = dict(el.attrib)
+            pp_qijl = list()
+            pp_qij = list()
+            pp_q = None
+            for q in el:
+                q_name = get_section_name(q.tag).partition('.')[0]
+                if q_name == 'PP_QIJL':
+                    qijl = dict(q.attrib)
+                    qijl.update(qijl=values.get(q))
+                    pp_qijl.append(qijl)
+                elif q_name == 'PP_QIJ':
+                    qij = dict(q.attrib)
+                    qij.update(qij=values.get(q))
+                    pp_qij.append(qij)
+                elif q_name == 'PP_Q':
+                    pp_q = values.get(q)
+            pp_aug.update(PP_QIJL=pp_qijl, PP_QIJ=pp_qij, PP_Q=pp_q)
+    return dict(PP_BETA=betas, PP_DIJ=dij, PP_AUGMENTATION=pp_aug)
 
 
 def read_pseudo_file(xml_file):
     """
     Reads a pseudo-potential XML-like file in the QE UPF format (text), returning
-    the content of each tag in a dictionary. The file is read in strings and
-    completed with a root UPF tag when it lacks, to avoids an XML syntax error.
-
-    TODO: add support for UPF-schema files
-    """
-    def iter_upf_file():
-        """
-        Creates an iterator over the lines of an UPF file,
-        inserting the root <UPF> tag when missing.
-        """
-        with open(xml_file, 'r') as f:
-            fake_root = None
-            for line in f:
-                if fake_root is not None:
-                    line = line.replace('&input', '&amp;input')
-                    line = line.replace('&inputp', '&amp;inputp')
-                    yield line
-                else:
-                    line = line.strip()
-                    if line.startswith("<UPF") and line[4] in ('>', ' '):
-                        yield line
-                        fake_root = False
-                    elif line:
-                        yield "<UPF>"
-                        yield line
-                        fake_root = True
-        if fake_root is True:
-            yield "</UPF>"
-
-    pseudo = {}
-    psroot = ElementTree.fromstringlist(list(iter_upf_file()))
-
-    # PP_INFO
-    try:
-        pp_info = psroot.find('PP_INFO').text
-    except AttributeError:
-        pp_info = ""
-    try:
-        pp_input = psroot.find('PP_INFO/PP_INPUTFILE').text
-    except AttributeError:
-        pp_input = ""
-    pseudo.update(PP_INFO=dict(INFO=pp_info, PP_INPUT=pp_input))
-
-    # PP_HEADER
-    pseudo.update(PP_HEADER=dict(psroot.find('PP_HEADER').attrib))
-
-    # PP_MESH
-    pp_mesh = dict(psroot.find('PP_MESH').attrib)
-    pp_r = np.array([float(x) for x in psroot.find('PP_MESH/PP_R').text.split()])
-    pp_rab = np.array([float(x) for x in psroot.find('PP_MESH/PP_RAB').text.split()])
-    pp_mesh.update(PP_R=pp_r, PP_RAB=pp_rab)
-    pseudo.update(PP_MESH=pp_mesh)
-
-    # PP_LOCAL
-    node = psroot.find('PP_LOCAL')
-    if node is not None:
-        pp_local = np.array([x for x in map(float, node.text.split())])
-    else:
-        pp_local = None
-    pseudo.update(PP_LOCAL=pp_local)
-
-    # PP_RHOATOM
-    node = psroot.find('PP_RHOATOM')
-    if node is not None:
-        pp_rhoatom = np.array([v for v in map(float, node.text.split())])
-    else:
-        pp_rhoatom = None
-    pseudo.update(PP_RHOATOM=pp_rhoatom)
-
-    # PP_NONLOCAL
-    node = psroot.find('PP_NONLOCAL')
-    if node is not None:
-        betas = list()
-        dij = None
-        pp_aug = None
-        pp_q = None
-        for el in node:
-            if 'PP_BETA' in el.tag:
-                beta = dict(el.attrib)
-                val = np.array(x for x in map(float, el.text.split()))
-                beta.update(beta=val)
-                betas.append(beta)
-            elif 'PP_DIJ' in el.tag:
-                text = '\n'.join(el.text.strip().split('\n')[1:])
-                dij = np.array([x for x in map(float, text.split())])
-            elif 'PP_AUGMENTATION' in el.tag:
-                pp_aug = dict(el.attrib)
-                pp_qijl = list()
-                pp_qij = list()
-                for q in el:
-                    if 'PP_QIJL' in q.tag:
-                        qijl = dict(q.attrib)
-                        val = np.array(x for x in map(float, q.text.split()))
-                        qijl.update(qijl=val)
-                        pp_qijl.append(qijl)
-                    elif 'PP_QIJ' in q.tag:
-                        qij = dict(q.attrib)
-                        val = np.array(x for x in map(float, q.text.split()))
-                        qij.update(qij=val)
-                        pp_qij.append(qij)
-                    elif q.tag == 'PP_Q':
-                        pp_q = np.array(x for x in map(float, q.text.split()))
-                pp_aug.update(PP_QIJL=pp_qijl, PP_QIJ=pp_qij, PP_Q=pp_q)
-        pp_nonlocal = dict(PP_BETA=betas, PP_DIJ=dij, PP_AUGMENTATION=pp_aug)
-    else:
-        pp_nonlocal = None
-
-    pseudo.update(PP_NONLOCAL=pp_nonlocal)
+    the content of each tag in a dictionary. UPF v1, UPF v2 and UPF-schema files
+    are supported. Files of UPF v1 format are completed with a root UPF tag, to
+    avoids an XML syntax error. The PP_BETA, PP_DIJ and PP_PSWFC sections of
+    UPF v1 files are converted to the layout of UPF v2 files, other sections
+    with non-numeric data (e.g. PP_ADDINFO) are returned as text. The
+    augmentation charges of UPF v1 ultrasoft pseudo-potentials are not read.
+
+    The file is parsed incrementally: the numeric content of each element is
+    converted to an array as soon as the element is closed and the text is
+    released, and each section is removed from the tree after its conversion,
+    so large files (e.g. PAW pseudo-potentials with PP_PAW and PP_FULL_WFC
+    sections) are loaded without keeping both the text and the arrays.
+
+    :param xml_file: the path of the UPF file.
+    :return: a dictionary with the sections PP_INFO, PP_HEADER, PP_MESH, \
+    PP_LOCAL, PP_RHOATOM and PP_NONLOCAL, followed by the other sections \
+    of the file (e.g. PP_PSWFC, PP_NLCC, PP_FULL_WFC, PP_PAW).
+    """
+    pseudo = dict(
+        PP_INFO=dict(INFO="", PP_INPUT=""),
+        PP_HEADER=None,
+        PP_MESH=None,
+        PP_LOCAL=None,
+        PP_RHOATOM=None,
+        PP_NONLOCAL=None,
+    )
+    values = {}
+    path = []
+    root = None
+
+    for event, elem in iter_upf_events(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            else:
+                path.append(elem)
+            continue
+        elif elem is root:
+            break
+
+        section_name = get_section_name(path[0].tag)
+        path.pop()
+        if path:
+            # A subsection: convert the numeric leaves and release their text
+            if section_name not in TEXT_SECTIONS and not len(elem):
+                values[elem] = get_leaf_array(elem, get_section_name(elem.tag))
+                elem.text = None
+            continue
+
+        if section_name == 'PP_INFO':
+            pp_input = ""
+            for child in elem:
+                if get_section_name(child.tag) == 'PP_INPUTFILE':
+                    pp_input = child.text
+            pseudo['PP_INFO'] = dict(INFO=elem.text or "", PP_INPUT=pp_input)
+        elif section_name == 'PP_HEADER':
+            pseudo['PP_HEADER'] = get_header(elem)
+        elif section_name == 'PP_MESH':
+            pp_mesh = dict(elem.attrib)
+            for child in elem:
+                child_name = get_section_name(child.tag)
+                if child_name in ('PP_R', 'PP_RAB'):
+                    pp_mesh[child_name] = values.get(child)
+            pseudo['PP_MESH'] = pp_mesh
+        elif section_name == 'PP_NONLOCAL':
+            pseudo['PP_NONLOCAL'] = get_nonlocal(elem, values)
+        elif section_name == 'PP_PSWFC' and not len(elem) and elem.text \
+                and not elem.text.isspace():
+            pseudo['PP_PSWFC'] = get_v1_pswfc(elem.text)
+        elif not len(elem):
+            try:
+                pseudo[section_name] = text_to_array(elem.text)
+            except ValueError:
+                pseudo[section_name] = elem.text  # e.g. PP_ADDINFO of UPF v1 files
+        else:
+            pseudo[section_name] = get_section_value(elem, values)
+
+        values.clear()
+        root.remove(elem)
+
+    if pseudo['PP_HEADER'] is None:
+        raise ValueError("PP_HEADER not found in %r" % xml_file)
     return pseudo
@@ -8,7 +8,11 @@
 # Authors: Davide Brunato
 #
 import logging
+import warnings
 from collections.abc import MutableMapping
+from xml.etree import ElementTree
+
+import numpy as np
 
 logger = logging.getLogger('qeschema')
 
@@ -80,6 +84,61 @@ def etree_iter_path(elem, tag=None, path='.'):
             yield e, p
 
 
+def sniff_root_tag(filename, chunk_size=4096):
+    """
+    Returns the tag of the root element of an XML file, parsing only the
+    head of the file up to the start tag of the root.
+
+    :param filename: the path of the XML file.
+    :param chunk_size: the number of bytes read from the file at a time.
+    """
+    parser = ElementTree.XMLPullParser(events=('start',))
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                return elem.tag
+    parser.close()  # raises a ParseError for a file without elements
+
+
+def write_lines(fp, lines):
+    """
+    Writes lines to a text file object, separated by newlines and without a
+    final newline, so the content is the same of a join of the lines.
+
+    :param fp: a text file object.
+    :param lines: an iterable of strings.
+    """
+    lines = iter(lines)
+    for line in lines:
+        fp.write(line)
+        break
+    for line in lines:
+        fp.write('\n')
+        fp.write(line)
+
+
+def text_to_array(text, dtype=float):
+    """
+    Converts a text of whitespace separated numbers to a 1-D NumPy array,
+    using a single bulk conversion instead of converting each token.
+
+    :param text: a string or `None`.
+    :param dtype: the data type of the array, default is `float`.
+    :return: a 1-D array, empty if the text is empty or `None`.
+    """
+    if not text or text.isspace():
+        return np.empty(0, dtype=dtype)
+
+    with warnings.catch_warnings():
+        # Older NumPy versions emit a warning on unmatched data instead of raising
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=dtype, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return np.array(text.split(), dtype=dtype)
+
+
 def to_fortran(value):
     """
     Translate a Python value to the equivalent literal representation for Fortran input.
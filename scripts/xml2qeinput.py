@@ -8,7 +8,8 @@
 # Authors: Davide Brunato, Giovanni Borghi
 #
 """
-Convert from XML input to Fortran input
+Convert from XML input to Fortran input. For converting many files
+in parallel use the command `qeschema convert`.
 """
 
 import sys
@@ -45,42 +46,15 @@ if __name__ == '__main__':
         sys.path.append(path.abspath(path.dirname(__file__)+'/../'))
 
     import qeschema
-    import os
-    import xml.etree.ElementTree as Etree
+    from qeschema.batch import batch_convert
 
     qeschema.set_logger(args.verbosity)
 
     input_fn = getattr(args, 'in')
     schema_fn = getattr(args, 'schema', None)
-    tree = Etree.parse(input_fn)
-    root = tree.getroot()
-    element_name = root.tag.split('}')[-1]
-    if element_name == 'espresso':
-        xml_document = qeschema.PwDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'nebRun':
-        xml_document = qeschema.NebDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'espressoph':
-        xml_document = qeschema.PhononDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'tddfpt':
-        xml_document = qeschema.TdDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'spectrumDoc':
-        xml_document = qeschema.TdSpectrumDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'xspectra':
-        xml_document = qeschema.XSpectraDocument(source=input_fn, schema=schema_fn)
-    elif element_name == 'epw':
-        xml_document = qeschema.EPWDocument(souce=input_fn, schema=schema_fn)
-    else:
-        sys.stderr.write("Could not find correct XML in %s, exiting...\n" % input_fn)
+    result = batch_convert([input_fn], max_workers=1, schema=schema_fn)[0]
+    if result.error is not None:
+        sys.stderr.write("Could not convert XML file %s: %s\n" % (input_fn, result.error))
         sys.exit(1)
 
-    root = None
-    tree = None
-
-    qe_in = xml_document.get_fortran_input()
-
-    input_fn_name, input_fn_ext = os.path.splitext(input_fn)
-    outfile = input_fn_name + '.in'
-
-    with open(outfile, mode='w') as f:
-        f.write(qe_in)
-        print("Input configuration written to file '%s' ..." % outfile)
+    print("Input configuration written to file '%s' ..." % result.output)
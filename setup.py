@@ -24,6 +24,9 @@ setup(
     packages=['qeschema', 'qeschema.hdf5'],
     package_data={'qeschema': ['schemas/*.xsd', 'schemas/releases/*.xsd']},
     scripts = ['scripts/xml2qeinput.py', 'scripts/yaml2qeinput.py'],
+    entry_points={
+        'console_scripts': ['qeschema=qeschema.cli:main'],
+    },
     url='https://github.com/QEF/qeschema',
     authors='Davide Brunato,Pietro Delugas,Giovanni Borghi,Alexandr Fonari',
     license='MIT',
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+import numpy as np
+
+from qeschema import batch_extract, PwDocument, PhononDocument, NebDocument
+from qeschema.batch import iter_filenames, batch_convert, get_document_class, \
+    _convert_file
+from qeschema.cli import main
+from qeschema.utils import sniff_root_tag
+
+
+class TestBatchExtract(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.ni_file = os.path.join(cls.test_dir, 'resources/pw/Ni.xml')
+        cls.si_file = os.path.join(cls.test_dir, 'resources/pw/Si.xml')
+        cls.missing_file = os.path.join(cls.test_dir, 'resources/pw/missing.xml')
+
+    def test_iter_filenames(self):
+        pattern = os.path.join(self.test_dir, 'resources/pw/[NS]i.xml')
+        self.assertListEqual(list(iter_filenames(pattern)), [self.ni_file, self.si_file])
+        self.assertListEqual(list(iter_filenames([self.missing_file, pattern])),
+                             [self.missing_file, self.ni_file, self.si_file])
+
+        filenames = list(iter_filenames(os.path.join(self.test_dir, 'resources/pw')))
+        self.assertIn(self.ni_file, filenames)
+        self.assertTrue(all(x.endswith('.xml') for x in filenames))
+
+    def test_serial_extraction(self):
+        files = [self.ni_file, self.si_file, self.missing_file]
+        columns = batch_extract(files, ['total_energy', 'stress', 'ks_eigenvalues'],
+                                max_workers=1)
+
+        self.assertListEqual(list(columns),
+                             ['filename', 'error', 'total_energy', 'stress', 'ks_eigenvalues'])
+        self.assertListEqual(columns['filename'].tolist(), files)
+        self.assertIsNone(columns['error'][0])
+        self.assertIsNone(columns['error'][1])
+        self.assertTrue(columns['error'][2].startswith('FileNotFoundError'))
+
+        self.assertEqual(columns['total_energy'].shape, (3,))
+        self.assertEqual(columns['total_energy'][0], -30.44558256272531)
+        self.assertEqual(columns['total_energy'][1], PwDocument(self.si_file).get_total_energy())
+        self.assertTrue(np.isnan(columns['total_energy'][2]))
+
+        self.assertEqual(columns['stress'].shape, (3, 3, 3))
+        self.assertTrue(np.isnan(columns['stress'][0]).all())
+        self.assertListEqual(columns['stress'][1].tolist(),
+                             PwDocument(self.si_file).get_stress())
+
+        self.assertEqual(columns['ks_eigenvalues'].dtype, object)
+        self.assertEqual(columns['ks_eigenvalues'][0].shape, (6, 18))
+        self.assertIsNone(columns['ks_eigenvalues'][2])
+
+        with self.assertRaises(ValueError):
+            batch_extract(files, 'unknown')
+
+    def test_pool_extraction(self):
+        files = [self.ni_file, self.si_file, self.missing_file]
+        columns = batch_extract(files, 'total_energy', max_workers=2, chunksize=1)
+        self.assertListEqual(columns['filename'].tolist(), files)
+        self.assertListEqual(columns['total_energy'][:2].tolist(),
+                             batch_extract(files[:2], max_workers=1)['total_energy'].tolist())
+        self.assertIsNotNone(columns['error'][2])
+
+    def test_batch_command(self):
+        with redirect_stdout(io.StringIO()) as stdout:
+            exit_code = main(['batch', self.ni_file, '-j', '1', '-q', 'total_energy', 'cell'])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(stdout.getvalue(),
+                         '%s: total_energy=-30.44558256272531 cell=(3, 3)\n' % self.ni_file)
+
+        with redirect_stdout(io.StringIO()) as stdout:
+            main(['batch', self.ni_file, self.si_file, '-j', '1', '-q', 'stress'])
+        self.assertEqual(stdout.getvalue(), '%s: stress=None\n%s: stress=(3, 3)\n'
+                         % (self.ni_file, self.si_file))
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            output_file = os.path.join(tmp_dir, 'output.json')
+            exit_code = main(['batch', self.ni_file, self.missing_file,
+                              '-j', '1', '-o', output_file])
+            self.assertEqual(exit_code, 1)
+            with open(output_file) as f:
+                records = json.load(f)
+            self.assertEqual(records[0], {'filename': self.ni_file, 'error': None,
+                                          'total_energy': -30.44558256272531})
+            self.assertIsNone(records[1]['total_energy'])
+
+            output_file = os.path.join(tmp_dir, 'output.npz')
+            main(['batch', self.ni_file, self.si_file, self.missing_file, '-j', '1',
+                  '-o', output_file, '-q', 'total_energy', 'ks_eigenvalues'])
+            with np.load(output_file, allow_pickle=False) as data:
+                self.assertListEqual(data['total_energy'][:1].tolist(), [-30.44558256272531])
+                self.assertListEqual(data['error'][:2].tolist(), ['', ''])
+                self.assertTrue(data['error'][2].startswith('FileNotFoundError'))
+                self.assertEqual(np.array(json.loads(data['ks_eigenvalues'][0])).shape,
+                                 (6, 18))
+                self.assertEqual(data['ks_eigenvalues'][2], '')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestBatchConvert(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.si_file = os.path.join(cls.test_dir, 'resources/pw/Si.xml')
+        cls.ph_file = os.path.join(cls.test_dir, 'resources/ph/alas_ph.xml')
+        cls.neb_file = os.path.join(cls.test_dir, 'resources/neb/H2+H.xml')
+        cls.dummy_file = os.path.join(cls.test_dir, 'resources/dummy/instance.xml')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_document_class(self):
+        self.assertEqual(sniff_root_tag(self.si_file),
+                         '{http://www.quantum-espresso.org/ns/qes/qes-1.0}espresso')
+        self.assertIs(get_document_class(self.si_file), PwDocument)
+        self.assertIs(get_document_class(self.ph_file), PhononDocument)
+        self.assertIs(get_document_class(self.neb_file), NebDocument)
+        with self.assertRaises(ValueError):
+            get_document_class(self.dummy_file)
+
+    def test_serial_conversion(self):
+        files = [self.si_file, self.ph_file, self.dummy_file]
+        results = batch_convert(files, max_workers=1, output_dir=self.tmp_dir)
+
+        self.assertListEqual([x.filename for x in results], files)
+        self.assertEqual(results[0].output, os.path.join(self.tmp_dir, 'Si.in'))
+        self.assertIsNone(results[0].error)
+        self.assertGreater(results[0].elapsed, 0.0)
+        with open(results[0].output) as f:
+            self.assertEqual(f.read(), PwDocument(self.si_file).get_fortran_input())
+        with open(results[1].output) as f:
+            self.assertEqual(f.read(), PhononDocument(self.ph_file).get_fortran_input())
+
+        self.assertIsNone(results[2].output)
+        self.assertTrue(results[2].error.startswith('ValueError'))
+
+    def test_output_conflicts(self):
+        other_dir = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(other_dir)
+        other_file = os.path.join(other_dir, os.path.basename(self.si_file))
+        shutil.copy(self.si_file, other_file)
+        output_dir = os.path.join(self.tmp_dir, 'output')
+
+        files = [self.si_file, self.ph_file, other_file]
+        results = batch_convert(files, max_workers=1, output_dir=output_dir)
+        self.assertListEqual([x.filename for x in results], files)
+        self.assertIsNone(results[1].error)
+        for result in (results[0], results[2]):
+            self.assertIsNone(result.output)
+            self.assertTrue(result.error.startswith('ValueError: output file'))
+        self.assertListEqual(os.listdir(output_dir), ['alas_ph.in'])
+
+        results = batch_convert(files, max_workers=2, output_dir=output_dir)
+        self.assertListEqual([x.error is None for x in results], [False, True, False])
+
+        # Without an output directory the outputs are distinct
+        results = batch_convert([self.si_file, other_file, other_file], max_workers=1,
+                                output_dir=None)
+        self.assertListEqual([x.error for x in results[1:]], [None, None])
+        os.unlink(results[0].output)
+
+    def test_duplicated_inputs(self):
+        shutil.copy(self.si_file, self.tmp_dir)
+        filename = os.path.join(self.tmp_dir, os.path.basename(self.si_file))
+        other_path = os.path.join(self.tmp_dir, '.', os.path.basename(filename))
+        files = [filename, self.tmp_dir, os.path.join(self.tmp_dir, '*.xml'), other_path]
+
+        for max_workers in (1, 2):
+            with mock.patch('qeschema.batch._convert_file',
+                            side_effect=_convert_file) as convert_file:
+                results = batch_convert(files, max_workers=max_workers)
+            if max_workers == 1:
+                self.assertEqual(convert_file.call_count, 1)
+            self.assertListEqual([x.filename for x in results], [filename] * 3 + [other_path])
+            self.assertListEqual([x.output for x in results],
+                                 [filename[:-4] + '.in'] * 3 + [other_path[:-4] + '.in'])
+            self.assertListEqual([x.error for x in results], [None] * 4)
+
+    def test_truncated_conversion(self):
+        def write_lines(fp, lines):
+            fp.write(next(lines))
+            raise ValueError("write error")
+
+        output = os.path.join(self.tmp_dir, 'Si.in')
+        with open(output, 'w') as f:
+            f.write('previous content')
+
+        with mock.patch('qeschema.documents.write_lines', write_lines):
+            results = batch_convert([self.si_file], max_workers=1, output_dir=self.tmp_dir)
+        self.assertEqual(results[0].error, 'ValueError: write error')
+        self.assertListEqual(os.listdir(self.tmp_dir), ['Si.in'])
+        with open(output) as f:
+            self.assertEqual(f.read(), 'previous content')
+
+    def test_pool_conversion(self):
+        files = [self.si_file, self.ph_file, self.neb_file]
+        results = batch_convert(files, max_workers=2, output_dir=self.tmp_dir)
+        self.assertListEqual([x.filename for x in results], files)
+        self.assertListEqual([x.error for x in results], [None] * 3)
+        self.assertListEqual(sorted(os.listdir(self.tmp_dir)),
+                             ['H2+H.in', 'Si.in', 'alas_ph.in'])
+
+    def test_convert_command(self):
+        with redirect_stdout(io.StringIO()) as stdout:
+            exit_code = main(['convert', self.si_file, '-j', '1', '-o', self.tmp_dir])
+        self.assertEqual(exit_code, 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(
+            '%s -> %s  (' % (self.si_file, os.path.join(self.tmp_dir, 'Si.in'))
+        ))
+        self.assertTrue(lines[1].startswith('Converted 1 of 1 files in '))
+
+        with redirect_stdout(io.StringIO()) as stdout:
+            exit_code = main(['convert', self.dummy_file, '-j', '1', '-o', self.tmp_dir])
+        self.assertEqual(exit_code, 1)
+        self.assertIn('ERROR ValueError', stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,9 +11,11 @@ import unittest
 import logging
 import re
 
-from qeschema.cards import get_atomic_species_card, get_atomic_positions_cell_card, \
-    get_atomic_constraints_card, get_k_points_card, get_atomic_forces_card, \
-    get_cell_parameters_card, get_qpoints_card, get_climbing_images, \
+import numpy as np
+
+from qeschema.cards import format_rows, format_positions, get_atomic_species_card, \
+    get_atomic_positions_cell_card, get_atomic_constraints_card, get_k_points_card, \
+    get_atomic_forces_card, get_cell_parameters_card, get_qpoints_card, get_climbing_images, \
     get_neb_images_positions_card, get_neb_cell_parameters_card, \
     get_neb_atomic_forces_card, get_positions_units
 
@@ -520,6 +522,75 @@ class TestCardsFunctions(unittest.TestCase):
     def test_get_neb_atomic_forces_card(self):
         self.assertIsNone(get_neb_atomic_forces_card('atomic_forces'))
 
+    def test_format_rows(self):
+        self.assertListEqual(format_rows([], []), [])
+        self.assertListEqual(format_rows(['%s %d', '%s'], ['a', 1, 'b']), ['a 1', 'b'])
+
+        atoms = [{'@name': 'O1', '$': [0.5, 0.5, 0.5]},
+                 {'@name': 'Fe1', '$': np.array([0.0, -1.0, 0.0])}]
+        self.assertListEqual(format_positions(atoms), [
+            'O1     0.50000000    0.50000000    0.50000000',
+            'Fe1    0.00000000   -1.00000000    0.00000000'
+        ])
+        self.assertListEqual(format_positions(atoms, np.array([1, 1, 1, 0, 1.0, 0])), [
+            'O1     0.50000000    0.50000000    0.50000000',
+            'Fe1    0.00000000   -1.00000000    0.00000000    0   1   0'
+        ])
+
+        with self.assertRaises(ValueError):
+            format_positions(atoms, [1, 1, 1])
+        with self.assertRaises(ValueError):
+            format_positions([{'@name': 'O1', '$': [0.5, 0.5]}])
+        with self.assertRaises(TypeError):
+            format_positions([{'@name': 'O1', '$': ['0.5', 0.5, 0.5]}])
+
+    def test_array_backed_cards(self):
+        nat = 100
+        names = ['Fe', 'O']
+        coords = np.linspace(-1.0, 1.0, 3 * nat).reshape(nat, 3)
+        free_positions = np.ones(3 * nat, dtype=int)
+        free_positions[::7] = 0
+
+        list_atoms = [{'@name': names[k % 2], '$': coords[k].tolist()} for k in range(nat)]
+        array_atoms = [{'@name': names[k % 2], '$': coords[k]} for k in range(nat)]
+
+        result = get_atomic_positions_cell_card(
+            'ATOMIC_POSITIONS', atomic_structure={'atomic_positions': {'atom': list_atoms}},
+            free_positions={'$': free_positions.tolist()}
+        )
+        self.assertEqual(len(result), nat + 1)
+        self.assertEqual(result[1], 'Fe    -1.00000000   -0.99331104   -0.98662207    0   1   1')
+        self.assertEqual(result[2], 'O     -0.97993311   -0.97324415   -0.96655518')
+        self.assertEqual(result[3], 'Fe    -0.95986622   -0.95317726   -0.94648829    1   0   1')
+
+        self.assertListEqual(result, get_atomic_positions_cell_card(
+            'ATOMIC_POSITIONS', atomic_structure={'atomic_positions': {'atom': array_atoms}},
+            free_positions={'$': free_positions}
+        ))
+
+        images = [{'@nat': nat, 'atomic_positions': {'atom': atoms}}
+                  for atoms in (list_atoms, array_atoms)]
+        result = get_neb_images_positions_card(
+            'ATOMIC_POSITIONS', atomic_structure=images, free_positions={'$': free_positions}
+        )
+        self.assertEqual(len(result), 2 * nat + 6)
+        self.assertListEqual(result[3:nat + 3], result[nat + 5:-1])
+
+        forces = np.linspace(-0.1, 0.1, 3 * nat)
+        result = get_atomic_forces_card('ATOMIC_FORCES', external_atomic_forces=forces,
+                                        atomic_positions={'atom': array_atoms})
+        self.assertListEqual(result, get_atomic_forces_card(
+            'ATOMIC_FORCES', external_atomic_forces=forces.tolist(),
+            atomic_positions={'atom': list_atoms}
+        ))
+        self.assertEqual(result[-1], 'O        0.09866221     0.09933110     0.10000000')
+
+        k_points = [{'@weight': 0.25, '$': [0.0, 0.5, k / 10]} for k in range(4)]
+        result = get_k_points_card('K_POINTS', k_points_IBZ={'nk': 4, 'k_point': k_points})
+        self.assertListEqual(result, ['K_POINTS', ' 4', ' 0.0 0.5 0.0 0.25',
+                                      ' 0.0 0.5 0.1 0.25', ' 0.0 0.5 0.2 0.25',
+                                      ' 0.0 0.5 0.3 0.25'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -114,6 +114,29 @@ class ConverterTestCase(unittest.TestCase):
             self.assertTrue(os.path.isfile(in_filename),
                             'Test output file %r missing!' % in_filename)
 
+    def test_shared_conversion_maps(self):
+        for cls in (qeschema.PwInputConverter, qeschema.PhononInputConverter,
+                    qeschema.NebInputConverter, qeschema.TdInputConverter,
+                    qeschema.TdSpectrumInputConverter, qeschema.XSpectraInputConverter,
+                    qeschema.EPWInputConverter):
+            converter = cls()
+            other = cls()
+            self.assertIs(converter.invariant_map, other.invariant_map)
+            self.assertIs(converter.variant_map, other.variant_map)
+            self.assertIs(converter.targets, other.targets)
+            self.assertIsNot(converter._input, other._input)
+
+            with self.assertRaises(TypeError):
+                converter.variant_map['./foo'] = ('CONTROL[foo]', None, None)
+
+        converter = qeschema.PwInputConverter()
+        self.assertEqual(converter.targets['CONTROL[calculation]'], ('CONTROL', 'calculation'))
+        self.assertEqual(converter.targets['K_POINTS'], ('K_POINTS', None))
+
+        engine_map = qeschema.NebInputConverter.NEB_TEMPLATE_MAP['engine']
+        qeschema.NebInputConverter()
+        self.assertIs(qeschema.NebInputConverter.NEB_TEMPLATE_MAP['engine'], engine_map)
+
 
 ##
 # Create test classes for examples
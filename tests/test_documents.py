@@ -7,10 +7,13 @@
 # http://opensource.org/licenses/MIT.
 # Authors: Davide Brunato
 #
+import io
 import os
 import unittest
+import unittest.mock
 import platform
 import xml.etree.ElementTree as ElementTree
+import numpy as np
 from xmlschema import XMLSchemaValidationError, XMLSchema, XMLResource
 
 try:
@@ -19,8 +22,8 @@ except ImportError:
     yaml = None
 
 from qeschema import QeDocument, PwDocument, PhononDocument, NebDocument, \
-    TdDocument, TdSpectrumDocument, XmlDocumentError, PwInputConverter
-from qeschema.documents import XmlDocument
+    TdDocument, TdSpectrumDocument, EPWDocument, XmlDocumentError, PwInputConverter
+from qeschema.documents import XmlDocument, get_conversion_plan
 
 
 class TestDocuments(unittest.TestCase):
@@ -533,6 +536,100 @@ class TestDocuments(unittest.TestCase):
         self.assertEqual(document.findall('.'), [document.root])
         self.assertEqual(document.findall('/node'), document.root[:])
 
+    def test_iterparse_method(self):
+        xml_filename = os.path.join(self.test_dir, 'resources/pw/Ni.xml')
+        document = PwDocument(schema='qes-20180510.xsd')
+
+        subtrees = []
+        for path, elem in document.iterparse(xml_filename, 'ks_energies'):
+            self.assertEqual(path, '/{http://www.quantum-espresso.org/ns/qes/qes-1.0}'
+                                   'espresso/output/band_structure/ks_energies')
+            self.assertEqual(elem.tag, 'ks_energies')
+            self.assertEqual(len(elem), 4)
+            subtrees.append(elem)
+
+        self.assertEqual(len(subtrees), 6)
+        self.assertTrue(all(len(e) == 0 for e in subtrees))
+        self.assertListEqual(document.errors, [])
+        self.assertEqual(document.filename, xml_filename)
+        self.assertEqual(document.format, 'xml')
+        self.assertIn('qes', document.namespaces)
+
+        self.assertIsNotNone(document.find('output/band_structure'))
+        self.assertIsNone(document.find('output/band_structure/ks_energies'))
+        self.assertEqual(document.get_total_energy(), -30.44558256272531)
+
+        paths = [p for p, _ in document.iterparse(
+            xml_filename, ('band_structure', 'ks_energies'), validation='strict')]
+        self.assertListEqual(paths, ['/{http://www.quantum-espresso.org/ns/qes/qes-1.0}'
+                                     'espresso/output/band_structure'])
+
+        with open(xml_filename) as f:
+            xml_data = f.read().replace('<npw>', '<npw>x')
+
+        subtrees = list(document.iterparse(io.StringIO(xml_data), ['ks_energies']))
+        self.assertEqual(len(subtrees), 6)
+        self.assertEqual(len(document.errors), 6)
+        self.assertIsNone(document.filename)
+
+        with self.assertRaises(XMLSchemaValidationError):
+            list(document.iterparse(io.StringIO(xml_data), 'ks_energies', validation='strict'))
+
+        document.errors.clear()
+        list(document.iterparse(io.StringIO(xml_data), 'ks_energies', validation='skip'))
+        self.assertListEqual(document.errors, [])
+
+    def test_from_xml_with_paths(self):
+        xml_filename = os.path.join(self.test_dir, 'resources/pw/Ni.xml')
+        document = PwDocument(schema='qes-20180510.xsd')
+
+        document.from_xml(xml_filename, paths=['output/total_energy', './output/atomic_structure'])
+        self.assertEqual(document.filename, xml_filename)
+        self.assertEqual(document.format, 'xml')
+        self.assertListEqual(document.errors, [])
+        self.assertIn('qes', document.namespaces)
+        self.assertEqual([e.tag for e in document.root], ['output'])
+        self.assertEqual([e.tag for e in document.root[0]], ['atomic_structure', 'total_energy'])
+
+        self.assertEqual(document.get_total_energy(), -30.44558256272531)
+        self.assertListEqual(document.get_cell_parameters(),
+                             [[-3.325, 0.0, 3.325], [0.0, 3.325, 3.325], [-3.325, 3.325, 0.0]])
+        self.assertListEqual(document.get_ks_eigenvalues(), [])
+
+        document.read(xml_filename, paths=['output/band_structure'])
+        self.assertEqual(len(document.get_ks_eigenvalues()), 6)
+        self.assertIsNone(document.find('output/total_energy'))
+
+        with open(xml_filename) as f:
+            xml_data = f.read()
+
+        document.from_xml(xml_data, validation='lax', paths='output/total_energy/etot')
+        self.assertIsNone(document.filename)
+        self.assertEqual(document.get_total_energy(), -30.44558256272531)
+
+        xml_data = xml_data.replace('<etot>', '<etot>x')
+        document.from_xml(io.StringIO(xml_data), validation='lax', paths=['output/total_energy'])
+        self.assertGreater(len(document.errors), 0)
+        with self.assertRaises(XMLSchemaValidationError):
+            document.from_xml(xml_data, paths=['output/total_energy'])
+
+        with self.assertRaises(XmlDocumentError):
+            document.from_xml(xml_filename, paths=['output//etot'])
+        with self.assertRaises(XmlDocumentError):
+            document.from_xml(XMLResource(xml_filename), paths=['output/total_energy'])
+
+        with open(xml_filename, 'rb') as f:
+            document.from_xml(f, paths=['output/total_energy'])
+        self.assertEqual(document.get_total_energy(), -30.44558256272531)
+
+        with open(xml_filename, 'rb') as f:
+            document.from_xml(io.BytesIO(f.read()), paths=['output/total_energy'])
+        self.assertEqual(document.get_total_energy(), -30.44558256272531)
+
+        json_filename = os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.json')
+        with self.assertRaises(XmlDocumentError):
+            document.read(json_filename, paths=['output/total_energy'])
+
     def test_unsupported_schema(self):
         with self.assertRaises(NotImplementedError):
             PwDocument(schema=os.path.join(self.test_dir, 'resources/dummy/schema.xsd'))
@@ -699,6 +796,181 @@ class TestDocuments(unittest.TestCase):
         self.assertEqual(fortran_input[:9], '&CONTROL\n')
         self.assertEqual(fortran_input, document.get_fortran_input())
 
+    def test_fortran_input_streaming(self):
+        xml_filename = os.path.join(self.test_dir, 'resources/neb/Al001_plus_H_bc3.xml')
+        document = NebDocument(source=xml_filename, schema='qes_neb_test_ref.xsd')
+        fortran_input = document.get_fortran_input()
+
+        lines = list(document.iter_fortran_input())
+        self.assertEqual(lines, fortran_input.split('\n'))
+        self.assertEqual(lines[:3], ['BEGIN', 'BEGIN_PATH_INPUT', '&PATH'])
+        self.assertEqual(lines[-2:], ['END_ENGINE_INPUT', 'END'])
+        index = lines.index('&CONTROL')
+        self.assertEqual(lines[index - 2:index], ['END_PATH_INPUT', 'BEGIN_ENGINE_INPUT'])
+
+        with io.StringIO() as f:
+            document.write_fortran_input(f)
+            self.assertEqual(f.getvalue(), fortran_input)
+
+        xml_filename = os.path.join(self.test_dir, 'resources/epw/epw_test1.xml')
+        document = EPWDocument(source=xml_filename)
+        fortran_input = document.get_fortran_input()
+        self.assertEqual(list(document.iter_fortran_input()), fortran_input.split('\n'))
+        with io.StringIO() as f:
+            document.write_fortran_input(f)
+            self.assertEqual(f.getvalue(), fortran_input)
+
+        document = PwDocument()
+        with self.assertRaises(XmlDocumentError):
+            document.iter_fortran_input()
+
+    def test_write_qe_input(self):
+        converter = PwInputConverter()
+        converter.set_path('./control_variables/calculation', 'calculation',
+                           {'calculation': 'scf'})
+        converter.set_path('./basis/ecutwfc', 'ecutwfc', {'ecutwfc': 30.0})
+
+        with io.StringIO() as f:
+            converter.write_qe_input(f)
+            self.assertEqual(f.getvalue(), converter.get_qe_input())
+            self.assertEqual(f.getvalue().split('\n')[:3],
+                             ['&CONTROL', " calculation='scf'", '/'])
+        self.assertIn(' ecutwfc=30.0', converter.get_qe_input())
+
+    def test_write_fortran_input_error(self):
+        xml_filename = os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.xml')
+        document = PwDocument(source=xml_filename)
+        with open(self.output_file, 'w') as f:
+            f.write('previous content')
+
+        def iter_fortran_input():
+            yield '&CONTROL'
+            raise ValueError("card error")
+
+        try:
+            with unittest.mock.patch.object(document, 'iter_fortran_input',
+                                            iter_fortran_input):
+                with self.assertRaises(ValueError):
+                    document.write_fortran_input(self.output_file)
+
+            with open(self.output_file) as f:
+                self.assertEqual(f.read(), 'previous content')
+            self.assertListEqual(
+                [x for x in os.listdir(os.path.dirname(self.output_file)) if x.endswith('.tmp')],
+                []
+            )
+
+            document.write_fortran_input(self.output_file)
+            with open(self.output_file) as f:
+                self.assertEqual(f.read(), document.get_fortran_input())
+        finally:
+            os.unlink(self.output_file)
+
+    def test_conversion_plan(self):
+        xml_filename = os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.xml')
+        document = PwDocument(source=xml_filename)
+        fortran_input = document.get_fortran_input()
+
+        schema_root = document.schema.elements['espresso']
+        converter = PwInputConverter()
+        plan = get_conversion_plan(schema_root, converter, './input')
+        self.assertIs(get_conversion_plan(schema_root, PwInputConverter(), './input'), plan)
+
+        # Ancestors of converted elements are walked but not converted
+        self.assertIsNone(plan['.'].key)
+        self.assertIsNone(plan['./control_variables'].key)
+        self.assertEqual(plan['./control_variables/title'].key, './control_variables/title')
+        self.assertEqual(plan['./atomic_species'].attributes, {'ntyp': './atomic_species/@ntyp'})
+        self.assertEqual(plan['./atomic_species'].key, './atomic_species/$')
+        self.assertEqual(plan['./atomic_species'].xsd_element.name, 'atomic_species')
+        self.assertNotIn('./atomic_species/species', plan)
+        for path in plan:
+            self.assertTrue(path == '.' or any(k.startswith(path) for k in
+                                               list(converter.invariant_map) +
+                                               list(converter.variant_map)))
+
+        # Elements that are not converted are skipped with their subtree
+        input_root = document.find('./input')
+        input_root.append(ElementTree.Element('unknown_element'))
+        self.assertEqual(document.get_fortran_input(), fortran_input)
+
+    def test_iter_fortran_inputs(self):
+        source = os.path.join(self.test_dir, 'resources/pw/FeO_LDAU_standard.xml')
+        document = PwDocument(source)
+        fortran_input = document.get_fortran_input()
+
+        grid = {'input/basis/ecutwfc': [30, 40.5],
+                './input/k_points_IBZ/monkhorst_pack/@nk1': [2, 4],
+                'input/electron_control/diago_full_acc': [True]}
+        inputs = list(document.iter_fortran_inputs(grid))
+        self.assertEqual(len(inputs), 4)
+        self.assertEqual(inputs[1][0], {'input/basis/ecutwfc': 30,
+                                        './input/k_points_IBZ/monkhorst_pack/@nk1': 4,
+                                        'input/electron_control/diago_full_acc': True})
+
+        for overrides, text in inputs:
+            expected = PwDocument(source)
+            for path, value in overrides.items():
+                elem_path, _, attr_name = path.partition('/@')
+                value = str(value).lower() if isinstance(value, bool) else str(value)
+                if attr_name:
+                    expected.find(elem_path).set(attr_name, value)
+                else:
+                    expected.find(elem_path).text = value
+            self.assertEqual(text, expected.get_fortran_input())
+
+        self.assertIn(' ecutwfc=40.5', inputs[3][1])
+        self.assertIn('K_POINTS automatic\n 4 2 2 0 0 0', inputs[3][1])
+        self.assertEqual(document.get_fortran_input(), fortran_input)
+
+        # The document is consistent while the generator is paused
+        inputs = document.iter_fortran_inputs({'input/basis/ecutwfc': [99.0, 77.0]})
+        self.assertIn(' ecutwfc=99.0', next(inputs)[1])
+        self.assertEqual(document.get_fortran_input(), fortran_input)
+        self.assertIn(' ecutwfc=77.0', next(inputs)[1])
+        self.assertEqual(document.get_fortran_input(), fortran_input)
+        del inputs
+
+        with self.assertRaises(XmlDocumentError):
+            list(document.iter_fortran_inputs({'output/basis_set/ecutwfc': [30]}))
+        with self.assertRaises(XmlDocumentError):
+            list(document.iter_fortran_inputs({'input/basis/unknown': [30]}))
+
+        with self.assertRaises(XMLSchemaValidationError):
+            list(document.iter_fortran_inputs({'input/basis/ecutwfc': ['none']}))
+        self.assertEqual(document.get_fortran_input(), fortran_input)
+
+    def test_path_index(self):
+        source = os.path.join(self.test_dir, 'resources/pw/Ni.xml')
+        document = PwDocument(source)
+        indexed = PwDocument(source, path_index=True)
+
+        paths = ['input', './input/atomic_species/species', '/output//k_point',
+                 './/output//ks_energies/eigenvalues', './/output/forces', './/species',
+                 './/atomic_positions/atom', './/atom', 'output//unknown', '//espresso']
+        for path in paths:
+            self.assertEqual(
+                [e.text for e in indexed.findall(path)], [e.text for e in document.findall(path)]
+            )
+            self.assertIs(indexed.find(path) is None, document.find(path) is None)
+        self.assertEqual(len(list(indexed.iter('species'))), len(list(document.iter('species'))))
+        self.assertEqual(indexed.get_k_points(), document.get_k_points())
+        self.assertEqual(indexed.get_atomic_positions(), document.get_atomic_positions())
+        self.assertTrue(np.array_equal(indexed.get_ks_eigenvalues_array(),
+                                       document.get_ks_eigenvalues_array()))
+
+        # Unsupported paths are delegated to ElementTree
+        for path in ['.//species[@name="Ni"]', './input/*', './output/../input', '.']:
+            self.assertEqual(indexed.findall(path), indexed.root.findall(path))
+
+        # The index is rebuilt when the tree is replaced or after a reset
+        indexed.find('./input').append(ElementTree.Element('unknown_element'))
+        self.assertIsNone(indexed.find('./input/unknown_element'))
+        indexed.clear_path_index()
+        self.assertIsNotNone(indexed.find('./input/unknown_element'))
+        indexed.read(source)
+        self.assertIsNone(indexed.find('./input/unknown_element'))
+
     def test_pw_get_atomic_positions(self):
         source = os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.xml')
         document = PwDocument(source)
@@ -741,6 +1013,47 @@ class TestDocuments(unittest.TestCase):
                 ]
             )
 
+    def test_pw_array_accessors(self):
+        source = os.path.join(self.test_dir, 'resources/pw/Ni.xml')
+        document = PwDocument(source)
+
+        eigenvalues = document.get_ks_eigenvalues_array()
+        self.assertIsInstance(eigenvalues, np.ndarray)
+        self.assertEqual(eigenvalues.shape, (6, 18))
+        self.assertTrue(eigenvalues.flags['C_CONTIGUOUS'])
+        self.assertListEqual(eigenvalues.tolist(), document.get_ks_eigenvalues())
+
+        k_points = document.get_k_points_array()
+        self.assertEqual(k_points.shape, (6, 3))
+        self.assertListEqual(k_points.tolist(), document.get_k_points())
+
+        symbols, positions = document.get_atomic_positions_array()
+        self.assertListEqual(symbols, ['Ni'])
+        self.assertEqual(positions.shape, (1, 3))
+        self.assertListEqual(positions.tolist(), [[0.0, 0.0, 0.0]])
+
+        self.assertIsNone(document.get_stress_array())
+        self.assertIsNone(document.get_forces_array())
+
+        source = os.path.join(self.test_dir, 'resources/pw/Si.xml')
+        document = PwDocument(source)
+        stress = document.get_stress_array()
+        self.assertEqual(stress.shape, (3, 3))
+        self.assertTrue(stress.flags['C_CONTIGUOUS'])
+        self.assertListEqual(stress.tolist(), document.get_stress())
+
+        forces = ElementTree.Element('forces', rank='2', dims='3 2')
+        forces.text = '0.1 0.2 0.3\n-0.1 -0.2 -0.3'
+        document.find('output').append(forces)
+        symbols, forces = document.get_forces_array()
+        self.assertListEqual(symbols, ['Si', 'Si'])
+        self.assertListEqual(forces.tolist(), [[0.1, 0.2, 0.3], [-0.1, -0.2, -0.3]])
+
+        document = PwDocument(os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.xml'))
+        self.assertIsNone(document.get_atomic_positions_array())
+        self.assertEqual(document.get_ks_eigenvalues_array().shape, (0, 0))
+        self.assertEqual(document.get_k_points_array().shape, (0, 3))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,18 +7,274 @@
 # http://opensource.org/licenses/MIT.
 # Authors: Davide Brunato
 #
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 from pathlib import Path
 
 try:
-    import yaml
+    import h5py
 except ImportError:
-    yaml = None
+    h5py = None
 else:
-    from qeschema.hdf5 import read_charge_file, get_wavefunctions, \
-        get_wf_attributes, get_wfc_miller_indices
+    from qeschema.hdf5 import read_charge_file, get_charge_density_grid, get_wavefunctions, \
+        iter_wavefunctions, get_wf_attributes, get_wfc_miller_indices, WfcDataset, \
+        ChargeDensity, open_hdf5_file, clear_hdf5_file_cache
 
+    def write_wfc_file(filename, igwx, nbnd, offset=0):
+        """Writes a small wavefunction file, returning the complex coefficients."""
+        evc = np.arange(nbnd * igwx * 2, dtype=np.float64).reshape(nbnd, 2 * igwx) + offset
+        with h5py.File(filename, 'w') as f:
+            f.attrs['gamma_only'] = b'.FALSE.'
+            f.attrs['igwx'] = igwx
+            f.attrs['nbnd'] = nbnd
+            mill = f.create_dataset('MillerIndices', data=np.full((igwx, 3), offset, np.int32))
+            for k, name in enumerate(('bg1', 'bg2', 'bg3')):
+                mill.attrs[name] = np.eye(3)[k]
+            f.create_dataset('evc', data=evc)
+        return evc[:, ::2] + 1j * evc[:, 1::2]
+
+    class TestWavefunctionReader(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+            cls.tmp_dir = tempfile.mkdtemp()
+            cls.filename = os.path.join(cls.tmp_dir, 'wfc1.hdf5')
+            cls.evc = write_wfc_file(cls.filename, igwx=7, nbnd=4)
+
+        @classmethod
+        def tearDownClass(cls):
+            shutil.rmtree(cls.tmp_dir)
+
+        def test_get_wavefunctions(self):
+            wfc = get_wavefunctions(self.filename)
+            self.assertEqual(wfc.dtype, np.complex128)
+            self.assertEqual(wfc.shape, (4, 7))
+            self.assertTrue(np.array_equal(wfc, self.evc))
+
+            wfc = get_wavefunctions(self.filename, start_band=1, stop_band=3)
+            self.assertTrue(np.array_equal(wfc, self.evc[1:3]))
+            wfc = get_wavefunctions(self.filename, start_band=2, stop_band=2)
+            self.assertTrue(np.array_equal(wfc, self.evc[2:3]))
+            wfc = get_wavefunctions(self.filename, start_pw=2, stop_pw=5)
+            self.assertTrue(np.array_equal(wfc, self.evc[:, 2:5]))
+            wfc = get_wavefunctions(self.filename, start_band=3, start_pw=-2)
+            self.assertTrue(np.array_equal(wfc, self.evc[3:, -2:]))
+
+        def test_output_buffer(self):
+            out = np.zeros((2, 7), dtype=np.complex128)
+            self.assertIs(get_wavefunctions(self.filename, stop_band=2, out=out), out)
+            self.assertTrue(np.array_equal(out, self.evc[:2]))
+
+            with self.assertRaises(ValueError):
+                get_wavefunctions(self.filename, out=out)
+            with self.assertRaises(TypeError):
+                get_wavefunctions(self.filename, out=np.zeros((4, 7), dtype=np.complex64))
+            with self.assertRaises(TypeError):
+                get_wavefunctions(self.filename, out=np.zeros((7, 4), dtype=np.complex128).T)
+
+        def test_iter_wavefunctions(self):
+            blocks = [(band, block.copy()) for band, block in
+                      iter_wavefunctions(self.filename, block_size=3)]
+            self.assertListEqual([band for band, _ in blocks], [0, 3])
+            self.assertTrue(np.array_equal(blocks[0][1], self.evc[:3]))
+            self.assertTrue(np.array_equal(blocks[1][1], self.evc[3:]))
+
+            blocks = list(iter_wavefunctions(self.filename, block_size=2, start_band=1,
+                                             start_pw=1, stop_pw=4))
+            self.assertListEqual([band for band, _ in blocks], [1, 3])
+            self.assertEqual(blocks[0][1].shape, (2, 3))
+            self.assertEqual(blocks[1][1].shape, (1, 3))
+            self.assertTrue(np.shares_memory(blocks[0][1], blocks[1][1]))
+            self.assertTrue(np.array_equal(blocks[1][1], self.evc[3:, 1:4]))
+
+            self.assertListEqual(list(iter_wavefunctions(self.filename, start_band=4)), [])
+            with self.assertRaises(ValueError):
+                list(iter_wavefunctions(self.filename, block_size=0))
+
+        def test_get_wf_attributes(self):
+            attrs = get_wf_attributes(self.filename)
+            self.assertEqual(attrs['igwx'], 7)
+            self.assertEqual(attrs['bg'].dtype, np.float64)
+            self.assertTrue(np.array_equal(attrs['bg'], np.eye(3)))
+
+    class TestChargeDensityGrid(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+            rng = np.random.default_rng(0)
+            cls.rho = rng.random((5, 5, 3))
+            rhog = np.fft.fftn(cls.rho) / cls.rho.size
+            mill = np.stack(np.meshgrid(np.arange(-2, 3), np.arange(-2, 3), np.arange(-1, 2),
+                                        indexing='ij'), axis=-1).reshape(-1, 3)
+            cls.mill = mill
+            cls.rhog = rhog[mill[:, 0], mill[:, 1], mill[:, 2]]
+            cls.tmp_dir = tempfile.mkdtemp()
+
+        @classmethod
+        def tearDownClass(cls):
+            shutil.rmtree(cls.tmp_dir)
+
+        def write_charge_file(self, filename, mill, rhog, gamma_only):
+            with h5py.File(filename, 'w') as f:
+                f.attrs['gamma_only'] = b'.TRUE.' if gamma_only else b'.FALSE.'
+                f.attrs['ngm_g'] = len(mill)
+                f.attrs['nspin'] = 1
+                f.create_dataset('MillerIndices', data=mill)
+                f.create_dataset('rhotot_g', data=np.stack([rhog.real, rhog.imag], -1).ravel())
+
+        def test_full_grid(self):
+            filename = os.path.join(self.tmp_dir, 'charge-density.hdf5')
+            self.write_charge_file(filename, self.mill, self.rhog, gamma_only=False)
+            charge = read_charge_file(filename)
+            self.assertListEqual(charge['nr_min'].tolist(), [5, 5, 3])
+
+            rho = get_charge_density_grid(charge)
+            self.assertEqual(rho.dtype, np.float64)
+            self.assertTrue(np.allclose(rho, self.rho))
+            g0 = np.flatnonzero(~self.mill.any(axis=1))[0]
+            self.assertAlmostEqual(rho.mean(), charge['rhotot_g'][g0].real)
+
+            rho = get_charge_density_grid(filename, dtype=np.float32)
+            self.assertEqual(rho.dtype, np.float32)
+            self.assertTrue(np.allclose(rho, self.rho, atol=1e-6))
+
+            rho = get_charge_density_grid(charge, nr=(10, 10, 6))
+            self.assertEqual(rho.shape, (10, 10, 6))
+            self.assertTrue(np.allclose(rho[::2, ::2, ::2], self.rho))
+
+            with self.assertRaises(ValueError):
+                get_charge_density_grid(charge, nr=(4, 4, 3))
+
+        def test_gamma_only(self):
+            # Keep only the half-space of G-vectors with the first non-zero index positive
+            first = np.array([next((x for x in g if x), 0) for g in self.mill])
+            mask = first >= 0
+            filename = os.path.join(self.tmp_dir, 'charge-density-gamma.hdf5')
+            self.write_charge_file(filename, self.mill[mask], self.rhog[mask], gamma_only=True)
+
+            rho = get_charge_density_grid(read_charge_file(filename))
+            self.assertTrue(np.allclose(rho, self.rho))
+
+    class TestChargeDensity(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+            cls.tmp_dir = tempfile.mkdtemp()
+            cls.filename = os.path.join(cls.tmp_dir, 'charge-density.hdf5')
+            rng = np.random.default_rng(1)
+            cls.mill = rng.integers(-3, 4, (20, 3)).astype(np.int32)
+            cls.rhotot = rng.standard_normal(40)
+            cls.rhodiff = rng.standard_normal(40)
+            with h5py.File(cls.filename, 'w') as f:
+                f.attrs['gamma_only'] = b'.FALSE.'
+                f.attrs['ngm_g'] = 20
+                f.attrs['nspin'] = 2
+                f.create_dataset('MillerIndices', data=cls.mill)
+                f.create_dataset('rhotot_g', data=cls.rhotot)
+                f.create_dataset('rhodiff_g', data=cls.rhodiff)
+
+        @classmethod
+        def tearDownClass(cls):
+            clear_hdf5_file_cache()
+            shutil.rmtree(cls.tmp_dir)
+
+        def test_lazy_access(self):
+            charge = ChargeDensity(self.filename)
+            self.assertEqual(charge.ngm_g, 20)
+            self.assertFalse(charge.gamma_only)
+            self.assertEqual(charge.components, ('rhotot_g', 'rhodiff_g'))
+            self.assertIsInstance(charge.miller_indices, h5py.Dataset)
+            self.assertTrue(np.array_equal(charge.miller_indices[5:8], self.mill[5:8]))
+
+            data = read_charge_file(self.filename)
+            self.assertTrue(np.array_equal(charge.nr_min, data['nr_min']))
+            self.assertTrue(np.array_equal(charge.get_component(), data['rhotot_g']))
+            self.assertTrue(np.array_equal(charge.get_component('rhodiff_g', stop=5),
+                                           data['rhodiff_g'][:5]))
+            self.assertTrue(np.array_equal(charge.get_component(indices=[7, 2, 9]),
+                                           data['rhotot_g'][[7, 2, 9]]))
+            self.assertEqual(charge.get_component(start=10, stop=10).shape, (0,))
+            self.assertTrue(np.array_equal(charge.get_component(indices=[-1]),
+                                           data['rhotot_g'][[-1]]))
+            self.assertTrue(np.array_equal(charge.get_component(indices=[2, -1, -20]),
+                                           data['rhotot_g'][[2, -1, -20]]))
+            with self.assertRaises(IndexError):
+                charge.get_component(indices=[20])
+            with self.assertRaises(IndexError):
+                charge.get_component(indices=[0, -21])
+            self.assertTrue(np.allclose(charge.get_grid(), get_charge_density_grid(data)))
+
+            with self.assertRaises(ValueError):
+                charge.get_component('rho')
+
+        def test_file_cache(self):
+            clear_hdf5_file_cache()
+            h5f = open_hdf5_file(self.filename)
+            self.assertIs(open_hdf5_file(self.filename), h5f)
+            self.assertIs(ChargeDensity(self.filename).file, h5f)
+            clear_hdf5_file_cache()
+            self.assertFalse(h5f.id.valid)
+            self.assertIsNot(open_hdf5_file(self.filename), h5f)
+
+    class TestWfcDataset(unittest.TestCase):
+
+        @classmethod
+        def setUpClass(cls):
+            cls.tmp_dir = tempfile.mkdtemp()
+            cls.evc = {}
+            for k in (1, 2, 10):
+                filename = os.path.join(cls.tmp_dir, 'wfc%d.hdf5' % k)
+                cls.evc[k] = write_wfc_file(filename, igwx=5, nbnd=3, offset=k)
+            with open(os.path.join(cls.tmp_dir, 'charge-density.hdf5'), 'w'):
+                pass
+
+        @classmethod
+        def tearDownClass(cls):
+            shutil.rmtree(cls.tmp_dir)
+
+        def test_discovery(self):
+            dataset = WfcDataset(self.tmp_dir)
+            self.assertEqual(len(dataset), 3)
+            self.assertListEqual([os.path.basename(x) for x in dataset.filenames],
+                                 ['wfc1.hdf5', 'wfc2.hdf5', 'wfc10.hdf5'])
+            with self.assertRaises(FileNotFoundError):
+                WfcDataset(os.path.join(self.tmp_dir, 'missing'))
+
+        def test_lazy_indexing(self):
+            dataset = WfcDataset(self.tmp_dir)
+            self.assertTrue(np.array_equal(dataset[0], self.evc[1]))
+            self.assertTrue(np.array_equal(dataset[2, 1], self.evc[10][1]))
+            self.assertTrue(np.array_equal(dataset[-1, -1], self.evc[10][2]))
+            self.assertTrue(np.array_equal(dataset[1, 1:], self.evc[2][1:]))
+            self.assertTrue(np.array_equal(dataset[1, ::-2], self.evc[2][::-2]))
+            self.assertEqual(dataset[1, 2:1].shape, (0, 5))
+
+            with self.assertRaises(IndexError):
+                dataset[3]
+            with self.assertRaises(IndexError):
+                dataset[0, 3]
+
+            miller_indices = dataset.get_miller_indices(2)
+            self.assertTrue(np.all(miller_indices == 10))
+            self.assertIs(dataset.get_miller_indices(-1), miller_indices)
+
+        def test_load(self):
+            for use_processes in (False, True):
+                dataset = WfcDataset(self.tmp_dir, max_workers=2, use_processes=use_processes)
+                wavefunctions = dataset.load(start_band=1)
+                self.assertListEqual(sorted(wavefunctions), [0, 1, 2])
+                self.assertTrue(np.array_equal(wavefunctions[1], self.evc[2][1:]))
+                self.assertTrue(np.shares_memory(dataset[1, 1:], wavefunctions[1]))
+                self.assertTrue(np.array_equal(dataset[1, 0], self.evc[2][0]))
+                self.assertTrue(np.all(dataset.get_miller_indices(1) == 2))
+
+            dataset = WfcDataset(self.tmp_dir)
+            self.assertListEqual(list(dataset.load(kpoints=[-1])), [2])
+            dataset.clear()
+            self.assertTrue(np.array_equal(dataset[2], self.evc[10]))
 
     # TODO: Fetch appropriate HDF5 files for testing
 
@@ -28,6 +284,25 @@ else:
         def test_read_charge_file(self):
             hdf5_file = Path(__file__).parent.joinpath('resources/hdf5/???')
 
+        def test_iter_wavefunctions(self):
+            blocks = [(band, block.copy()) for band, block in
+                      iter_wavefunctions(self.filename, block_size=3)]
+            self.assertListEqual([band for band, _ in blocks], [0, 3])
+            self.assertTrue(np.array_equal(blocks[0][1], self.evc[:3]))
+            self.assertTrue(np.array_equal(blocks[1][1], self.evc[3:]))
+
+            blocks = list(iter_wavefunctions(self.filename, block_size=2, start_band=1,
+                                             start_pw=1, stop_pw=4))
+            self.assertListEqual([band for band, _ in blocks], [1, 3])
+            self.assertEqual(blocks[0][1].shape, (2, 3))
+            self.assertEqual(blocks[1][1].shape, (1, 3))
+            self.assertTrue(np.shares_memory(blocks[0][1], blocks[1][1]))
+            self.assertTrue(np.array_equal(blocks[1][1], self.evc[3:, 1:4]))
+
+            self.assertListEqual(list(iter_wavefunctions(self.filename, start_band=4)), [])
+            with self.assertRaises(ValueError):
+                list(iter_wavefunctions(self.filename, block_size=0))
+
         def test_get_wf_attributes(self):
             hdf5_file = Path(__file__).parent.joinpath('resources/hdf5/???')
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+import os
+import subprocess
+import sys
+import unittest
+
+import qeschema
+
+
+class TestPackage(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pkg_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def run_python(self, code):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=self.pkg_folder)
+        return output.decode().strip()
+
+    def test_lazy_import(self):
+        code = "import sys, qeschema; " \
+               "print(','.join(m for m in ('xmlschema', 'numpy', 'h5py', 'yaml', " \
+               "'qeschema.documents', 'qeschema.converters') if m in sys.modules))"
+        self.assertEqual(self.run_python(code), '')
+
+        code = "import sys, qeschema; qeschema.XmlDocumentError; " \
+               "print('xmlschema' in sys.modules)"
+        self.assertEqual(self.run_python(code), 'False')
+
+        code = "import sys, qeschema; qeschema.PwDocument; " \
+               "print('xmlschema' in sys.modules, 'h5py' in sys.modules, 'yaml' in sys.modules)"
+        self.assertEqual(self.run_python(code), 'True False False')
+
+    def test_package_api(self):
+        from qeschema.documents import PwDocument
+        from qeschema.utils import set_logger
+
+        self.assertIs(qeschema.PwDocument, PwDocument)
+        self.assertIs(qeschema.set_logger, set_logger)
+        for name in qeschema.__all__:
+            if name != 'hdf5':
+                self.assertTrue(hasattr(qeschema, name), name)
+            self.assertIn(name, dir(qeschema))
+
+        with self.assertRaises(AttributeError):
+            getattr(qeschema, 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+import unittest
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from qeschema import upf
+from qeschema.pseudos import PseudoInfo, PseudoLibrary, get_functional_name
+
+UPF_FILE = str(Path(__file__).parent.joinpath('resources/upf/N.pz-vbc.UPF'))
+
+UPF_V1_HEADER = """<PP_INFO>
+Generated using FHI98PP
+</PP_INFO>
+<PP_HEADER>
+   0                   Version Number
+  Fe                   Element
+   US                  Ultrasoft pseudopotential
+    T                  Nonlinear Core Correction
+ SLA  PW   PBX  PBC    PBE  Exchange-Correlation functional
+   16.00000000000      Z valence
+  -85.44567480602      Total energy
+   45.00000   360.00000 Suggested cutoff for wfc and rho
+    2                  Max angular momentum component
+  861                  Number of points in mesh
+    3    6             Number of Wavefunctions, Number of Projectors
+</PP_HEADER>
+<PP_MESH>
+  <PP_R>
+  1.0 2.0
+  </PP_R>
+</PP_MESH>
+"""
+
+
+class TestPseudoLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pseudo_dir = os.path.join(self.tmp_dir, 'pseudo')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(self.pseudo_dir)
+        shutil.copy(UPF_FILE, self.pseudo_dir)
+        with open(os.path.join(self.pseudo_dir, 'Fe.pbe-nd-rrkjus.upf'), 'w') as f:
+            f.write(UPF_V1_HEADER)
+        with open(os.path.join(self.pseudo_dir, 'README'), 'w') as f:
+            f.write('not a pseudo-potential\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_v1_header(self):
+        header = upf.read_pseudo_header(os.path.join(self.pseudo_dir, 'Fe.pbe-nd-rrkjus.upf'))
+        self.assertEqual(header['element'], 'Fe')
+        self.assertEqual(header['functional'], 'SLA  PW   PBX  PBC')
+        self.assertEqual(header['z_valence'], '16.00000000000')
+        self.assertEqual(header['wfc_cutoff'], '45.00000')
+        self.assertEqual(header['rho_cutoff'], '360.00000')
+        self.assertEqual(header['mesh_size'], '861')
+
+    def test_functional_names(self):
+        self.assertEqual(get_functional_name(' SLA  PW   PBX  PBC'), 'PBE')
+        self.assertEqual(get_functional_name('SLA-PZ-NOGX-NOGC'), 'PZ')
+        self.assertEqual(get_functional_name('pbe'), 'PBE')
+        self.assertEqual(get_functional_name('sla pw  tpss tpss'), 'SLA PW TPSS TPSS')
+
+    def test_index(self):
+        library = PseudoLibrary(self.pseudo_dir)
+        self.assertEqual(len(library), 2)
+        self.assertEqual([x.filename for x in library],
+                         ['Fe.pbe-nd-rrkjus.upf', 'N.pz-vbc.UPF'])
+        self.assertEqual(library['N.pz-vbc.UPF'], PseudoInfo(
+            'N.pz-vbc.UPF', 'N', 'PZ', 5.0, 60.0, 240.0, 'NC', 'no', 161
+        ))
+
+        self.assertEqual([x.filename for x in library.find('fe', 'PBE')],
+                         ['Fe.pbe-nd-rrkjus.upf'])
+        self.assertEqual([x.filename for x in library.find(functional='SLA PZ NOGX NOGC')],
+                         ['N.pz-vbc.UPF'])
+        self.assertEqual(library.find('Fe', 'PZ'), [])
+        self.assertEqual(len(library.find(pseudo_type='us')), 1)
+        with self.assertRaises(TypeError):
+            library.find(color='red')
+
+    def test_scan(self):
+        library = PseudoLibrary(self.pseudo_dir)
+        self.assertEqual(library.scan(), 0)
+
+        os.unlink(os.path.join(self.pseudo_dir, 'Fe.pbe-nd-rrkjus.upf'))
+        shutil.copy(UPF_FILE, os.path.join(self.pseudo_dir, 'N2.UPF'))
+        self.assertEqual(library.scan(), 1)
+        self.assertEqual([x.filename for x in library.find('N')], ['N.pz-vbc.UPF', 'N2.UPF'])
+        self.assertNotIn('Fe.pbe-nd-rrkjus.upf', library)
+
+    def test_persistent_index(self):
+        library = PseudoLibrary(self.pseudo_dir, self.cache_dir)
+        self.assertTrue(os.path.isfile(library.index_filename))
+
+        with mock.patch('qeschema.pseudos.read_pseudo_header') as read_header:
+            library = PseudoLibrary(self.pseudo_dir, self.cache_dir)
+            read_header.assert_not_called()
+        self.assertEqual(library.find('N')[0].mesh_size, 161)
+
+    def test_load(self):
+        library = PseudoLibrary(self.pseudo_dir, self.cache_dir)
+        pseudo = library.load('N.pz-vbc.UPF')
+        self.assertIs(library.load(library['N.pz-vbc.UPF']), pseudo)
+        self.assertTrue(os.path.isfile(
+            library.get_store_filename(library.get_digest('N.pz-vbc.UPF'))
+        ))
+
+        library = PseudoLibrary(self.pseudo_dir, self.cache_dir)
+        with mock.patch('qeschema.pseudos.read_pseudo_file') as read_file:
+            stored = library.load('N.pz-vbc.UPF')
+            read_file.assert_not_called()
+
+        self.assertEqual(stored['PP_HEADER'], pseudo['PP_HEADER'])
+        self.assertEqual(stored['PP_INFO'], pseudo['PP_INFO'])
+        self.assertIsNone(stored['PP_NONLOCAL']['PP_AUGMENTATION'])
+        self.assertTrue(np.array_equal(stored['PP_MESH']['PP_R'], pseudo['PP_MESH']['PP_R']))
+        self.assertTrue(np.array_equal(stored['PP_NONLOCAL']['PP_BETA'][0]['beta'],
+                                       pseudo['PP_NONLOCAL']['PP_BETA'][0]['beta']))
+
+        with self.assertRaises(KeyError):
+            library.load('Si.UPF')
+
+        # Stores of other formats are not loaded
+        with mock.patch('qeschema.pseudos.STORE_VERSION', 0):
+            library = PseudoLibrary(self.pseudo_dir, self.cache_dir)
+            with mock.patch('qeschema.pseudos.read_pseudo_file',
+                            side_effect=upf.read_pseudo_file) as read_file:
+                library.load('N.pz-vbc.UPF')
+                read_file.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Copyright (c), 2015-2022, Quantum Espresso Foundation and SISSA (Scuola
+# Internazionale Superiore di Studi Avanzati). All rights reserved.
+# This file is distributed under the terms of the MIT License. See the
+# file 'LICENSE' in the root directory of the present distribution, or
+# http://opensource.org/licenses/MIT.
+# Authors: Davide Brunato
+#
+import os
+import shutil
+import tempfile
+import unittest
+from xmlschema import XMLSchema
+
+from qeschema import PwDocument, NebDocument, clear_schema_cache, schema_cache_info
+from qeschema.documents import SCHEMAS_DIR
+from qeschema.schema_cache import SchemaCache, SchemaCacheInfo, SchemaStore, \
+    schema_cache, get_schema, get_default_store_dir, find_xsd_element
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.schema_file = os.path.join(cls.test_dir, 'resources/dummy/schema.xsd')
+
+    def setUp(self):
+        clear_schema_cache()
+
+    def test_cache_info(self):
+        self.assertEqual(schema_cache_info(), SchemaCacheInfo(0, 0, schema_cache.maxsize, 0))
+
+        schema = get_schema(self.schema_file)
+        self.assertIsInstance(schema, XMLSchema)
+        self.assertEqual(schema_cache_info().misses, 1)
+        self.assertIs(get_schema(self.schema_file), schema)
+        self.assertEqual(schema_cache_info(), SchemaCacheInfo(1, 1, schema_cache.maxsize, 1))
+
+        clear_schema_cache()
+        self.assertEqual(schema_cache_info(), SchemaCacheInfo(0, 0, schema_cache.maxsize, 0))
+        self.assertIsNot(get_schema(self.schema_file), schema)
+
+    def test_shared_schemas(self):
+        document = PwDocument()
+        self.assertIs(PwDocument().schema, document.schema)
+        self.assertIsNot(NebDocument().schema, document.schema)
+        self.assertEqual(schema_cache_info().hits, 1)
+        self.assertEqual(schema_cache_info().misses, 2)
+
+        source = os.path.join(self.test_dir, 'resources/pw/Al001_relax_bfgs.xml')
+        self.assertIs(PwDocument(source).schema, PwDocument(source).schema)
+
+    def test_uncached_sources(self):
+        with open(self.schema_file) as f:
+            schema_text = f.read()
+        self.assertIsNot(get_schema(schema_text), get_schema(schema_text))
+        self.assertEqual(schema_cache_info().currsize, 0)
+
+    def test_bounded_size(self):
+        cache = SchemaCache(maxsize=1)
+        schemas_dir = os.path.join(os.path.dirname(self.test_dir), 'qeschema/schemas')
+        cache.get_schema(os.path.join(schemas_dir, 'qes_spectrum.xsd'))
+        cache.get_schema(self.schema_file)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(self.schema_file, cache)
+
+        with self.assertRaises(ValueError):
+            SchemaCache(maxsize=0)
+
+    def test_changed_schema_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, 'schema.xsd')
+            shutil.copy(self.schema_file, filename)
+
+            cache = SchemaCache()
+            schema = cache.get_schema(filename)
+            self.assertIs(cache.get_schema(filename), schema)
+
+            stat = os.stat(filename)
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNot(cache.get_schema(filename), schema)
+            self.assertEqual(cache.info(), SchemaCacheInfo(1, 2, cache.maxsize, 1))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_changed_imported_schema_file(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name in ('qes.xsd', 'qes_neb.xsd'):
+                shutil.copy(os.path.join(SCHEMAS_DIR, name), tmp_dir)
+            filename = os.path.join(tmp_dir, 'qes_neb.xsd')
+
+            cache = SchemaCache()
+            schema = cache.get_schema(filename)
+            self.assertIs(cache.get_schema(filename), schema)
+
+            imported_file = os.path.join(tmp_dir, 'qes.xsd')
+            stat = os.stat(imported_file)
+            os.utime(imported_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNot(cache.get_schema(filename), schema)
+            self.assertEqual(cache.info(), SchemaCacheInfo(1, 2, cache.maxsize, 1))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_find_xsd_element(self):
+        schema = PwDocument().schema
+        path = './/output//etot'
+        xsd_element = find_xsd_element(schema, path)
+        self.assertIs(xsd_element, schema.find(path))
+        self.assertIs(find_xsd_element(schema, path), xsd_element)
+        self.assertIsNone(find_xsd_element(schema, './/output//missing'))
+
+        schema_root = schema.elements['espresso']
+        self.assertIs(find_xsd_element(schema_root, './input/control_variables'),
+                      schema_root.find('./input/control_variables'))
+
+
+class TestSchemaStore(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.schema_file = os.path.join(cls.test_dir, 'resources/dummy/schema.xsd')
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_store_dir(self):
+        environ = os.environ.copy()
+        try:
+            os.environ['QESCHEMA_CACHE_DIR'] = self.tmp_dir
+            self.assertEqual(get_default_store_dir(), self.tmp_dir)
+            self.assertEqual(SchemaStore().directory, self.tmp_dir)
+
+            del os.environ['QESCHEMA_CACHE_DIR']
+            os.environ['XDG_CACHE_HOME'] = self.tmp_dir
+            self.assertEqual(get_default_store_dir(), os.path.join(self.tmp_dir, 'qeschema'))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_store_and_load(self):
+        store = SchemaStore(self.tmp_dir)
+        self.assertTrue(store.enabled)
+        self.assertIsNone(store.load(self.schema_file))
+
+        schema = XMLSchema(self.schema_file)
+        self.assertTrue(store.save(self.schema_file, schema))
+        self.assertTrue(os.path.isfile(store.get_store_filename(self.schema_file)))
+
+        stored_schema = store.load(self.schema_file)
+        self.assertIsInstance(stored_schema, XMLSchema)
+        self.assertIsNot(stored_schema, schema)
+        filename = os.path.join(self.test_dir, 'resources/dummy/instance.xml')
+        self.assertTrue(stored_schema.is_valid(filename))
+
+        store.clear()
+        self.assertIsNone(store.load(self.schema_file))
+        self.assertFalse(SchemaStore(os.path.join(self.tmp_dir, 'missing')).enabled)
+
+    def test_outdated_schema(self):
+        filename = os.path.join(self.tmp_dir, 'schema.xsd')
+        shutil.copy(self.schema_file, filename)
+
+        store = SchemaStore(self.tmp_dir)
+        store.save(filename, XMLSchema(filename))
+        self.assertIsNotNone(store.load(filename))
+
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(store.load(filename))
+
+    def test_cache_with_store(self):
+        cache = SchemaCache(store=SchemaStore(self.tmp_dir))
+        schema = cache.get_schema(self.schema_file)
+        self.assertIsNotNone(cache.store.load(self.schema_file))
+
+        cache.clear()
+        stored_schema = cache.get_schema(self.schema_file)
+        self.assertIsNot(stored_schema, schema)
+        self.assertIs(cache.get_schema(self.schema_file), stored_schema)
+        self.assertEqual(cache.info().misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,10 +8,52 @@
 # Authors: Davide Brunato
 #
 import unittest
+import os
+import tempfile
 import numpy as np
 from pathlib import Path
+from unittest import mock
 
-from qeschema.upf import read_pseudo_file
+from qeschema import upf
+from qeschema.upf import read_pseudo_file, read_pseudo_header
+
+UPF_SCHEMA_FILE = """<?xml version="1.0" encoding="UTF-8"?>
+<qe_pp:pseudo xmlns:qe_pp="http://www.quantum-espresso.org/ns/qes/qe_pp-1.0">
+  <pp_info>Synthetic PAW pseudo-potential
+    <pp_inputfile>&input title='Si' /</pp_inputfile>
+  </pp_info>
+  <pp_header>
+    <element>Si</element>
+    <pseudo_type>PAW</pseudo_type>
+    <functional>PBE</functional>
+    <z_valence>4.0</z_valence>
+    <mesh_size>4</mesh_size>
+  </pp_header>
+  <pp_mesh mesh="4">
+    <pp_r>0.1 0.2 0.3 0.4</pp_r>
+    <pp_rab>0.01 0.01 0.01 0.01</pp_rab>
+  </pp_mesh>
+  <pp_local>-1.0 -2.0 -3.0 -4.0</pp_local>
+  <pp_nonlocal>
+    <pp_beta index="1" angular_momentum="0">1.0 2.0 3.0 4.0</pp_beta>
+    <pp_beta index="2" angular_momentum="1">5.0 6.0 7.0 8.0</pp_beta>
+    <pp_dij>1.0 0.0 0.0 1.0</pp_dij>
+    <pp_augmentation q_with_l="true">
+      <pp_q>0.5 0.0 0.0 0.5</pp_q>
+      <pp_qijl first_index="1" second_index="1" angular_momentum="0">1 1 1 1</pp_qijl>
+    </pp_augmentation>
+  </pp_nonlocal>
+  <pp_full_wfc number_of_wfc="1">
+    <pp_aewfc index="1" label="3S">0.1 0.2 0.3 0.4</pp_aewfc>
+    <pp_pswfc index="1" label="3S">0.5 0.6 0.7 0.8</pp_pswfc>
+  </pp_full_wfc>
+  <pp_rhoatom>4.0 3.0 2.0 1.0</pp_rhoatom>
+  <pp_paw paw_data_format="2">
+    <pp_occupations>2.0 2.0</pp_occupations>
+    <pp_ae_nlcc>9.0 8.0 7.0 6.0</pp_ae_nlcc>
+  </pp_paw>
+</qe_pp:pseudo>
+"""
 
 
 class TestUpfUtils(unittest.TestCase):
@@ -21,8 +63,8 @@ class TestUpfUtils(unittest.TestCase):
 
         obj = read_pseudo_file(str(upf_file))
         self.assertIsInstance(obj, dict)
-        self.assertListEqual(list(obj), ['PP_INFO', 'PP_HEADER', 'PP_MESH',
-                                         'PP_LOCAL', 'PP_RHOATOM', 'PP_NONLOCAL'])
+        self.assertListEqual(list(obj), ['PP_INFO', 'PP_HEADER', 'PP_MESH', 'PP_LOCAL',
+                                         'PP_RHOATOM', 'PP_NONLOCAL', 'PP_PSWFC'])
 
         self.assertIsInstance(obj['PP_INFO'], dict)
         self.assertIsInstance(obj['PP_HEADER'], dict)
@@ -32,6 +74,128 @@ class TestUpfUtils(unittest.TestCase):
         self.assertIsInstance(obj['PP_RHOATOM'], np.ndarray)
         self.assertIsInstance(obj['PP_NONLOCAL'], dict)
 
+        mesh_size = int(obj['PP_HEADER']['mesh_size'])
+        for array in (obj['PP_MESH']['PP_R'], obj['PP_MESH']['PP_RAB'],
+                      obj['PP_LOCAL'], obj['PP_RHOATOM'],
+                      obj['PP_NONLOCAL']['PP_BETA'][0]['beta']):
+            self.assertEqual(array.dtype, np.float64)
+            self.assertEqual(array.shape, (mesh_size,))
+        self.assertEqual(obj['PP_MESH']['PP_R'][-1], 57.6326847847)
+        self.assertListEqual(obj['PP_NONLOCAL']['PP_DIJ'].tolist(), [0.7381333001930001])
+        self.assertEqual([x['label'] for x in obj['PP_PSWFC']['PP_CHI']], ['2S', '2P'])
+        self.assertEqual(obj['PP_PSWFC']['PP_CHI'][1]['chi'].shape, (mesh_size,))
+
+        # Parsing doesn't depend on how the file is fed to the parser
+        with mock.patch.object(upf, 'FEED_LINES', 7):
+            other = read_pseudo_file(str(upf_file))
+        self.assertTrue(np.array_equal(other['PP_RHOATOM'], obj['PP_RHOATOM']))
+        self.assertEqual(other['PP_HEADER'], obj['PP_HEADER'])
+
+    def test_read_v1_pseudo_file(self):
+        upf_file = str(Path(__file__).parent.joinpath('resources/upf/N.pz-vbc.v1.UPF'))
+        obj = read_pseudo_file(upf_file)
+        other = read_pseudo_file(upf_file.replace('.v1', ''))
+        self.assertListEqual(list(obj), list(other))
+        self.assertEqual(obj['PP_HEADER']['mesh_size'], '161')
+        self.assertTrue(np.allclose(obj['PP_LOCAL'], other['PP_LOCAL']))
+
+        beta = obj['PP_NONLOCAL']['PP_BETA'][0]
+        self.assertEqual(beta['index'], '1')
+        self.assertEqual(beta['angular_momentum'], '0')
+        self.assertEqual(beta['cutoff_radius_index'], '133')
+        self.assertTrue(np.allclose(beta['beta'],
+                                    other['PP_NONLOCAL']['PP_BETA'][0]['beta'][:133]))
+        self.assertTrue(np.allclose(obj['PP_NONLOCAL']['PP_DIJ'],
+                                    other['PP_NONLOCAL']['PP_DIJ']))
+
+        chis = obj['PP_PSWFC']['PP_CHI']
+        self.assertEqual([(x['index'], x['label'], x['l']) for x in chis],
+                         [('1', '2S', '0'), ('2', '2P', '1')])
+        for chi, other_chi in zip(chis, other['PP_PSWFC']['PP_CHI']):
+            self.assertTrue(np.allclose(chi['chi'], other_chi['chi']))
+
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, 'N.v1.upf')
+            with open(upf_file) as f:
+                text = f.read()
+            with open(filename, 'w') as f:
+                f.write(text.replace(
+                    '<PP_NONLOCAL>\n  <PP_BETA>\n    1    0             Beta    L\n',
+                    '<PP_NONLOCAL>\n  <PP_BETA>\n    2    1             Beta    L\n'
+                ).replace(
+                    '    1                  Number of nonzero Dij\n    1    1',
+                    '    1                  Number of nonzero Dij\n    1    2',
+                ))
+                f.write('<PP_ADDINFO>\n  2S  1  0  0.50  2.00000000000\n</PP_ADDINFO>\n')
+
+            obj = read_pseudo_file(filename)
+            self.assertEqual(obj['PP_NONLOCAL']['PP_BETA'][0]['angular_momentum'], '1')
+            self.assertEqual(obj['PP_NONLOCAL']['PP_DIJ'].tolist(),
+                             [0.0, 0.738133300193, 0.738133300193, 0.0])
+            self.assertEqual(obj['PP_ADDINFO'].split(), ['2S', '1', '0', '0.50', '2.00000000000'])
+
+    def test_read_pseudo_header(self):
+        upf_file = str(Path(__file__).parent.joinpath('resources/upf/N.pz-vbc.UPF'))
+        header = read_pseudo_header(upf_file)
+        self.assertEqual(header, read_pseudo_file(upf_file)['PP_HEADER'])
+        self.assertEqual(header['element'], 'N ')
+        self.assertEqual(header['mesh_size'], '161')
+
+        # Fallback to the incremental parsing when the header is not found by the scan
+        with mock.patch.object(upf, 'HEADER_SCAN_LIMIT', 100), \
+                mock.patch.object(upf, 'HEADER_CHUNK_SIZE', 64):
+            self.assertIsNone(upf.find_header_text(upf_file))
+            self.assertEqual(read_pseudo_header(upf_file), header)
+        with mock.patch.object(upf, 'HEADER_CHUNK_SIZE', 64):
+            self.assertEqual(read_pseudo_header(upf_file), header)
+
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, 'empty.upf')
+            with open(filename, 'w') as f:
+                f.write('<UPF version="2.0.1">\n<PP_INFO>\n</PP_INFO>\n</UPF>\n')
+            with self.assertRaises(ValueError):
+                read_pseudo_header(filename)
+
+            # Multibyte characters split between chunks
+            filename = os.path.join(dirname, 'author.upf')
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('<UPF version="2.0.1">\n<PP_HEADER author="%s" element="Si"/>\n'
+                        '</UPF>\n' % ('\u00e9' * 100))
+            with mock.patch.object(upf, 'HEADER_CHUNK_SIZE', 63):
+                self.assertEqual(read_pseudo_header(filename)['author'], '\u00e9' * 100)
+
+    def test_read_upf_schema_file(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            filename = os.path.join(dirname, 'Si.paw.upf')
+            with open(filename, 'w') as f:
+                f.write(UPF_SCHEMA_FILE)
+
+            header = read_pseudo_header(filename)
+            obj = read_pseudo_file(filename)
+
+        self.assertEqual(header['element'], 'Si')
+        self.assertEqual(obj['PP_HEADER'], header)
+        self.assertEqual(header['z_valence'], '4.0')
+        self.assertEqual(obj['PP_INFO']['PP_INPUT'], "&input title='Si' /")
+        self.assertListEqual(obj['PP_MESH']['PP_R'].tolist(), [0.1, 0.2, 0.3, 0.4])
+        self.assertListEqual(obj['PP_LOCAL'].tolist(), [-1.0, -2.0, -3.0, -4.0])
+
+        pp_nonlocal = obj['PP_NONLOCAL']
+        self.assertEqual([x['angular_momentum'] for x in pp_nonlocal['PP_BETA']], ['0', '1'])
+        self.assertListEqual(pp_nonlocal['PP_BETA'][1]['beta'].tolist(), [5.0, 6.0, 7.0, 8.0])
+        self.assertListEqual(pp_nonlocal['PP_DIJ'].tolist(), [1.0, 0.0, 0.0, 1.0])
+        self.assertListEqual(pp_nonlocal['PP_AUGMENTATION']['PP_Q'].tolist(),
+                             [0.5, 0.0, 0.0, 0.5])
+        self.assertEqual(len(pp_nonlocal['PP_AUGMENTATION']['PP_QIJL']), 1)
+
+        self.assertEqual(obj['PP_FULL_WFC']['number_of_wfc'], '1')
+        self.assertListEqual(obj['PP_FULL_WFC']['PP_AEWFC'][0]['aewfc'].tolist(),
+                             [0.1, 0.2, 0.3, 0.4])
+        self.assertEqual(obj['PP_FULL_WFC']['PP_PSWFC'][0]['label'], '3S')
+        self.assertListEqual(obj['PP_PAW']['PP_OCCUPATIONS'].tolist(), [2.0, 2.0])
+        self.assertListEqual(obj['PP_PAW']['PP_AE_NLCC'].tolist(), [9.0, 8.0, 7.0, 6.0])
+        self.assertEqual(obj['PP_PAW']['paw_data_format'], '2')
+
 
 if __name__ == '__main__':
     unittest.main()
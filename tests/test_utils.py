@@ -13,8 +13,10 @@ import logging
 import sys
 from types import MethodType
 from xml.etree import ElementTree
+import numpy as np
 
-from qeschema.utils import set_logger, etree_iter_path, to_fortran, BiunivocalMap
+from qeschema.utils import set_logger, etree_iter_path, to_fortran, \
+    text_to_array, BiunivocalMap
 
 
 class TestHelperFunctions(unittest.TestCase):
@@ -100,6 +102,20 @@ class TestHelperFunctions(unittest.TestCase):
         self.assertEqual(to_fortran(10), '10')
         self.assertEqual(to_fortran(999.1), '999.1')
 
+    def test_text_to_array(self):
+        array = text_to_array(' 1.0  -2.5E-001\n 3 ')
+        self.assertIsInstance(array, np.ndarray)
+        self.assertEqual(array.dtype, np.float64)
+        self.assertListEqual(array.tolist(), [1.0, -0.25, 3.0])
+        self.assertListEqual(text_to_array('1 2\n3', dtype=int).tolist(), [1, 2, 3])
+
+        self.assertEqual(text_to_array(None).shape, (0,))
+        self.assertEqual(text_to_array('').shape, (0,))
+        self.assertEqual(text_to_array(' \n ').shape, (0,))
+
+        with self.assertRaises(ValueError):
+            text_to_array('1.0 a')
+
 
 class TestBiunivocalMap(unittest.TestCase):
 